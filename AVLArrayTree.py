@@ -0,0 +1,782 @@
+"""An array backed (struct-of-arrays) AVL tree, with the same dictionary API as AVLTree.
+
+Nodes are indices into parallel buffers (keys, heights, sizes, left/right/parent links)
+instead of AVLNode objects, so a tree of n keys is a handful of flat arrays plus one list
+of values: no per-node objects for the garbage collector to walk. Index 0 is the virtual
+node, and deleted slots are chained in a free list and reused by the next insert.
+Keys must be integers that fit in 64 bits.
+"""
+from array import array
+
+
+"""A class holding the buffers of the nodes of one or more AVLArrayTree
+(the trees returned by split, and the trees joined together, share their store).
+"""
+
+class AVLArrayStore(object):
+
+	def __init__(self):
+		# slot 0 is the virtual node: height -1, size 0, no links
+		self.keys = array("q", [0])
+		self.heights = array("b", [-1])
+		self.sizes = array("i", [0])
+		self.lefts = array("i", [0])
+		self.rights = array("i", [0])
+		self.parents = array("i", [0])
+		self.values = [None]
+		self.free = 0  # head of the free list, chained through lefts
+
+	"""returns a slot for a new leaf, reusing a deleted slot when there is one
+	@rtype: int
+	@returns: the index of the new node
+	complexity: O(1) amortized
+	"""
+	def new_node(self, key, val):
+		i = self.free
+		if i:
+			self.free = self.lefts[i]
+			self.keys[i] = key
+			self.heights[i] = 0
+			self.sizes[i] = 1
+			self.lefts[i] = 0
+			self.rights[i] = 0
+			self.parents[i] = 0
+			self.values[i] = val
+			return i
+		self.keys.append(key)
+		self.heights.append(0)
+		self.sizes.append(1)
+		self.lefts.append(0)
+		self.rights.append(0)
+		self.parents.append(0)
+		self.values.append(val)
+		return len(self.keys) - 1
+
+	"""puts a slot that is no longer in any tree on the free list
+	@type i: int
+	@param i: the index of the node
+	complexity: O(1)
+	"""
+	def free_node(self, i):
+		self.values[i] = None
+		self.heights[i] = -1
+		self.sizes[i] = 0
+		self.rights[i] = 0
+		self.parents[i] = 0
+		self.lefts[i] = self.free
+		self.free = i
+
+
+"""
+A class implementing an AVL tree over an AVLArrayStore.
+Nodes are returned as int indices (None where AVLTree returns None); use get_key / get_value on them.
+"""
+
+class AVLArrayTree(object):
+
+	"""
+	Constructor.
+	@type store: AVLArrayStore
+	@param store: the buffers to allocate the nodes in, a new store if None
+	"""
+	def __init__(self, store=None):
+		self.store = store if store is not None else AVLArrayStore()
+		self.root = 0
+		self.min = 0
+		self.max = 0
+
+	"""builds a dictionary from (key, value) pairs sorted by key, without rebalancing
+	@type items: iterable
+	@param items: (key, value) pairs in increasing key order, for equal keys the last value is kept
+	@type store: AVLArrayStore
+	@param store: the buffers to allocate the nodes in, a new store if None
+	@rtype: AVLArrayTree
+	complexity: O(n)
+	"""
+	@classmethod
+	def from_sorted(cls, items, store=None):
+		keys = []
+		values = []
+		for key, val in items:
+			if keys and key <= keys[-1]:
+				if key != keys[-1]:
+					raise ValueError("from_sorted got key %r after key %r" % (key, keys[-1]))
+				values[-1] = val
+				continue
+			keys.append(key)
+			values.append(val)
+		tree = cls(store)
+		tree.root = tree.build_sorted(keys, values, 0, len(keys))
+		tree.update_min_max()
+		return tree
+
+	"""builds the subtree of keys[lo:hi] by splitting each range at its middle (see AVLTree.build_sorted)
+	@rtype: int
+	@returns: the root of the subtree (with no parent), 0 if the range is empty
+	complexity: O(hi - lo), no recursion
+	"""
+	def build_sorted(self, keys, values, lo, hi):
+		if lo >= hi:
+			return 0
+		s = self.store
+		H, S, L, R, P = s.heights, s.sizes, s.lefts, s.rights, s.parents
+		mid = (lo + hi) // 2
+		root = s.new_node(keys[mid], values[mid])
+		H[root] = (hi - lo).bit_length() - 1
+		S[root] = hi - lo
+		stack = [(root, lo, mid, hi)]
+		while stack:
+			node, lo, mid, hi = stack.pop()
+			if lo < mid:  # build the left half
+				child_mid = (lo + mid) // 2
+				child = s.new_node(keys[child_mid], values[child_mid])
+				H[child] = (mid - lo).bit_length() - 1
+				S[child] = mid - lo
+				P[child] = node
+				L[node] = child
+				stack.append((child, lo, child_mid, mid))
+			if mid + 1 < hi:  # build the right half
+				child_mid = (mid + 1 + hi) // 2
+				child = s.new_node(keys[child_mid], values[child_mid])
+				H[child] = (hi - mid - 1).bit_length() - 1
+				S[child] = hi - mid - 1
+				P[child] = node
+				R[node] = child
+				stack.append((child, mid + 1, child_mid, hi))
+		return root
+
+	"""returns the key of a node
+	@type node: int
+	@rtype: int
+	complexity: O(1)
+	"""
+	def get_key(self, node):
+		return self.store.keys[node]
+
+	"""returns the value of a node
+	@type node: int
+	@rtype: any
+	complexity: O(1)
+	"""
+	def get_value(self, node):
+		return self.store.values[node]
+
+	"""returns the height of a node, -1 for the virtual node
+	@type node: int
+	@rtype: int
+	complexity: O(1)
+	"""
+	def get_height(self, node):
+		return self.store.heights[node]
+
+	"""searches for a node in the dictionary corresponding to the key (starting at the root)
+	@type key: int
+	@rtype: (int,int)
+	@returns: a tuple (x,e) where x is the node of key (or None if not found),
+	and e is the number of nodes on the search path
+	complexity: O(log n)
+	"""
+	def search(self, key):
+		path_len = 0
+		if key is None:
+			return None, path_len
+		K, L, R = self.store.keys, self.store.lefts, self.store.rights
+		curr = self.root
+		while curr:
+			path_len += 1
+			k = K[curr]
+			if key == k:
+				return curr, path_len
+			curr = L[curr] if key < k else R[curr]
+		return None, path_len
+
+	"""searches for a batch of keys at once, each search starting from the path of the previous one
+	(see AVLTree.search_many)
+	@type keys: list or numpy.ndarray
+	@type nodes: bool
+	@param nodes: return the nodes of the keys instead of their values
+	@rtype: (list, list)
+	@returns: a tuple (results, found) in the order of keys
+	complexity: O(m log m) for the sort plus O(m log(n/m + 1)) for the m searches
+	"""
+	def search_many(self, keys, nodes=False):
+		is_array = hasattr(keys, "argsort") and hasattr(keys, "tolist")
+		if is_array:
+			order = keys.argsort(kind="stable").tolist()
+			keys = keys.tolist()
+		else:
+			keys = list(keys)
+			order = sorted(range(len(keys)), key=keys.__getitem__)
+		K, L, R, V = self.store.keys, self.store.lefts, self.store.rights, self.store.values
+		results = [None] * len(keys)
+		found = [False] * len(keys)
+		if self.root:
+			path = [self.root]
+			bounds = [None]  # the exclusive upper bound of the subtree of each node on the path
+			for i in order:
+				key = keys[i]
+				while bounds[-1] is not None and key >= bounds[-1]:
+					path.pop()
+					bounds.pop()
+				curr = path[-1]
+				while True:
+					k = K[curr]
+					if key == k:
+						results[i] = curr if nodes else V[curr]
+						found[i] = True
+						break
+					if key < k:
+						child = L[curr]
+						bound = k
+					else:
+						child = R[curr]
+						bound = bounds[-1]
+					if not child:
+						break
+					path.append(child)
+					bounds.append(bound)
+					curr = child
+		if is_array:
+			import numpy
+			found = numpy.array(found, dtype=bool)
+		return results, found
+
+	"""climbs from the max to the lowest node on the right spine whose subtree can hold key
+	@rtype: (int,int)
+	@returns: the node to start the descent at (0 if the tree is empty) and the number of steps
+	complexity: O(log d) for a key d positions below the max
+	"""
+	def finger_start(self, key):
+		K, P = self.store.keys, self.store.parents
+		curr = self.max
+		path_len = 0
+		while curr and P[curr] and K[P[curr]] >= key:
+			path_len += 1
+			curr = P[curr]
+		return curr, path_len
+
+	"""searches for a node in the dictionary corresponding to the key, starting at the max
+	@type key: int
+	@rtype: (int,int)
+	@returns: a tuple (x,e) where x is the node of key (or None if not found),
+	and e is the number of nodes on the path from the max
+	complexity: O(log d) for a key d positions below the max
+	"""
+	def finger_search(self, key):
+		if key is None:
+			return None, 0
+		K, L, R = self.store.keys, self.store.lefts, self.store.rights
+		curr, path_len = self.finger_start(key)
+		while curr:
+			path_len += 1
+			k = K[curr]
+			if key == k:
+				return curr, path_len
+			curr = L[curr] if key < k else R[curr]
+		return None, path_len
+
+	"""doing right rotation at a node, updating heights and sizes
+	@type x: int
+	@param x: the node with the balance factor 2
+	complexity: O(1)
+	"""
+	def rotate_right(self, x):
+		s = self.store
+		H, S, L, R, P = s.heights, s.sizes, s.lefts, s.rights, s.parents
+		y = L[x]
+		p = P[x]
+		b = R[y]
+		L[x] = b
+		if b:
+			P[b] = x
+		R[y] = x
+		P[x] = y
+		P[y] = p
+		if not p:  # x was the top of self or of a detached subtree
+			if self.root == x:
+				self.root = y
+		elif L[p] == x:
+			L[p] = y
+		else:
+			R[p] = y
+		H[x] = max(H[L[x]], H[R[x]]) + 1
+		S[x] = S[L[x]] + S[R[x]] + 1
+		H[y] = max(H[L[y]], H[R[y]]) + 1
+		S[y] = S[L[y]] + S[R[y]] + 1
+
+	"""doing left rotation at a node, updating heights and sizes
+	@type x: int
+	@param x: the node with the balance factor -2
+	complexity: O(1)
+	"""
+	def rotate_left(self, x):
+		s = self.store
+		H, S, L, R, P = s.heights, s.sizes, s.lefts, s.rights, s.parents
+		y = R[x]
+		p = P[x]
+		b = L[y]
+		R[x] = b
+		if b:
+			P[b] = x
+		L[y] = x
+		P[x] = y
+		P[y] = p
+		if not p:  # x was the top of self or of a detached subtree
+			if self.root == x:
+				self.root = y
+		elif L[p] == x:
+			L[p] = y
+		else:
+			R[p] = y
+		H[x] = max(H[L[x]], H[R[x]]) + 1
+		S[x] = S[L[x]] + S[R[x]] + 1
+		H[y] = max(H[L[y]], H[R[y]]) + 1
+		S[y] = S[L[y]] + S[R[y]] + 1
+
+	"""rebalances from a node up, stopping as soon as the heights stop changing (see AVLTree.balance)
+	@type case: str
+	@param case: "insert" or "delete"
+	@type x: int
+	@param x: the node to start from
+	@type fix_sizes: bool
+	@param fix_sizes: keep walking to the root after the stop to refresh the sizes,
+	False when the caller already counted the change in the size of every ancestor
+	@rtype: int
+	@returns: the number of PROMOTE cases
+	"""
+	def rebalance(self, case, x, fix_sizes=True):
+		s = self.store
+		H, S, L, R, P = s.heights, s.sizes, s.lefts, s.rights, s.parents
+		num_promotions = 0
+		while x:
+			p = P[x]
+			left_height = H[L[x]]
+			right_height = H[R[x]]
+			bf = left_height - right_height
+			if -2 < bf < 2:
+				S[x] = S[L[x]] + S[R[x]] + 1
+				new_height = (left_height if left_height > right_height else right_height) + 1
+				if new_height == H[x]:
+					x = p
+					break  # the ancestors keep their heights
+				H[x] = new_height
+				num_promotions += 1
+				x = p
+			else:
+				if bf == -2:
+					r = R[x]
+					right_bf = H[L[r]] - H[R[r]]
+					if right_bf == -1 or (right_bf == 0 and case == "delete"):
+						self.rotate_left(x)
+					else:
+						self.rotate_right(r)
+						self.rotate_left(x)
+				else:
+					l = L[x]
+					left_bf = H[L[l]] - H[R[l]]
+					if left_bf == 1 or (left_bf == 0 and case == "delete"):
+						self.rotate_right(x)
+					else:
+						self.rotate_left(l)
+						self.rotate_right(x)
+				x = p
+				if case == "insert":
+					break  # the rotated subtree is back to its height before the insertion
+		if fix_sizes:
+			while x:
+				S[x] = S[L[x]] + S[R[x]] + 1
+				x = P[x]
+		return num_promotions
+
+	"""attaches a new leaf under parent and rebalances
+	@rtype: int
+	@returns: the number of PROMOTE cases
+	"""
+	def attach(self, node, parent, fix_sizes):
+		K, L, R, P = self.store.keys, self.store.lefts, self.store.rights, self.store.parents
+		key = K[node]
+		if key < K[parent]:
+			L[parent] = node
+		else:
+			R[parent] = node
+		P[node] = parent
+		if key < K[self.min]:
+			self.min = node
+		if key > K[self.max]:
+			self.max = node
+		return self.rebalance("insert", parent, fix_sizes)
+
+	"""inserts a new node into the dictionary with corresponding key and value (starting at the root),
+	updating the value if the key already appears
+	@type key: int
+	@type val: any
+	@rtype: (int,int,int)
+	@returns: a 3-tuple (x,e,h) where x is the node of key, e is the number of nodes on the
+	search path and h is the number of PROMOTE cases during the AVL rebalancing
+	complexity: O(log n), with O(1) amortized rebalancing
+	"""
+	def insert(self, key, val):
+		s = self.store
+		K, S, L, R, P = s.keys, s.sizes, s.lefts, s.rights, s.parents
+		path_len = 0
+		parent = 0
+		curr = self.root
+		# a single descent, counting the new key in the sizes on the way (undone if the key exists)
+		while curr:
+			path_len += 1
+			k = K[curr]
+			if key == k:
+				s.values[curr] = val
+				ancestor = P[curr]
+				while ancestor:
+					S[ancestor] -= 1
+					ancestor = P[ancestor]
+				return curr, path_len, 0
+			S[curr] += 1
+			parent = curr
+			curr = L[curr] if key < k else R[curr]
+		node = s.new_node(key, val)
+		if not parent:
+			self.root = self.min = self.max = node
+			return node, path_len, 0
+		return node, path_len, self.attach(node, parent, False)
+
+	"""inserts a new node into the dictionary with corresponding key and value, starting at the max,
+	updating the value if the key already appears (like insert; AVLTree.finger_insert instead
+	requires the key to be absent)
+	@type key: int
+	@type val: any
+	@rtype: (int,int,int)
+	@returns: a 3-tuple (x,e,h) as in insert, e counts the path from the max
+	complexity: O(log d) search for a key d positions below the max, O(log n) to refresh the sizes
+	"""
+	def finger_insert(self, key, val):
+		s = self.store
+		K, L, R = s.keys, s.lefts, s.rights
+		curr, path_len = self.finger_start(key)
+		parent = 0
+		while curr:
+			path_len += 1
+			k = K[curr]
+			if key == k:
+				s.values[curr] = val
+				return curr, path_len, 0
+			parent = curr
+			curr = L[curr] if key < k else R[curr]
+		node = s.new_node(key, val)
+		if not parent:
+			self.root = self.min = self.max = node
+			return node, path_len, 0
+		return node, path_len, self.attach(node, parent, True)
+
+	"""returns the node with the min key bigger than the key of node
+	@type node: int
+	@rtype: int
+	@returns: the successor, None if node has the maximal key
+	complexity: O(log n)
+	"""
+	def successor(self, node):
+		L, R, P = self.store.lefts, self.store.rights, self.store.parents
+		if R[node]:
+			node = R[node]
+			while L[node]:
+				node = L[node]
+			return node
+		parent = P[node]
+		while parent and R[parent] == node:
+			node = parent
+			parent = P[node]
+		return parent or None
+
+	"""returns the node with the max key smaller than the key of node
+	@type node: int
+	@rtype: int
+	@returns: the predecessor, None if node has the minimal key
+	complexity: O(log n)
+	"""
+	def predecessor(self, node):
+		L, R, P = self.store.lefts, self.store.rights, self.store.parents
+		if L[node]:
+			node = L[node]
+			while R[node]:
+				node = R[node]
+			return node
+		parent = P[node]
+		while parent and L[parent] == node:
+			node = parent
+			parent = P[node]
+		return parent or None
+
+	"""deletes node from the dictionary, its slot goes to the free list.
+	A node with two children is replaced by its successor node (not by copying the key),
+	so the indices of the other nodes stay valid.
+	@type node: int
+	@pre: node is a node of self
+	complexity: O(log n)
+	"""
+	def delete(self, node):
+		if node is None:
+			return
+		s = self.store
+		H, S, L, R, P = s.heights, s.sizes, s.lefts, s.rights, s.parents
+		if node == self.min:
+			self.min = self.successor(node) or 0
+		if node == self.max:
+			self.max = self.predecessor(node) or 0
+		parent = P[node]
+		if L[node] and R[node]:
+			follower = R[node]
+			while L[follower]:
+				follower = L[follower]
+			if P[follower] == node:
+				y = follower
+			else:
+				y = P[follower]
+				# remove the follower from its place, it has no left child
+				L[y] = R[follower]
+				if R[follower]:
+					P[R[follower]] = y
+				R[follower] = R[node]
+				P[R[node]] = follower
+			L[follower] = L[node]
+			P[L[node]] = follower
+			H[follower] = H[node]
+			S[follower] = S[node]
+			child = follower
+		else:
+			child = L[node] or R[node]
+			y = parent
+		if child:
+			P[child] = parent
+		if not parent:
+			self.root = child
+		elif L[parent] == node:
+			L[parent] = child
+		else:
+			R[parent] = child
+		s.free_node(node)
+		self.rebalance("delete", y)
+
+	"""joins two detached subtrees with a node whose key is between them (see AVLTree.join_nodes)
+	@rtype: int
+	@returns: the root of the joined subtree, with no parent
+	complexity: O(|height(left) - height(right)| + 1)
+	"""
+	def join_nodes(self, left, node, right):
+		s = self.store
+		H, S, L, R, P = s.heights, s.sizes, s.lefts, s.rights, s.parents
+		P[left] = 0
+		P[right] = 0
+		parent = 0
+		top = node
+		if H[left] > H[right] + 1:  # go down the right spine of left
+			top = left
+			while H[left] > H[right]:
+				parent = left
+				left = R[left]
+			R[parent] = node
+		elif H[right] > H[left] + 1:  # go down the left spine of right
+			top = right
+			while H[right] > H[left]:
+				parent = right
+				right = L[right]
+			L[parent] = node
+		L[node] = left
+		R[node] = right
+		P[left] = node
+		P[right] = node
+		P[0] = 0  # one of the subtrees may be the virtual node, whose links stay 0
+		P[node] = parent
+		H[node] = max(H[left], H[right]) + 1
+		S[node] = S[left] + S[right] + 1
+		if not parent:
+			return node
+		self.rebalance("delete", parent)
+		return top if not P[top] else P[top]
+
+	"""splits a detached subtree around a key (see AVLTree.split_nodes)
+	@rtype: (int, int, int)
+	@returns: a 3-tuple (left, x, right) of the roots of the keys smaller and larger than key
+	(0 if empty) and the detached node of key (0 if key is not in the subtree)
+	complexity: O(log n)
+	"""
+	def split_nodes(self, root, key):
+		s = self.store
+		K, L, R = s.keys, s.lefts, s.rights
+		path = []
+		found = 0
+		curr = root
+		while curr:
+			if key == K[curr]:
+				found = curr
+				break
+			path.append(curr)
+			curr = L[curr] if key < K[curr] else R[curr]
+		left = right = 0
+		if found:
+			left, right = L[found], R[found]
+			L[found] = R[found] = s.parents[found] = 0
+			s.parents[left] = s.parents[right] = 0
+		for node in reversed(path):
+			if key < K[node]:  # node and its right subtree are larger than key
+				right = self.join_nodes(right, node, R[node])
+			else:
+				left = self.join_nodes(L[node], node, left)
+		return left, found, right
+
+	"""recomputes self.min and self.max by walking down the spines
+	complexity: O(log n)
+	"""
+	def update_min_max(self):
+		L, R = self.store.lefts, self.store.rights
+		self.min = self.max = self.root
+		while L[self.min]:
+			self.min = L[self.min]
+		while R[self.max]:
+			self.max = R[self.max]
+
+	"""returns a tree of this store holding the items of a tree of another store,
+	tree is left empty and its slots go back to the free list of its store
+	@rtype: AVLArrayTree
+	complexity: O(n) for the n keys of tree
+	"""
+	def adopt(self, tree):
+		adopted = AVLArrayTree.from_sorted(tree.items(), self.store)
+		s = tree.store
+		L, R = s.lefts, s.rights
+		stack = [tree.root] if tree.root else []
+		while stack:
+			i = stack.pop()
+			if L[i]:
+				stack.append(L[i])
+			if R[i]:
+				stack.append(R[i])
+			s.free_node(i)  # overwrites the links of i, read above
+		tree.root = tree.min = tree.max = 0
+		return adopted
+
+	"""joins self with item and another AVLArrayTree, the result is self and tree2 is left empty
+	@type tree2: AVLArrayTree
+	@param tree2: a dictionary to be joined with self
+	@type key: int
+	@param key: the key separating self and tree2
+	@type val: any
+	@param val: the value corresponding to key
+	@pre: all keys in self are smaller than key and all keys in tree2 are larger than key,
+	or the opposite way
+	@rtype: AVLArrayTree
+	complexity: O(|h1 - h2| + 1) when both trees use the same store (e.g. they came from split),
+	otherwise tree2 is first copied into the store of self in O(size of tree2)
+	"""
+	def join(self, tree2, key, val):
+		if tree2.store is not self.store:
+			tree2 = self.adopt(tree2)
+		node = self.store.new_node(key, val)
+		K = self.store.keys
+		if (self.root and K[self.root] < key) or (tree2.root and K[tree2.root] > key):
+			low, high = self, tree2
+		else:
+			low, high = tree2, self
+		self.root = self.join_nodes(low.root, node, high.root)
+		self.min = low.min or node
+		self.max = high.max or node
+		tree2.root = tree2.min = tree2.max = 0
+		return self
+
+	"""splits the dictionary at a given node, self is left empty and node is freed
+	@type node: int
+	@pre: node is in self
+	@rtype: (AVLArrayTree, AVLArrayTree)
+	@returns: a tuple (left, right) of the keys smaller and larger than the key of node,
+	both in the store of self; (None, None) if node is None or self is empty, like AVLTree.split
+	complexity: O(log n)
+	"""
+	def split(self, node):
+		if node is None or not self.root:
+			return None, None
+		left, found, right = self.split_nodes(self.root, self.store.keys[node])
+		if found:
+			self.store.free_node(found)
+		self.root = self.min = self.max = 0
+		left_tree = AVLArrayTree(self.store)
+		left_tree.root = left
+		left_tree.update_min_max()
+		right_tree = AVLArrayTree(self.store)
+		right_tree.root = right
+		right_tree.update_min_max()
+		return left_tree, right_tree
+
+	"""lazily yields the (key, value) pairs in key order, using an explicit stack
+	@rtype: generator of (int, any)
+	complexity: O(n) for the whole walk, O(log n) memory
+	"""
+	def items(self):
+		K, L, R, V = self.store.keys, self.store.lefts, self.store.rights, self.store.values
+		stack = []
+		curr = self.root
+		while stack or curr:
+			while curr:
+				stack.append(curr)
+				curr = L[curr]
+			curr = stack.pop()
+			yield K[curr], V[curr]
+			curr = R[curr]
+
+	"""writes the dictionary to a file in a compact binary format (see AVLTreeFile)
+	@type path: str
+	complexity: O(n)
+	"""
+	def dump(self, path):
+		import AVLTreeFile  # AVLTreeFile imports this module
+		AVLTreeFile.dump(self, path)
+
+	"""loads a dictionary written by dump (by either engine) into a new store, without inserting
+	@type path: str
+	@type use_mmap: bool
+	@param use_mmap: map the file instead of reading it: the tree is read-only and searchable right away
+	@rtype: AVLArrayTree
+	complexity: O(n) buffer copies, O(log n) with use_mmap
+	"""
+	@classmethod
+	def load(cls, path, use_mmap=False):
+		import AVLTreeFile
+		return AVLTreeFile.load(path, "array", use_mmap)
+
+	"""returns an array representing dictionary
+	@rtype: list
+	@returns: a sorted list according to key of tuples (key, value)
+	complexity: O(n)
+	"""
+	def avl_to_array(self):
+		return list(self.items())
+
+	"""returns the node with the minimal key
+	@rtype: int
+	@returns: the minimal node, None if the dictionary is empty
+	complexity: O(1)
+	"""
+	def min_node(self):
+		return self.min or None
+
+	"""returns the node with the maximal key
+	@rtype: int
+	@returns: the maximal node, None if the dictionary is empty
+	complexity: O(1)
+	"""
+	def max_node(self):
+		return self.max or None
+
+	"""returns the number of items in dictionary
+	@rtype: int
+	complexity: O(1)
+	"""
+	def size(self):
+		return self.store.sizes[self.root]
+
+	"""returns the root of the tree representing the dictionary
+	@rtype: int
+	@returns: the root, None if the dictionary is empty
+	complexity: O(1)
+	"""
+	def get_root(self):
+		return self.root or None
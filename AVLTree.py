@@ -8,9 +8,15 @@
 
 """A class represnting a node in an AVL tree"""
 from enum import nonmember
+from collections import Counter, OrderedDict
+import itertools
+import time
 
 
 class AVLNode(object):
+	# slotted layout: no per-node __dict__, see VIRTUAL_NODE for the shared leaves
+	__slots__ = ("key", "value", "left", "right", "parent", "height", "size", "epoch", "agg", "prev", "next")
+
 	"""Constructor, you are allowed to add more fields. 
 	
 	@type key: int
@@ -21,10 +27,15 @@ class AVLNode(object):
 	def __init__(self, key, value):
 		self.key = key
 		self.value = value
-		self.left = None
-		self.right = None
+		self.left = None if key is None else VIRTUAL_NODE
+		self.right = None if key is None else VIRTUAL_NODE
 		self.parent = None
 		self.height = -1
+		self.size = 0 if key is None else 1  # number of real nodes in the subtree of self
+		self.epoch = 0  # the snapshot generation of the tree that created self, see AVLTree.own
+		self.agg = None  # the aggregate of the subtree of self, when the tree has an augmentation
+		self.prev = None  # the in-order neighbours of self in its tree (None at the min / max),
+		self.next = None  # kept by every update, so that successor and predecessor are O(1)
 		
 
 	"""returns whether self is not a virtual node 
@@ -132,6 +143,15 @@ class AVLNode(object):
 	def get_height(self):
 		return self.height
 
+	"""returns the size of the subtree of self
+    Complexity: O(1)
+    @rtype: int
+    @returns: the number of real nodes in the subtree of self, 0 if the node is virtual
+    """
+
+	def get_size(self):
+		return self.size
+
 	"""sets key
     Complexity: O(1)
     @type key: int or None
@@ -186,6 +206,15 @@ class AVLNode(object):
 	def set_height(self, height):
 		self.height = height
 
+	"""sets the size of the subtree of the node
+    Complexity: O(1)
+    @type size: int
+    @param size: the size
+    """
+
+	def set_size(self, size):
+		self.size = size
+
 
 	"""calculates height
 		@rtype: int
@@ -198,6 +227,17 @@ class AVLNode(object):
 		right_height = self.get_right().get_height() if self.get_right() else -1  # If right is None, height is -1
 		return max(left_height, right_height) + 1
 
+	"""calculates the size of the subtree
+		@rtype: int
+		@returns: size of left child + size of right child + 1
+		complexity: O(1)
+		"""
+
+	def check_size(self):
+		left_size = self.left.size if self.left else 0
+		right_size = self.right.size if self.right else 0
+		return left_size + right_size + 1
+
 
 	"""calculates the balance factor of a given node
     @type node: AVLNode
@@ -209,6 +249,372 @@ class AVLNode(object):
 		return (self.left.height if self.left else 0) - (self.right.height if self.right else 0)
 
 
+"""A class representing the virtual leaf of the AVL tree.
+A single instance (VIRTUAL_NODE) is shared by every tree as the child of all leaves,
+so inserting a key allocates one node instead of three. The instance is immutable:
+the setters are no-ops (callers may keep doing e.g. node.get_left().set_parent(node)
+on a leaf) and direct attribute assignment raises.
+"""
+
+class _VirtualNode(AVLNode):
+	__slots__ = ()
+
+	def __init__(self):
+		for field in AVLNode.__slots__:
+			object.__setattr__(self, field, None)
+		object.__setattr__(self, "height", -1)
+		object.__setattr__(self, "size", 0)
+
+	def __setattr__(self, name, value):
+		raise AttributeError("the virtual node is shared and can not be modified")
+
+	def set_key(self, key):
+		pass
+
+	def set_value(self, value):
+		pass
+
+	def set_left(self, left):
+		pass
+
+	def set_right(self, right):
+		pass
+
+	def set_parent(self, parent):
+		pass
+
+	def set_height(self, height):
+		pass
+
+	def set_size(self, size):
+		pass
+
+
+VIRTUAL_NODE = _VirtualNode()
+
+# every tree that takes a snapshot gets a fresh epoch from here, so no two trees ever own the same epoch
+SNAPSHOT_EPOCHS = itertools.count(1)
+
+
+"""An augmentation of the nodes of an AVLTree: every node keeps the aggregate of its subtree,
+combine(combine(left, project(key, value)), right), so any key range is aggregated in O(log n).
+combine must be associative with identity as its neutral element (a monoid), it need not be
+commutative: the values are always combined in key order.
+"""
+
+class AVLAugmentation(object):
+
+	"""
+	@type combine: function
+	@param combine: combine(a, b) of the aggregates of two adjacent key ranges, a before b
+	@param identity: the aggregate of an empty range
+	@type project: function
+	@param project: project(key, value) is the aggregate of a single item, the value if None
+	"""
+	def __init__(self, combine, identity, project=None):
+		self.combine = combine
+		self.identity = identity
+		self.project = project if project is not None else (lambda key, value: value)
+
+	"""the number of items (which the subtree sizes already give, see AVLTree.rank)"""
+	@classmethod
+	def count(cls):
+		return cls(lambda a, b: a + b, 0, lambda key, value: 1)
+
+	"""the sum of project(key, value), of the values if project is None"""
+	@classmethod
+	def sum(cls, project=None):
+		return cls(lambda a, b: a + b, 0, project)
+
+	"""the minimum of project(key, value), None for an empty range"""
+	@classmethod
+	def min(cls, project=None):
+		return cls(lambda a, b: b if a is None else a if b is None or a <= b else b, None, project)
+
+	"""the maximum of project(key, value), None for an empty range"""
+	@classmethod
+	def max(cls, project=None):
+		return cls(lambda a, b: b if a is None else a if b is None or a >= b else b, None, project)
+
+
+"""A class collecting operation statistics of one AVLTree, see AVLTree.enable_stats.
+The counters are cumulative: rotations (a double rotation counts once, as double), promotions,
+histograms (path length -> count) of the e returned by search / finger_search and by
+insert / finger_insert, the number of calls per operation, and a histogram of the height
+differences of the joins (including the joins done inside split and the set operations).
+"""
+
+class AVLTreeStats(object):
+	TRACKED = ("search", "finger_search", "insert", "finger_insert", "insert_many", "delete", "join", "split")
+
+	def __init__(self, hook=None, timing=False):
+		self.single_rotations = 0
+		self.double_rotations = 0
+		self.promotions = 0
+		self.search_paths = Counter()
+		self.insert_paths = Counter()
+		self.join_height_diffs = Counter()
+		self.calls = Counter()
+		self.seconds = Counter()  # total time per operation, only when timing
+		self.hook = hook
+		self.timing = timing or hook is not None
+
+	"""returns a bound method of tree that counts its calls and path lengths (and times them when timing)
+	@type tree: AVLTree
+	@type name: str
+	@param name: one of TRACKED
+	@rtype: function
+	"""
+	def wrap(self, tree, name):
+		method = getattr(type(tree), name).__get__(tree)
+		paths = self.search_paths if "search" in name else self.insert_paths if name.endswith("insert") else None
+
+		def tracked(*args, **kwargs):
+			if not self.timing:
+				result = method(*args, **kwargs)
+				self.calls[name] += 1
+				if paths is not None:
+					paths[result[1]] += 1
+				return result
+			rotations = self.single_rotations + self.double_rotations
+			start = time.perf_counter()
+			result = method(*args, **kwargs)
+			elapsed = time.perf_counter() - start
+			self.calls[name] += 1
+			self.seconds[name] += elapsed
+			if paths is not None:
+				paths[result[1]] += 1
+			if self.hook is not None:
+				self.hook(name, elapsed, self.single_rotations + self.double_rotations - rotations)
+			return result
+		return tracked
+
+	"""returns the counters as plain dicts, e.g. for a metrics exporter
+	@rtype: dict
+	"""
+	def as_dict(self):
+		return {
+			"single_rotations": self.single_rotations,
+			"double_rotations": self.double_rotations,
+			"promotions": self.promotions,
+			"search_paths": dict(self.search_paths),
+			"insert_paths": dict(self.insert_paths),
+			"join_height_diffs": dict(self.join_height_diffs),
+			"calls": dict(self.calls),
+			"seconds": dict(self.seconds),
+		}
+
+
+"""A bounded cache from keys to the nodes of one AVLTree, in front of search and finger_search
+(see AVLTree.enable_cache). Only nodes that are in the tree are cached: the tree discards a key
+when its node is deleted or replaced by a copy, and drops the entries of the keys it gives away
+in split, join, the range deletes and the destroying set operations.
+policy "lru" evicts the least recently used key, "clock" approximates it with one reference bit
+per slot (a hit only sets the bit, so hits do not reorder anything).
+"""
+
+class AVLTreeCache(object):
+	POLICIES = ("lru", "clock")
+
+	"""
+	@type capacity: int
+	@param capacity: the maximal number of cached keys, at least 1
+	@type policy: str
+	@param policy: one of POLICIES
+	"""
+	def __init__(self, capacity=1024, policy="lru"):
+		if capacity < 1:
+			raise ValueError("the cache capacity must be at least 1")
+		if policy not in AVLTreeCache.POLICIES:
+			raise ValueError("unknown cache policy %r, expected one of %s" % (policy, ", ".join(AVLTreeCache.POLICIES)))
+		self.capacity = capacity
+		self.policy = policy
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.entries = OrderedDict()  # key -> node for lru, key -> slot for clock
+		# the clock: a ring of slots with their key, node and reference bit, and the free slots
+		self.slot_keys = []
+		self.slot_nodes = []
+		self.slot_refs = []
+		self.free_slots = []
+		self.hand = 0
+
+	"""returns the cached node of key, None on a miss
+	@rtype: AVLNode
+	complexity: O(1)
+	"""
+	def get(self, key):
+		entry = self.entries.get(key)
+		if entry is None:
+			self.misses += 1
+			return None
+		self.hits += 1
+		if self.policy == "lru":
+			self.entries.move_to_end(key)
+			return entry
+		self.slot_refs[entry] = True
+		return self.slot_nodes[entry]
+
+	"""caches the node of key, evicting a key if the cache is full
+	@type node: AVLNode
+	complexity: O(1), amortized for clock
+	"""
+	def put(self, key, node):
+		entries = self.entries
+		if self.policy == "lru":
+			entries[key] = node
+			entries.move_to_end(key)
+			if len(entries) > self.capacity:
+				entries.popitem(last=False)
+				self.evictions += 1
+			return
+		slot = entries.get(key)
+		if slot is not None:
+			self.slot_nodes[slot] = node
+			self.slot_refs[slot] = True
+			return
+		if self.free_slots:
+			slot = self.free_slots.pop()
+		elif len(self.slot_keys) < self.capacity:
+			slot = len(self.slot_keys)
+			self.slot_keys.append(None)
+			self.slot_nodes.append(None)
+			self.slot_refs.append(False)
+		else:
+			refs = self.slot_refs
+			while refs[self.hand]:  # give every referenced slot a second chance
+				refs[self.hand] = False
+				self.hand = (self.hand + 1) % self.capacity
+			slot = self.hand
+			self.hand = (self.hand + 1) % self.capacity
+			del entries[self.slot_keys[slot]]
+			self.evictions += 1
+		self.slot_keys[slot] = key
+		self.slot_nodes[slot] = node
+		self.slot_refs[slot] = False
+		entries[key] = slot
+
+	"""forgets the node of key, if it is cached
+	complexity: O(1)
+	"""
+	def discard(self, key):
+		entry = self.entries.pop(key, None)
+		if entry is not None and self.policy == "clock":
+			self.slot_keys[entry] = None
+			self.slot_nodes[entry] = None
+			self.slot_refs[entry] = False
+			self.free_slots.append(entry)
+
+	"""forgets the nodes of all the cached keys for which test(key) is true
+	@type test: function
+	complexity: O(capacity)
+	"""
+	def discard_where(self, test):
+		for key in [key for key in self.entries if test(key)]:
+			self.discard(key)
+
+	"""forgets all the cached nodes, the counters are kept
+	complexity: O(capacity)
+	"""
+	def clear(self):
+		self.entries.clear()
+		self.slot_keys = []
+		self.slot_nodes = []
+		self.slot_refs = []
+		self.free_slots = []
+		self.hand = 0
+
+	def __len__(self):
+		return len(self.entries)
+
+	"""returns the fraction of the lookups that hit, 0.0 before any lookup
+	@rtype: float
+	"""
+	def hit_ratio(self):
+		lookups = self.hits + self.misses
+		return self.hits / lookups if lookups else 0.0
+
+	"""returns the counters as a plain dict, e.g. for a metrics exporter
+	@rtype: dict
+	"""
+	def as_dict(self):
+		return {
+			"policy": self.policy,
+			"capacity": self.capacity,
+			"size": len(self.entries),
+			"hits": self.hits,
+			"misses": self.misses,
+			"evictions": self.evictions,
+			"hit_ratio": self.hit_ratio(),
+		}
+
+
+"""A position in an AVLTree that moves with seek, next and prev, like the cursor of a merge-join.
+Every move starts from the current node: next and prev follow the in-order links in O(1),
+and seeking to a key d positions away costs a finger search.
+After an update of the tree, seek again before moving: the current node may be gone.
+"""
+
+class AVLTreeCursor(object):
+
+	"""
+	@type tree: AVLTree
+	"""
+	def __init__(self, tree):
+		self.tree = tree
+		self.node = None  # the current node, None when the cursor is off the tree
+
+	"""moves to the node with the smallest key at least key, starting from the current node
+	@rtype: AVLNode
+	@returns: the new current node, None if every key is smaller than key
+	complexity: O(log d) on average for a key d positions away, O(log n) at worst
+	"""
+	def seek(self, key):
+		tree = self.tree
+		if tree.root is None:
+			self.node = None
+			return None
+		if self.node is None:
+			curr = tree.root
+			bound = None
+		else:
+			curr = tree.finger_climb(key, self.node)[0]
+			# the climb stops below a parent that is bigger than key (for the smaller keys, inside the subtree)
+			bound = curr.parent if curr.parent is not None and curr.parent.key > key else None
+		while curr.is_real_node():
+			if key == curr.key:
+				self.node = curr
+				return curr
+			if key < curr.key:
+				bound = curr
+				curr = curr.left
+			else:
+				curr = curr.right
+		self.node = bound
+		return bound
+
+	"""moves to the next key
+	@rtype: AVLNode
+	@returns: the new current node, None past the max
+	complexity: O(1)
+	"""
+	def next(self):
+		if self.node is not None:
+			self.node = self.tree.successor(self.node)
+		return self.node
+
+	"""moves to the previous key
+	@rtype: AVLNode
+	@returns: the new current node, None before the min
+	complexity: O(1)
+	"""
+	def prev(self):
+		if self.node is not None:
+			self.node = self.tree.predecessor(self.node)
+		return self.node
+
+
 """
 A class implementing an AVL tree.
 """
@@ -218,8 +624,144 @@ class AVLTree(object):
 	"""
 	Constructor, you are allowed to add more fields.
 	"""
-	def __init__(self):
+	"""
+	@type augment: AVLAugmentation
+	@param augment: the aggregate every node keeps for its subtree, see aggregate; None for none
+	"""
+	def __init__(self, augment=None):
 		self.root = None
+		self.min = None  # the node with the minimal key, kept up to date by every update
+		self.max = None  # the node with the maximal key, the starting point of the finger operations
+		self.stats = None  # an AVLTreeStats while enable_stats is on
+		self.epoch = 0  # nodes with another epoch may be shared with a snapshot, once cow is on
+		self.cow = False  # copy-on-write, turned on by the first snapshot
+		self.augment = augment  # kept up to date wherever the subtree sizes are
+		self.cache = None  # an AVLTreeCache while enable_cache is on
+
+	"""returns a read-only view of the dictionary as it is now
+	The view shares all the nodes with self. From now on self copies a node before changing it
+	(path copying: an update copies the O(log n) nodes on its path, a rotation the nodes it moves),
+	so the view stays valid and unchanged however self is updated later, and costs memory only
+	in proportion to the updates made since. Nodes that self returned earlier may be replaced
+	by copies in self; delete accepts such old versions (the live node of the key is deleted).
+	@rtype: AVLTreeSnapshot
+	complexity: O(1)
+	"""
+	def snapshot(self):
+		view = AVLTreeSnapshot(self)
+		self.start_cow()
+		return view
+
+	"""moves self to a fresh epoch with copy-on-write on, so all its current nodes count as shared
+	complexity: O(1)
+	"""
+	def start_cow(self):
+		self.epoch = next(SNAPSHOT_EPOCHS)
+		self.cow = True
+
+	"""returns a version of a live node that self may change in place.
+	With copy-on-write on, a node of an older epoch (possibly shared with a snapshot) is copied
+	together with its not yet copied ancestors, top-down, and the copies are linked into self.
+	Only the parent pointers and in-order links of the shared nodes are updated, snapshots never follow them.
+	@type node: AVLNode
+	@param node: a node of the live tree
+	@rtype: AVLNode
+	complexity: O(1) when nothing is copied, O(k) for k copied nodes
+	"""
+	def own(self, node):
+		if not self.cow or not node.is_real_node() or node.epoch == self.epoch:
+			return node
+		chain = []
+		while node is not None and node.epoch != self.epoch:
+			chain.append(node)
+			node = node.parent
+		parent = node
+		for old in reversed(chain):
+			new = AVLNode.__new__(AVLNode)  # every slot is set below
+			new.key = old.key
+			new.value = old.value
+			new.left = old.left
+			new.right = old.right
+			new.height = old.height
+			new.size = old.size
+			new.agg = old.agg
+			new.epoch = self.epoch
+			new.parent = parent
+			new.left.set_parent(new)
+			new.right.set_parent(new)
+			new.prev = old.prev
+			new.next = old.next
+			if new.prev is not None:
+				new.prev.next = new
+			if new.next is not None:
+				new.next.prev = new
+			if parent is None:
+				if self.root is old:
+					self.root = new
+			elif parent.left is old:
+				parent.left = new
+			else:
+				assert parent.right is old, "own climbed a stale parent pointer"
+				parent.right = new
+			if self.min is old:
+				self.min = new
+			if self.max is old:
+				self.max = new
+			if self.cache is not None:
+				self.cache.discard(old.key)
+			parent = new
+		return parent
+
+	"""puts a bounded cache from keys to nodes in front of search and finger_search.
+	A hit returns the node with e = 0, since no node of the tree is visited; the found nodes of
+	the misses are cached. The other operations keep the cache exact (see AVLTreeCache).
+	@type capacity: int
+	@param capacity: the maximal number of cached keys
+	@type policy: str
+	@param policy: "lru" or "clock"
+	@rtype: AVLTreeCache
+	@returns: the new cache, which counts its hits, misses and evictions
+	"""
+	def enable_cache(self, capacity=1024, policy="lru"):
+		self.cache = AVLTreeCache(capacity, policy)
+		return self.cache
+
+	"""removes the cache of enable_cache
+	@rtype: AVLTreeCache
+	@returns: the removed cache, None if there was none
+	"""
+	def disable_cache(self):
+		cache = self.cache
+		self.cache = None
+		return cache
+
+	"""starts collecting operation statistics in self.stats.
+	The tracked operations are wrapped on this instance only, so a tree without stats runs the
+	plain methods; inside the algorithms the cost is one "is None" test per rotation and per balance.
+	@type hook: function
+	@param hook: called as hook(name, seconds, rotations) after every tracked operation, for
+	correlating latency with rebalancing work. Giving a hook turns timing on.
+	@type timing: bool
+	@param timing: accumulate the time spent per operation in stats.seconds
+	@rtype: AVLTreeStats
+	"""
+	def enable_stats(self, hook=None, timing=False):
+		self.disable_stats()
+		self.stats = AVLTreeStats(hook, timing)
+		for name in AVLTreeStats.TRACKED:
+			setattr(self, name, self.stats.wrap(self, name))
+		return self.stats
+
+	"""stops collecting statistics and removes the wrappers of enable_stats
+	@rtype: AVLTreeStats
+	@returns: the statistics collected so far, None if they were not enabled
+	"""
+	def disable_stats(self):
+		stats = self.stats
+		for name in AVLTreeStats.TRACKED:
+			self.__dict__.pop(name, None)
+		self.stats = None
+		return stats
 
 	"""sets a new value for root
 	Complexity: O(1)
@@ -228,6 +770,88 @@ class AVLTree(object):
 	def set_root(self, root):
 		self.root = root
 
+	"""builds a dictionary from (key, value) pairs sorted by key, without rebalancing
+	@type items: iterable
+	@param items: (key, value) pairs in increasing key order, for equal keys the last value is kept
+	@rtype: AVLTree
+	@returns: a height-balanced tree holding the items, with correct heights and sizes
+	complexity: O(n)
+	"""
+	@classmethod
+	def from_sorted(cls, items):
+		keys = []
+		values = []
+		for key, val in items:
+			if keys and key <= keys[-1]:
+				if key != keys[-1]:
+					raise ValueError("from_sorted got key %r after key %r" % (key, keys[-1]))
+				values[-1] = val
+				continue
+			keys.append(key)
+			values.append(val)
+		tree = cls()
+		tree.set_root(tree.build_sorted(keys, values, 0, len(keys)))
+		tree.update_min_max()
+		return tree
+
+	"""builds a dictionary from (key, value) pairs in any order, sorting them once
+	@type items: iterable
+	@param items: (key, value) pairs, for equal keys the last value is kept (like insert)
+	@rtype: AVLTree
+	@returns: a height-balanced tree holding the items
+	complexity: O(n log n) for the sort, O(n) for the build
+	"""
+	@classmethod
+	def from_unsorted(cls, items):
+		return cls.from_sorted(sorted(dict(items).items()))
+
+	"""builds the subtree of keys[lo:hi] by splitting each range at its middle
+	@type keys: list
+	@param keys: strictly increasing keys
+	@type values: list
+	@param values: the values matching keys
+	@rtype: AVLNode
+	@returns: the root of the subtree (with no parent), None if the range is empty,
+	with its nodes linked in order from keys[lo] to keys[hi - 1]
+	complexity: O(hi - lo), no recursion. A range of m keys always gets height m.bit_length() - 1,
+	since the two halves of a range differ by at most one key.
+	"""
+	def build_sorted(self, keys, values, lo, hi):
+		if lo >= hi:
+			return None
+		mid = (lo + hi) // 2
+		root = AVLNode(keys[mid], values[mid])
+		root.height = (hi - lo).bit_length() - 1
+		root.size = hi - lo
+		first = lo
+		in_order = [None] * (hi - lo)
+		in_order[mid - first] = root
+		stack = [(root, lo, mid, hi)]
+		while stack:
+			node, lo, mid, hi = stack.pop()
+			if lo < mid:  # build the left half
+				child_mid = (lo + mid) // 2
+				child = AVLNode(keys[child_mid], values[child_mid])
+				child.height = (mid - lo).bit_length() - 1
+				child.size = mid - lo
+				child.parent = node
+				node.left = child
+				in_order[child_mid - first] = child
+				stack.append((child, lo, child_mid, mid))
+			if mid + 1 < hi:  # build the right half
+				child_mid = (mid + 1 + hi) // 2
+				child = AVLNode(keys[child_mid], values[child_mid])
+				child.height = (hi - mid - 1).bit_length() - 1
+				child.size = hi - mid - 1
+				child.parent = node
+				node.right = child
+				in_order[child_mid - first] = child
+				stack.append((child, mid + 1, child_mid, hi))
+		for before, after in zip(in_order, in_order[1:]):
+			before.next = after
+			after.prev = before
+		return root
+
 
 	"""searches for a node in the dictionary corresponding to the key (starting at the root)
         
@@ -242,11 +866,18 @@ class AVLTree(object):
 		path_len = 0
 		if self.root is None or key is None:
 			return None, path_len
+		cache = self.cache
+		if cache is not None:
+			node = cache.get(key)
+			if node is not None:
+				return node, path_len
 		# Start search at the root
 		curr_node = self.get_root()
 		while curr_node.is_real_node():
 			path_len += 1
 			if key == curr_node.get_key():
+				if cache is not None:
+					cache.put(key, curr_node)
 				return curr_node, path_len
 
 			if key < curr_node.get_key():
@@ -255,16 +886,38 @@ class AVLTree(object):
 				curr_node = curr_node.get_right()  # Key is greater than current key - search in right sub-tree
 		return None, path_len
 
+	"""returns the node of key by a plain descent from the root, for the internal lookups:
+	the cache and the statistics, which count the lookups of the user, are left alone
+	@rtype: AVLNode
+	@returns: the node of key, None if key is not in the dictionary
+	complexity: O(log n)
+	"""
+	def find_node(self, key):
+		curr = self.root
+		while curr is not None and curr.is_real_node():
+			if key == curr.key:
+				return curr
+			curr = curr.left if key < curr.key else curr.right
+		return None
+
 	"""searches for a node in the dictionary corresponding to the key, starting at the max
+	(or at any node given as the finger)
 
     @type key: int
     @param key: a key to be searched
+    @type finger: AVLNode
+    @param finger: a node of self to start at, e.g. the result of the previous lookup; None for the max
     @rtype: (AVLNode,int)
     @returns: a tuple (x,e) where x is the node corresponding to key (or None if not found),
     and e is the number of edges on the path between the starting node and ending node+1.
+    complexity: O(log d) from the max for a key d positions below it; from another finger,
+    the climb up to the lowest ancestor whose subtree holds key and the way down from it,
+    O(log d) on average for keys d positions away and O(log n) at worst
     """
 
-	def finger_search(self, key):
+	def finger_search(self, key, finger=None):
+		if finger is not None:
+			return self.finger_search_from(key, finger)
 
 		path_len = 0
 		curr_node = self.max_node()
@@ -272,6 +925,11 @@ class AVLTree(object):
 		# the key is invalid or the tree is empty
 		if key == None or curr_node == None:
 			return None, path_len
+		cache = self.cache
+		if cache is not None:
+			node = cache.get(key)
+			if node is not None:
+				return node, path_len
 
 		# Traverse from the max to the node which is the root of the subtree that contains the key (if root is not max)
 		while (curr_node.is_real_node()
@@ -281,6 +939,8 @@ class AVLTree(object):
 
 			path_len += 1
 			if key == curr_node.get_key():
+				if cache is not None:
+					cache.put(key, curr_node)
 				return curr_node, path_len
 			else:
 				curr_node = curr_node.get_parent()
@@ -289,6 +949,8 @@ class AVLTree(object):
 		if curr_node.get_left().is_real_node() and curr_node.get_right().is_real_node():
 			if curr_node.get_key() == key:
 				path_len += 1
+				if cache is not None:
+					cache.put(key, curr_node)
 				return curr_node, path_len
 			curr_node = curr_node.get_left()
 			path_len += 1
@@ -297,6 +959,8 @@ class AVLTree(object):
 		while curr_node.is_real_node():
 			path_len += 1
 			if key == curr_node.get_key():
+				if cache is not None:
+					cache.put(key, curr_node)
 				return curr_node, path_len
 
 			if key < curr_node.get_key():
@@ -306,6 +970,110 @@ class AVLTree(object):
 
 		return None, path_len
 
+	"""searches for a batch of keys at once: the keys are visited in sorted order and each search
+	starts from the path of the previous one, climbing only as far as the next key requires
+	@type keys: list or numpy.ndarray
+	@param keys: the keys to search for, in any order and possibly repeated
+	@type nodes: bool
+	@param nodes: return the nodes of the keys instead of their values
+	@rtype: (list, list)
+	@returns: a tuple (results, found) in the order of keys, where results[i] is the value
+	(or node) of keys[i], None if it is not in the dictionary, and found[i] tells whether it is;
+	found is a NumPy bool array when keys is a NumPy array
+	complexity: O(m log m) for the sort plus O(m log(n/m + 1)) for the m searches
+	"""
+	def search_many(self, keys, nodes=False):
+		is_array = hasattr(keys, "argsort") and hasattr(keys, "tolist")
+		if is_array:  # a NumPy array: sort it natively and compare plain ints
+			order = keys.argsort(kind="stable").tolist()
+			keys = keys.tolist()
+		else:
+			keys = list(keys)
+			order = sorted(range(len(keys)), key=keys.__getitem__)
+		results = [None] * len(keys)
+		found = [False] * len(keys)
+		if self.root is not None and self.root.is_real_node():
+			# the path to the last node visited, with the exclusive upper bound of each subtree
+			# (None for no bound); keys come in increasing order, so the lower bounds always hold
+			path = [self.root]
+			bounds = [None]
+			for i in order:
+				key = keys[i]
+				while bounds[-1] is not None and key >= bounds[-1]:
+					path.pop()
+					bounds.pop()
+				curr = path[-1]
+				while True:
+					if key == curr.key:
+						results[i] = curr if nodes else curr.value
+						found[i] = True
+						break
+					if key < curr.key:
+						child = curr.left
+						bound = curr.key
+					else:
+						child = curr.right
+						bound = bounds[-1]
+					if not child.is_real_node():
+						break
+					path.append(child)
+					bounds.append(bound)
+					curr = child
+		if is_array:
+			import numpy  # keys was a NumPy array, so NumPy is there
+			found = numpy.array(found, dtype=bool)
+		return results, found
+
+	"""finger_search starting at a given node
+	@rtype: (AVLNode,int)
+	"""
+	def finger_search_from(self, key, finger):
+		if key is None or not finger.is_real_node():
+			return None, 0
+		curr_node, path_len = self.finger_climb(key, finger)
+		while curr_node.is_real_node():
+			path_len += 1
+			if key == curr_node.key:
+				return curr_node, path_len
+			curr_node = curr_node.left if key < curr_node.key else curr_node.right
+		return None, path_len
+
+	"""climbs from finger to the lowest ancestor whose subtree is where key belongs:
+	all the keys between the key of finger and key are in that subtree
+	@type finger: AVLNode
+	@param finger: a node of self
+	@rtype: (AVLNode,int)
+	@returns: the ancestor and the number of edges climbed
+	complexity: O(depth of finger - depth of the ancestor)
+	"""
+	def finger_climb(self, key, finger):
+		curr = finger
+		path_len = 0
+		if key >= curr.key:
+			# a left child whose parent is bigger than key bounds the keys up to key
+			while curr.parent is not None and (curr is curr.parent.right or curr.parent.key <= key):
+				curr = curr.parent
+				path_len += 1
+		else:
+			while curr.parent is not None and (curr is curr.parent.left or curr.parent.key >= key):
+				curr = curr.parent
+				path_len += 1
+		return curr, path_len
+
+	"""returns a cursor over the dictionary, positioned at the smallest key at least key
+	@type key: int
+	@param key: where to start, None for the min
+	@rtype: AVLTreeCursor
+	complexity: O(log n)
+	"""
+	def cursor(self, key=None):
+		cursor = AVLTreeCursor(self)
+		if key is None:
+			cursor.node = self.min
+		else:
+			cursor.seek(key)
+		return cursor
+
 	"""doing right rotation in order to keep the tree balance
     @type criminal: AVLNode
     @param criminal: the node with the balance factor 2 
@@ -313,6 +1081,9 @@ class AVLTree(object):
     """
 
 	def RightRotation(self, criminal):
+		if self.cow:
+			criminal = self.own(criminal)
+			self.own(criminal.get_left())
 		criminal_left = criminal.get_left()
 		criminal_is_right_child = criminal.is_right_child()
 		criminal.set_left(criminal_left.get_right())
@@ -322,13 +1093,19 @@ class AVLTree(object):
 		if criminal_is_right_child:
 			criminal_left.get_parent().set_right(criminal_left)
 		else:
-			if self.root == criminal:
-				self.root = criminal_left
+			if criminal_left.get_parent() is None:  # criminal was the top of self or of a detached subtree
+				if self.root == criminal:
+					self.root = criminal_left
 			else:
 				criminal_left.get_parent().set_left(criminal_left)
 		criminal.set_parent(criminal_left)
 		criminal.set_height(criminal.check_height())
 		criminal_left.set_height(criminal_left.check_height())
+		criminal.set_size(criminal.check_size())
+		criminal_left.set_size(criminal_left.check_size())
+		if self.augment is not None:
+			self.update_aggregate(criminal)
+			self.update_aggregate(criminal_left)
 
 	"""doing left rotation in order to keep the tree balance
     @type criminal: AVLNode
@@ -337,6 +1114,9 @@ class AVLTree(object):
     """
 
 	def LeftRotation(self, criminal):
+		if self.cow:
+			criminal = self.own(criminal)
+			self.own(criminal.get_right())
 		criminal_right = criminal.get_right()
 		criminal_is_right_child = criminal.is_right_child()
 		criminal.set_right(criminal_right.get_left())
@@ -346,53 +1126,116 @@ class AVLTree(object):
 		if criminal_is_right_child:
 			criminal_right.get_parent().set_right(criminal_right)
 		else:
-			if self.root == criminal:
-				self.root = criminal_right
+			if criminal_right.get_parent() is None:  # criminal was the top of self or of a detached subtree
+				if self.root == criminal:
+					self.root = criminal_right
 			else:
 				criminal_right.get_parent().set_left(criminal_right)
 		criminal.set_parent(criminal_right)
 		criminal.set_height(criminal.check_height())
 		criminal_right.set_height(criminal_right.check_height())
+		criminal.set_size(criminal.check_size())
+		criminal_right.set_size(criminal_right.check_size())
+		if self.augment is not None:
+			self.update_aggregate(criminal)
+			self.update_aggregate(criminal_right)
 
 	"""balances input AVLTree using rotations
 
+    The walk stops as soon as it can no longer change anything above: at a balanced node
+    whose height did not change, or right after the rotation of an insert (which restores
+    the height the subtree had before the insertion).
     @type node: AVLNode 
     @param node: a node to perform balancing from
+    @type fix_sizes: bool
+    @param fix_sizes: keep walking to the root after the stop to refresh the sizes,
+    False when the caller already counted the change in the size of every ancestor
+    @type deferred: bool
+    @param deferred: leave the sizes and aggregates above the stop stale, for a caller that
+    refreshes them later with fix_paths (insert_many does it once for the whole batch)
     @pre: node is in self
+    @rtype: int
+    @returns: the number of PROMOTE cases
+    complexity: O(1) amortized for an insert with fix_sizes False, O(log n) otherwise
     """
-	def balance(self, case , node_to_insert_parent):
+	def balance(self, case , node_to_insert_parent, fix_sizes=True, deferred=False):
 		num_promotions = 0
-		# The loop ensures we check each node on the path to the root for balance violations
-		while node_to_insert_parent != None:  # going all the way to the root
+		# The loop checks the nodes on the path to the root for balance violations, until nothing changes
+		while node_to_insert_parent != None:
 			grandpa = node_to_insert_parent.get_parent()
 			bf = node_to_insert_parent.get_BF()
 			new_height = node_to_insert_parent.check_height()
 
 			if abs(bf) < 2:  # Current balance factor is good
-				if new_height != node_to_insert_parent.get_height():
-					node_to_insert_parent.set_height(new_height)
-					num_promotions += 1
+				node_to_insert_parent.set_size(node_to_insert_parent.check_size())
+				if self.augment is not None:
+					self.update_aggregate(node_to_insert_parent)
+				if new_height == node_to_insert_parent.get_height():
+					node_to_insert_parent = grandpa
+					break  # the ancestors keep their heights
+				node_to_insert_parent.set_height(new_height)
+				num_promotions += 1
 				node_to_insert_parent = grandpa
 			else:
 				if bf == -2:
 					right_bf = node_to_insert_parent.get_right().get_BF()
-					if right_bf == -1 or (right_bf == 0 and case == "delete"):
+					single = right_bf == -1 or (right_bf == 0 and case == "delete")
+					if single:
 						self.LeftRotation(node_to_insert_parent)
 					else:
 						self.RightRotation(node_to_insert_parent.get_right())
 						self.LeftRotation(node_to_insert_parent)
 				else:
 					left_bf = node_to_insert_parent.get_left().get_BF()
-					if left_bf == 1 or (left_bf == 0 and case == "delete"):
+					single = left_bf == 1 or (left_bf == 0 and case == "delete")
+					if single:
 						self.RightRotation(node_to_insert_parent)
 					else:
 						self.LeftRotation(node_to_insert_parent.get_left())
 						self.RightRotation(node_to_insert_parent)
+				if self.stats is not None:
+					if single:
+						self.stats.single_rotations += 1
+					else:
+						self.stats.double_rotations += 1
 
 				node_to_insert_parent = grandpa
-
+				if case == "insert":
+					break  # the rotated subtree is back to its height before the insertion
+
+		if deferred:
+			pass
+		elif self.augment is not None:  # the aggregates cannot be counted in ahead like the sizes
+			self.update_aggregates_up(node_to_insert_parent)
+		elif fix_sizes:
+			while node_to_insert_parent != None:
+				node_to_insert_parent.set_size(node_to_insert_parent.check_size())
+				node_to_insert_parent = node_to_insert_parent.get_parent()
+		if self.stats is not None:
+			self.stats.promotions += num_promotions
 		return num_promotions
 
+	"""threads a new leaf into the in-order links, next to its parent
+	(a left leaf comes right before its parent, a right leaf right after it)
+	@type node: AVLNode
+	@pre: node was just attached as a child of node.parent
+	complexity: O(1)
+	"""
+	def link_leaf(self, node):
+		parent = node.parent
+		if parent.left is node:
+			node.next = parent
+			node.prev = parent.prev
+			parent.prev = node
+			if node.prev is not None:
+				node.prev.next = node
+		else:
+			node.prev = parent
+			node.next = parent.next
+			parent.next = node
+			if node.next is not None:
+				node.next.prev = node
+
 	"""insert node in a binary search tree
 	@type node: AVLNode
 	@param node: node to insert
@@ -417,13 +1260,16 @@ class AVLTree(object):
 				else:
 					curr = curr.get_right()
 			#we found the parent to which we will attach the new node
+			curr_parent = self.own(curr_parent)
 			if node.key < curr_parent.get_key():
 				curr_parent.set_left(node)
 			else:
 				curr_parent.set_right(node)
 
 			node.set_parent(curr_parent) #set the parent of this node to be the curr_parent
+			self.link_leaf(node)
 		node.set_height(node.check_height())
+		self.update_min_max_on_insert(node)
 		return node, path_len
 
 	''''inserts a new node into the dictionary with corresponding key and value (starting at the root)
@@ -439,27 +1285,52 @@ class AVLTree(object):
 
 	def insert(self, key, val):
 
-		num_promotions = 0
-		#check if the key already exists in the tree
-		existing_node, path_len = self.search(key)
-		if existing_node is not None:
-			#key already exists, update the value
-			existing_node.set_value(val)
-			return existing_node, path_len, 0
-		else:
-			node_to_insert = AVLNode(key, val)
-			node_to_insert.set_left(AVLNode(None, None))
-			node_to_insert.set_right(AVLNode(None, None))
-			node_to_insert.get_left().set_parent(node_to_insert)
-			node_to_insert.get_right().set_parent(node_to_insert)
-			inserted_node, path_len = self.insertBST(node_to_insert)
-			# we inserted the node, now we need to rebalance.
-			if (not self.get_root().get_right().is_real_node() and not self.get_root().get_left().is_real_node()):
-				return inserted_node, path_len, 0  # the tree contains only the node, no need to rebalance
+		path_len = 0
+		parent = None
+		curr = self.root
+		cow = self.cow
+		# a single descent, both to find an existing key and to find the insertion point.
+		# the new key is counted in the size of every node on the way (and undone if the key exists),
+		# so balance can stop as soon as the heights stop changing
+		while curr is not None and curr.is_real_node():
+			path_len += 1
+			if cow and curr.epoch != self.epoch:
+				curr = self.own(curr)
+			if key == curr.get_key():
+				#key already exists, update the value
+				curr.set_value(val)
+				ancestor = curr.get_parent()
+				while ancestor is not None:
+					ancestor.set_size(ancestor.get_size() - 1)
+					ancestor = ancestor.get_parent()
+				if self.augment is not None:
+					self.update_aggregates_up(curr)
+				return curr, path_len, 0
+			curr.set_size(curr.get_size() + 1)
+			parent = curr
+			if key < curr.get_key():
+				curr = curr.get_left()
+			else:
+				curr = curr.get_right()
 
-			else:  # we need to rebalance
-				num_promotions = self.balance("insert", node_to_insert.get_parent())
-				return inserted_node, path_len, num_promotions
+		node_to_insert = AVLNode(key, val)
+		node_to_insert.set_height(0)
+		node_to_insert.epoch = self.epoch
+		if self.augment is not None:
+			self.update_aggregate(node_to_insert)
+		if parent is None:
+			self.root = node_to_insert
+			self.update_min_max_on_insert(node_to_insert)
+			return node_to_insert, path_len, 0  # the tree contains only the node, no need to rebalance
+		if key < parent.get_key():
+			parent.set_left(node_to_insert)
+		else:
+			parent.set_right(node_to_insert)
+		node_to_insert.set_parent(parent)
+		self.link_leaf(node_to_insert)
+		self.update_min_max_on_insert(node_to_insert)
+		num_promotions = self.balance("insert", parent, False)
+		return node_to_insert, path_len, num_promotions
 
 
 	"""inserts a new node into the dictionary with corresponding key and value, starting at the max
@@ -532,13 +1403,16 @@ class AVLTree(object):
 			parent, path_len = self.finger_search_parent(node.key)
 
 			# we found the parent to which we will attach the new node
+			parent = self.own(parent)
 			if node.key < parent.get_key():
 				parent.set_left(node)
 			else:
 				parent.set_right(node)
 
 			node.set_parent(parent)  # set the parent of this node to be the last_parent
+			self.link_leaf(node)
 		node.set_height(node.check_height())
+		self.update_min_max_on_insert(node)
 		return node, path_len
 
 
@@ -558,10 +1432,9 @@ class AVLTree(object):
 
 		num_promotions = 0
 		node_to_insert = AVLNode(key, val)
-		node_to_insert.set_left(AVLNode(None, None))
-		node_to_insert.set_right(AVLNode(None, None))
-		node_to_insert.get_left().set_parent(node_to_insert)
-		node_to_insert.get_right().set_parent(node_to_insert)
+		node_to_insert.epoch = self.epoch
+		if self.augment is not None:
+			self.update_aggregate(node_to_insert)
 		inserted_node, path_len = self.finger_insertBST(node_to_insert)
 		# we inserted the node, now we need to rebalance.
 		if not self.get_root().get_right().is_real_node() and not self.get_root().get_left().is_real_node():
@@ -571,36 +1444,118 @@ class AVLTree(object):
 			num_promotions = self.balance("insert", node_to_insert.get_parent())
 			return inserted_node, path_len, num_promotions
 
+	"""inserts a batch of items, updating the value of keys that already appear (like insert)
+
+	@type pairs: iterable
+	@param pairs: (key, value) pairs in any order, for equal keys the last value is kept
+	@rtype: (int,int,int)
+	@returns: a 3-tuple (m,e,h) where m is the number of new keys,
+	e is the total number of edges on the search paths of the batch,
+	and h is the total number of PROMOTE cases during the AVL rebalancing.
+	The batch is sorted once and every key is searched from the node of the previous key:
+	the search climbs while the key is beyond the subtree it is in and then goes down,
+	so close keys cost O(log d) for a rank distance d instead of a walk from the root.
+	The rebalancing stops where the heights stop changing, and the sizes and aggregates of
+	the changed nodes and their ancestors are refreshed once at the end (see fix_paths).
+	An empty tree is bulk-built with build_sorted (e = h = 0).
+	complexity: O(m log m) for the sort, then O(m log(n/m + 1)) for the searches and the refresh
+	"""
+	def insert_many(self, pairs):
+		batch = sorted(dict(pairs).items())
+		if not batch:
+			return 0, 0, 0
+		if self.root is None:
+			self.set_root(self.build_sorted([key for key, _ in batch], [val for _, val in batch], 0, len(batch)))
+			self.update_min_max()
+			if self.augment is not None:
+				self.aggregate_nodes(self.root)
+			return len(batch), 0, 0
+		num_inserted = 0
+		path_len = 0
+		num_promotions = 0
+		changed = []  # the new nodes and the nodes with new values, for fix_paths
+		finger = None
+		for key, val in batch:
+			curr = self.root
+			if finger is not None:
+				# keys only grow, so climb until key is below the upper bound of the subtree of curr
+				curr = finger
+				while curr.parent is not None and (curr.is_right_child() or key >= curr.parent.key):
+					curr = curr.parent
+					path_len += 1
+			parent = None
+			while curr.is_real_node() and curr.key != key:
+				path_len += 1
+				parent = curr
+				curr = curr.left if key < curr.key else curr.right
+			if curr.is_real_node():  # the key exists, update the value
+				path_len += 1
+				curr = self.own(curr)
+				curr.set_value(val)
+				if self.augment is not None:
+					changed.append(curr)
+				finger = curr
+				continue
+			parent = self.own(parent)
+			node = AVLNode(key, val)
+			node.set_height(0)
+			node.epoch = self.epoch
+			if self.augment is not None:
+				self.update_aggregate(node)
+			node.set_parent(parent)
+			if key < parent.key:
+				parent.set_left(node)
+			else:
+				parent.set_right(node)
+			self.link_leaf(node)
+			self.update_min_max_on_insert(node)
+			num_promotions += self.balance("insert", parent, False, True)
+			num_inserted += 1
+			changed.append(node)
+			finger = node
+		self.fix_paths(changed)
+		return num_inserted, path_len, num_promotions
+
 	"""searches for the node with the min key bigger then self 
 		@type node: AVLNode
 		@param key: a node successor to be searched
 		@rtype: AVLNode
-		@returns: successor node 
-		compleity: worst case is O(log n)
+		@returns: successor node, None if node has the maximal key
+		complexity: O(1), the in-order link of node
 		"""
 
 	def successor(self, node):
 		if not node or not node.is_real_node():
 			return None
-		curr = node
-		if curr.get_right().is_real_node():
-			curr = curr.get_right()
-			while curr.get_left().is_real_node():
-				curr = curr.get_left()
-			return curr
-		parent = curr.get_parent()
-		while parent != None and parent.is_real_node() and curr.is_right_child():
-			curr = parent
-			parent = curr.get_parent()
-		return parent  # If node has the maximum key, None will be returned
+		return node.next
+
+	"""searches for the node with the max key smaller then self
+		@type node: AVLNode
+		@param node: a node whose predecessor is searched
+		@rtype: AVLNode
+		@returns: predecessor node, None if node has the minimal key
+		complexity: O(1), the in-order link of node
+		"""
+
+	def predecessor(self, node):
+		if not node or not node.is_real_node():
+			return None
+		return node.prev
 
 	"""delete binary search tree
 		@type node: AVLNode
 		@param node: node to delete
-		complexity: O(log n) ,(because of successor)
+		@type follower: AVLNode
+		@param follower: the successor of node when the caller already has it, None to search for it
+		complexity: O(1), replace moves the successor into the place of node without changing
+		the key order, so only node leaves the in-order links
 		"""
 
-	def deleteBST(self, node):
+	def deleteBST(self, node, follower=None):
+		if node.prev is not None:
+			node.prev.next = node.next
+		if node.next is not None:
+			node.next.prev = node.prev
 		right_child = node.get_right()
 		left_child = node.get_left()
 		has_right = right_child.is_real_node()
@@ -611,14 +1566,13 @@ class AVLTree(object):
 			if parent == None:
 				self.root = None
 			elif node.is_right_child():
-				parent.set_right(AVLNode(None, None))
-				parent.get_right().set_parent(parent)
+				parent.set_right(VIRTUAL_NODE)
 			else:
-				parent.set_left(AVLNode(None, None))
-				parent.get_left().set_parent(parent)
+				parent.set_left(VIRTUAL_NODE)
 		# Case 2: Node has two children
 		elif has_right and has_left:
-			follower = self.successor(node)
+			if follower is None:
+				follower = self.successor(node)
 			# Remove successor from tree
 			if follower.is_right_child():
 				follower.get_parent().set_right(follower.get_right())
@@ -651,16 +1605,27 @@ class AVLTree(object):
 	def delete(self, node):
 		if node is None:
 			return
+		if self.cow:
+			# node may be a version kept by a snapshot: delete the live node of its key, with its path copied
+			node = self.own(self.find_node(node.get_key()))
+		if self.cache is not None:
+			self.cache.discard(node.get_key())
 		# Save parent of deleted node, for rebalancing
 		follower = self.successor(node)
 		if node.get_right().is_real_node() and node.get_left().is_real_node():
+			follower = self.own(follower)
 			y = follower.get_parent()
 			# In case the successor is the node's right child
 			if follower == node.get_right():
 				y = follower
 		else:
 			y = node.get_parent()
-		self.deleteBST(node)
+		# the neighbour of a removed min / max takes its place (node objects are kept by deleteBST)
+		if node is self.min:
+			self.min = follower
+		if node is self.max:
+			self.max = node.prev
+		self.deleteBST(node, follower)
 		self.balance("delete",y)
 		return
 
@@ -675,18 +1640,207 @@ class AVLTree(object):
 		if node is not None:
 			node.height = 1 + max(node.left.height if node.left else -1, node.right.height if node.right else -1)
 
-	"""returns the node with the maximal key in the dictionary
+	"""recomputes the aggregate of a node from its item and the aggregates of its children
+	@type node: AVLNode
+	@pre: self.augment is not None
+	complexity O(1)
+	"""
+	def update_aggregate(self, node):
+		augment = self.augment
+		agg = augment.project(node.key, node.value)
+		if node.left.is_real_node():
+			agg = augment.combine(node.left.agg, agg)
+		if node.right.is_real_node():
+			agg = augment.combine(agg, node.right.agg)
+		node.agg = agg
+
+	"""recomputes the sizes and aggregates of a node and all its ancestors
+	@type node: AVLNode
+	@pre: self.augment is not None
+	complexity O(log n)
+	"""
+	def update_aggregates_up(self, node):
+		while node is not None:
+			node.set_size(node.check_size())
+			self.update_aggregate(node)
+			node = node.parent
+
+	"""recomputes the sizes and aggregates of some nodes and all their ancestors, children before
+	parents and each node once, e.g. after a batch of inserts whose rebalancing was deferred.
+	The other nodes must be right already: a rotation refreshes the nodes it moves, so after
+	balance(deferred=True) only the ancestors of the changed nodes can be stale.
+	@type nodes: list of AVLNode
+	@param nodes: the nodes of self that were added or whose values changed
+	complexity O(k) for the k nodes on the union of the paths to the root,
+	O(m log(n/m + 1)) for m nodes spread over a tree of n
+	"""
+	def fix_paths(self, nodes):
+		marked = set()
+		for node in nodes:
+			while node is not None and id(node) not in marked:
+				marked.add(id(node))
+				node = node.parent
+		if not marked:
+			return
+		stack = [self.root]
+		order = []
+		while stack:
+			node = stack.pop()
+			order.append(node)
+			if id(node.left) in marked:
+				stack.append(node.left)
+			if id(node.right) in marked:
+				stack.append(node.right)
+		augment = self.augment
+		for node in reversed(order):
+			node.set_size(node.check_size())
+			if augment is not None:
+				self.update_aggregate(node)
+
+	"""recomputes the aggregates of all the nodes of a subtree, children before parents
+	@type root: AVLNode
+	@param root: the root of a subtree (VIRTUAL_NODE or None if empty)
+	complexity O(n), no recursion
+	"""
+	def aggregate_nodes(self, root):
+		if root is None or not root.is_real_node():
+			return
+		stack = [root]
+		order = []
+		while stack:
+			node = stack.pop()
+			order.append(node)
+			if node.left.is_real_node():
+				stack.append(node.left)
+			if node.right.is_real_node():
+				stack.append(node.right)
+		for node in reversed(order):
+			self.update_aggregate(node)
+
+	"""sets the augmentation of the dictionary and computes the aggregates of all the nodes,
+	e.g. after from_sorted or load
+	@type augment: AVLAugmentation
+	@param augment: the new augmentation, None to stop keeping aggregates
+	complexity O(n)
+	"""
+	def set_augmentation(self, augment):
+		if self.cow:  # the aggregates of the nodes shared with the snapshots belong to them
+			self.set_root(self.copy().root)
+			self.update_min_max()
+			self.start_cow()
+			if self.cache is not None:
+				self.cache.clear()
+		self.augment = augment
+		if augment is not None:
+			self.aggregate_nodes(self.root)
+
+	"""aggregates the items with keys between lo and hi (inclusive), in key order
+	@type lo: int
+	@param lo: smallest key, None for no lower bound
+	@type hi: int
+	@param hi: largest key, None for no upper bound
+	@pre: self.augment is not None
+	@rtype: any
+	@returns: the combination of project(key, value) over the range, augment.identity if it is empty
+	complexity O(log n): one path to each end of the range, using the aggregates of the subtrees between
+	"""
+	def aggregate(self, lo=None, hi=None):
+		augment = self.augment
+		if augment is None:
+			raise ValueError("aggregate needs an AVLTree with an augmentation")
+		combine = augment.combine
+		curr = self.root
+		# the highest node inside the range, the paths to both ends of the range start at it
+		while curr is not None and curr.is_real_node():
+			if lo is not None and curr.key < lo:
+				curr = curr.right
+			elif hi is not None and curr.key > hi:
+				curr = curr.left
+			else:
+				break
+		if curr is None or not curr.is_real_node():
+			return augment.identity
+		result = augment.project(curr.key, curr.value)
+		node = curr.left
+		while node.is_real_node():  # the nodes at least lo, from the right to the left
+			if lo is not None and node.key < lo:
+				node = node.right
+				continue
+			part = augment.project(node.key, node.value)
+			if node.right.is_real_node():
+				part = combine(part, node.right.agg)
+			result = combine(part, result)
+			if lo is None:
+				if node.left.is_real_node():
+					result = combine(node.left.agg, result)
+				break
+			node = node.left
+		node = curr.right
+		while node.is_real_node():  # the nodes at most hi, from the left to the right
+			if hi is not None and node.key > hi:
+				node = node.left
+				continue
+			part = augment.project(node.key, node.value)
+			if node.left.is_real_node():
+				part = combine(node.left.agg, part)
+			result = combine(result, part)
+			if hi is None:
+				if node.right.is_real_node():
+					result = combine(result, node.right.agg)
+				break
+			node = node.right
+		return result
+
+	"""
+	Updates the subtree size of the given node based on the sizes of its children.
+    @type node: AVLNode
+    @param node: the node for which the size is updated
+    complexity O(1)
+    """
+
+	def update_size(self, node):
+		if node is not None:
+			node.size = node.check_size()
+
+	"""returns the node with the minimal key in the dictionary
 		@rtype: AVLNode
-		@returns: the maximal node, None if the dictionary is empty
-		complexity is O(logn)
+		@returns: the minimal node, None if the dictionary is empty
+		complexity is O(1), the node is kept in self.min
 		"""
 	def min_node(self):
-		if self.root is None:
-			return None
+		return self.min
+
+	"""updates self.min and self.max after node was attached to the tree
+	@type node: AVLNode
+	@param node: the newly inserted node
+	complexity: O(1)
+	"""
+	def update_min_max_on_insert(self, node):
+		if self.min is None or node.key < self.min.key:
+			self.min = node
+		if self.max is None or node.key > self.max.key:
+			self.max = node
+
+	"""recomputes self.min and self.max by walking down the left and right spines,
+	for trees whose root was set directly instead of through insert / delete / join,
+	and ends the in-order links there (a subtree cut from a bigger tree still links to its old neighbours)
+	complexity: O(log n)
+	"""
+	def update_min_max(self):
+		if self.root is None or not self.root.is_real_node():
+			self.min = None
+			self.max = None
+			return
 		current = self.root
 		while current.left.is_real_node():
 			current = current.left
-		return current
+		self.min = current
+		current.prev = None
+		current = self.root
+		while current.right.is_real_node():
+			current = current.right
+		self.max = current
+		current.next = None
 
 	"""joins self with item and another AVLTree
 	@type tree2: AVLTree 
@@ -697,93 +1851,46 @@ class AVLTree(object):
 	@param val: the value corresponding to key
 	@pre: all keys in self are smaller than key and all keys in tree2 are larger than key,
 	or the opposite way
-	complexity is O(logn)
+	@rtype: AVLTree
+	@returns: self, holding the joined dictionary. The nodes of tree2 are reused, so tree2 is left empty.
+	complexity is O(|h1 - h2| + 1): only the root heights and the separator key are used,
+	the new node is attached on the spine of the taller tree (see join_nodes)
 	"""
 
 	def join(self, tree2, key, val):
+		if tree2.cache is not None and tree2 is not self:
+			tree2.cache.clear()  # all its nodes go to self
+		if self.augment is not None and tree2.augment is not self.augment and tree2.root is not None:
+			if tree2.cow:  # recompute the aggregates on a copy, the nodes may be shared with snapshots
+				copy = tree2.copy()
+				tree2.set_root(None)
+				tree2.update_min_max()
+				tree2 = copy
+			self.aggregate_nodes(tree2.root)
+		if tree2.cow and not self.cow:
+			self.start_cow()  # the nodes of tree2 may be shared with its snapshots
 		new_node = AVLNode(key, val)
-		new_tree = AVLTree()
-		new_tree.set_root(new_node)
-		if tree2.get_root() is None:
-			if self.get_root() is None:
-				self.insert(key, val)
-				return self
-			self.insert(key, val)
-			return self
+		new_node.epoch = self.epoch
+		if (self.root is not None and self.root.key < key) or (tree2.root is not None and tree2.root.key > key):
+			low_tree, high_tree = self, tree2
 		else:
-			if self.get_root() is None:
-				if tree2.size() == 1:
-					if key > tree2.get_root().get_key():
-						new_node.parent = self.get_root()
-						self.update_height(new_node)
-						self.insert(tree2.get_root().get_key(), tree2.get_root().get_value())
-						self.get_root().set_right(new_node)
-						return self
-					else:
-						new_node.parent = self.get_root()
-						self.update_height(new_node)
-						self.insert(tree2.get_root().get_key(), tree2.get_root().get_value())
-						self.get_root().set_left(new_node)
-						return self
-				else:
-					tree2.insert(key, val)
-				return tree2
-		if self.get_root().get_height() < tree2.get_root().get_height():  # Make it so self is taller
-			self, tree2 = tree2, self
-		if tree2.get_root().key < key:
-			new_node.set_left(tree2.get_root())
-		else:
-			new_node.set_right(tree2.get_root())
-		if self.max_node().key < tree2.max_node().key:
-			curr = self.get_root()
-			while curr.get_height() > tree2.get_root().get_height():
-				if curr.get_right().is_real_node():
-					curr = curr.get_right()
-				else:
-					break
-			if curr:
-				if curr.parent is not None:
-					if curr.parent.left == curr:
-						curr.parent.set_left(new_node)  # Update parent's left child
-					elif curr.parent.right == curr:
-						curr.parent.set_right(new_node)  # Update parent's right child
-				else:
-					# If curr was the root, update the root of the tree to new_node
-					self.set_root(new_node)
-
-				# Set curr as the left child of new_node
-				new_node.set_left(curr)
-				curr.set_parent(new_node)  # Update curr's parent pointer
-			else:
-				new_node.set_right(curr)
-
-		elif self.min_node().key > tree2.min_node().key:
-			curr = self.get_root()
-			while curr.get_height() > tree2.get_root().get_height():
-				curr = curr.get_left()
-			if curr:
-				if curr.parent is not None:
-					if curr.parent.left == curr:
-						curr.parent.set_left(new_node)  # Update parent's left child
-					elif curr.parent.right == curr:
-						curr.parent.set_right(new_node)  # Update parent's right child
-				else:
-					# If curr was the root, update the root of the tree to new_node
-					self.set_root(new_node)
-
-				# Set curr as the left child of new_node
-				new_node.set_right(curr)
-				curr.set_parent(new_node)  # Update curr's parent pointer
-
-			else:
-				new_node.set_left(curr)
-
-		if new_node.left:
-			new_node.left.parent = new_node
-		if new_node.right:
-			new_node.right.parent = new_node
-		self.update_height(new_node)
-		self.balance("insert", new_node)
+			low_tree, high_tree = tree2, self
+		low_root = low_tree.root if low_tree.root is not None else VIRTUAL_NODE
+		high_root = high_tree.root if high_tree.root is not None else VIRTUAL_NODE
+		new_min = low_tree.min if low_tree.min is not None else new_node
+		new_max = high_tree.max if high_tree.max is not None else new_node
+		new_node.prev = low_tree.max
+		new_node.next = high_tree.min
+		if new_node.prev is not None:
+			new_node.prev.next = new_node
+		if new_node.next is not None:
+			new_node.next.prev = new_node
+		self.set_root(self.join_nodes(low_root, new_node, high_root))
+		self.min = new_min
+		self.max = new_max
+		if tree2 is not self:
+			tree2.set_root(None)
+			tree2.update_min_max()
 		return self
 
 	"""splits the dictionary at a given node
@@ -793,46 +1900,425 @@ class AVLTree(object):
 	@rtype: (AVLTree, AVLTree)
 	@returns: a tuple (left, right), where left is an AVLTree representing the keys in the 
 	dictionary smaller than node.key, and right is an AVLTree representing the keys in the 
-	dictionary larger than node.key.
-	complexity is O(logn)
+	dictionary larger than node.key. The nodes of self are reused, so self is left empty
+	and node is detached from both trees.
+	complexity is O(logn): the path to node is joined bottom-up with split_nodes,
+	and the joins telescope over the heights of the path
 	"""
 
 	def split(self, node):
-		left_tree = AVLTree()
-		right_tree = AVLTree()
-		if node is None:
+		if node is None or self.root is None:
 			return None, None
-		# get to the target node
-		current = self.get_root()
-		if current is None:
-			return None, None
-		while current is not None:
-			if node.get_key() < current.get_key():
-				subtree = AVLTree()
-				subtree.root = current.get_right()
-				right_tree = right_tree.join(subtree, current.get_key(), current.get_value())
-				current = current.get_left()
-			elif node.get_key() > current.get_key():
-				subtree = AVLTree()
-				subtree.root = current.get_left()
-				left_tree = left_tree.join(subtree, current.get_key(), current.get_value())
-				current = current.get_right()
+		left, _, right = self.split_nodes(self.root, node.get_key())
+		self.set_root(None)
+		self.update_min_max()
+		if self.cache is not None:
+			self.cache.clear()
+		left_tree, right_tree = self.tree_from_root(left), self.tree_from_root(right)
+		if self.cow:  # their nodes may be shared with the snapshots of self
+			left_tree.start_cow()
+			right_tree.start_cow()
+		return left_tree, right_tree
+
+	"""deletes all the keys between lo and hi (inclusive) by cutting the range out with two splits
+	and joining what is left, so the k deleted nodes are neither visited nor rebalanced one by one
+	@type lo: int
+	@param lo: smallest key to delete, None for no lower bound
+	@type hi: int
+	@param hi: largest key to delete, None for no upper bound
+	@type keep: bool
+	@param keep: return the deleted keys as an AVLTree instead of dropping them
+	@rtype: int or AVLTree
+	@returns: the number of deleted keys, or the tree of the deleted keys if keep
+	complexity: O(log n)
+	"""
+	def delete_range(self, lo, hi, keep=False):
+		if lo is not None and hi is not None and lo > hi:
+			return self.tree_from_root(VIRTUAL_NODE) if keep else 0
+		if self.cache is not None:
+			self.cache.discard_where(lambda k: (lo is None or k >= lo) and (hi is None or k <= hi))
+		left, inside = VIRTUAL_NODE, self.root
+		if inside is not None and lo is not None:
+			left, inside = self.split_nodes_at(inside, lo, False)
+		right = VIRTUAL_NODE
+		if inside is not None and hi is not None:
+			inside, right = self.split_nodes_at(inside, hi, True)
+		return self.cut_range(left, inside, right, keep)
+
+	"""deletes all the keys smaller than key (see delete_range)
+	@type key: int
+	@param key: the smallest key to keep
+	@rtype: int or AVLTree
+	complexity: O(log n)
+	"""
+	def delete_below(self, key, keep=False):
+		if self.cache is not None:
+			self.cache.discard_where(lambda k: k < key)
+		if self.root is None:
+			return self.cut_range(VIRTUAL_NODE, None, VIRTUAL_NODE, keep)
+		inside, right = self.split_nodes_at(self.root, key, False)
+		return self.cut_range(VIRTUAL_NODE, inside, right, keep)
+
+	"""deletes all the keys larger than key (see delete_range)
+	@type key: int
+	@param key: the largest key to keep
+	@rtype: int or AVLTree
+	complexity: O(log n)
+	"""
+	def delete_above(self, key, keep=False):
+		if self.cache is not None:
+			self.cache.discard_where(lambda k: k > key)
+		if self.root is None:
+			return self.cut_range(VIRTUAL_NODE, None, VIRTUAL_NODE, keep)
+		left, inside = self.split_nodes_at(self.root, key, True)
+		return self.cut_range(left, inside, VIRTUAL_NODE, keep)
+
+	"""splits a detached subtree into the keys below and above key, with the node of key (if any)
+	joined back into one of the sides
+	@type found_left: bool
+	@param found_left: put the node of key in the left side rather than the right one
+	@rtype: (AVLNode, AVLNode)
+	complexity: O(log n)
+	"""
+	def split_nodes_at(self, root, key, found_left):
+		left, found, right = self.split_nodes(root, key)
+		if found is not None:
+			if found_left:
+				left = self.join_nodes(left, found, VIRTUAL_NODE)
 			else:
-				if current.get_left() and current.get_left().is_real_node():
-					if left_tree.root is None:
-						left_tree.set_root(current.get_left())
-					else:
-						left_tree.insert(current.get_left().get_key(), current.get_left().get_value())
-				if current.get_right() and current.get_right().is_real_node():
-					if right_tree.root is None:
-						right_tree.set_root(current.get_right())
-					else:
-						right_tree.insert(current.get_right().get_key(), current.get_right().get_value())
-				break  # stop if found the node
+				right = self.join_nodes(VIRTUAL_NODE, found, right)
+		return left, right
+
+	"""makes the join of left and right the tree of self, and disposes of the range cut out between them
+	@type inside: AVLNode
+	@param inside: the root of the cut range, VIRTUAL_NODE or None if empty
+	@rtype: int or AVLTree
+	@returns: the number of keys in inside, or a tree of them if keep
+	complexity: O(log n)
+	"""
+	def cut_range(self, left, inside, right, keep):
+		if inside is None:
+			inside = VIRTUAL_NODE
+		root = self.join2_nodes(left, right)
+		self.set_root(root if root.is_real_node() else None)
+		self.update_min_max()
+		if not keep:
+			return inside.size  # the nodes go with their last reference
+		removed = self.tree_from_root(inside)
+		if self.cow:  # its nodes may be shared with the snapshots of self
+			removed.start_cow()
+		return removed
+
+	"""joins two detached subtrees with a node whose key is between them
+	@type left: AVLNode
+	@param left: the root of a subtree (VIRTUAL_NODE if empty) with keys smaller than node.key
+	@type node: AVLNode
+	@param node: a node that is not in any tree, it becomes an inner node of the result
+	@type right: AVLNode
+	@param right: the root of a subtree (VIRTUAL_NODE if empty) with keys larger than node.key
+	@rtype: AVLNode
+	@returns: the root of the joined subtree, with no parent
+	complexity: O(|left.height - right.height| + 1): the node is attached on the spine
+	of the taller subtree at the height of the shorter one, and the path back up has the same length.
+	The in-order links are not touched: split_nodes joins pieces that were already neighbours,
+	the other callers link node first (see link_between)
+	"""
+	def join_nodes(self, left, node, right):
+		if self.stats is not None:
+			self.stats.join_height_diffs[abs(left.height - right.height)] += 1
+		left.set_parent(None)
+		right.set_parent(None)
+		if left.height > right.height + 1:  # go down the right spine of left
+			top = left = self.own(left)
+			curr = left
+			while curr.height > right.height:
+				parent = self.own(curr)
+				curr = parent.right
+			parent.set_right(node)
+		elif right.height > left.height + 1:  # go down the left spine of right
+			top = right = self.own(right)
+			curr = right
+			while curr.height > left.height:
+				parent = self.own(curr)
+				curr = parent.left
+			parent.set_left(node)
+		else:
+			top = node
+			parent = None
+		if top is left:
+			left = curr
+		elif top is right:
+			right = curr
+		node.set_left(left)
+		node.set_right(right)
+		left.set_parent(node)
+		right.set_parent(node)
+		node.set_parent(parent)
+		node.set_height(node.check_height())
+		node.set_size(node.check_size())
+		if self.augment is not None:
+			self.update_aggregate(node)
+		if parent is None:
+			return node
+		# the attached node can unbalance its ancestors on the spine, a rotation with a
+		# balanced child is possible here, which is the "delete" case of balance
+		self.balance("delete", parent)
+		return top if top.parent is None else top.parent
+
+	"""splits a detached subtree around a key
+	@type root: AVLNode
+	@param root: the root of a subtree (VIRTUAL_NODE if empty)
+	@type key: int
+	@param key: the key to split by, not necessarily in the subtree
+	@rtype: (AVLNode, AVLNode, AVLNode)
+	@returns: a 3-tuple (left, x, right) where left and right are the roots (with no parent,
+	VIRTUAL_NODE if empty) of the keys smaller and larger than key, and x is the detached node
+	of key (None if key is not in the subtree). The in-order links are kept as they are: they stay
+	right inside each part, only the links of the ends of the parts point across the split.
+	complexity: O(log n), the joins on the way up telescope over the heights of the path
+	"""
+	def split_nodes(self, root, key):
+		path = []
+		found = None
+		curr = self.own(root)
+		while curr.is_real_node():
+			curr = self.own(curr)
+			if key == curr.key:
+				found = curr
+				break
+			path.append(curr)
+			curr = curr.left if key < curr.key else curr.right
+		if found is not None:
+			left, right = found.left, found.right
+			left.set_parent(None)  # own must not climb from them back into found
+			right.set_parent(None)
+			found.set_left(VIRTUAL_NODE)
+			found.set_right(VIRTUAL_NODE)
+			found.set_parent(None)
+			found.set_height(0)
+			found.set_size(1)
+			if self.augment is not None:
+				self.update_aggregate(found)
+		else:
+			left, right = VIRTUAL_NODE, VIRTUAL_NODE
+		for node in reversed(path):
+			if key < node.key:  # node and its right subtree are larger than key
+				right = self.join_nodes(right, node, node.right)
+			else:
+				left = self.join_nodes(node.left, node, left)
+		return left, found, right
+
+	"""joins two detached subtrees when no separating node is given, using the max of left as the separator
+	@type left: AVLNode
+	@param left: the root of a subtree (VIRTUAL_NODE if empty)
+	@type right: AVLNode
+	@param right: the root of a subtree (VIRTUAL_NODE if empty) with keys larger than those of left
+	@rtype: AVLNode
+	@returns: the root of the joined subtree, with no parent
+	complexity: O(log n)
+	"""
+	def join2_nodes(self, left, right):
+		if not left.is_real_node():
+			right.set_parent(None)
+			return right
+		curr = left
+		while curr.right.is_real_node():
+			curr = curr.right
+		left, last, _ = self.split_nodes(left, curr.key)
+		self.link_between(left, last, right)
+		return self.join_nodes(left, last, right)
+
+	"""links a node into the in-order links between two detached subtrees, before they are joined
+	@type left: AVLNode
+	@param left: the root of a subtree (VIRTUAL_NODE if empty) with keys smaller than node.key
+	@type right: AVLNode
+	@param right: the root of a subtree (VIRTUAL_NODE if empty) with keys larger than node.key
+	complexity: O(left.height + right.height), a walk down the facing spines
+	"""
+	def link_between(self, left, node, right):
+		node.prev = node.next = None
+		if left.is_real_node():
+			while left.right.is_real_node():
+				left = left.right
+			left.next = node
+			node.prev = left
+		if right.is_real_node():
+			while right.left.is_real_node():
+				right = right.left
+			right.prev = node
+			node.next = right
+
+	"""returns a new AVLTree holding a detached subtree
+	@type root: AVLNode
+	@param root: the root of a subtree (VIRTUAL_NODE if empty)
+	@rtype: AVLTree
+	complexity: O(log n) for the min and max
+	"""
+	def tree_from_root(self, root):
+		tree = AVLTree(self.augment)
+		if root.is_real_node():
+			root.set_parent(None)
+			tree.set_root(root)
+		tree.update_min_max()
+		return tree
+
+	"""returns a copy of the dictionary, sharing the values but no nodes
+	@rtype: AVLTree
+	complexity: O(n)
+	"""
+	def copy(self):
+		tree = AVLTree.from_sorted(self.items())
+		if self.augment is not None:
+			tree.set_augmentation(self.augment)
+		return tree
+
+	"""writes the dictionary to a file in a compact binary format (see AVLTreeFile)
+	@type path: str
+	@pre: the keys are integers that fit in 64 bits
+	complexity: O(n)
+	"""
+	def dump(self, path):
+		import AVLTreeFile  # AVLTreeFile imports this module
+		AVLTreeFile.dump(self, path)
+
+	"""loads a dictionary written by dump, without inserting
+	@type path: str
+	@type use_mmap: bool
+	@param use_mmap: map the file instead of reading it, and return a read-only AVLArrayTree over it
+	that is searchable right away, building no AVLNode
+	@rtype: AVLTree
+	complexity: O(n), O(log n) with use_mmap
+	"""
+	@classmethod
+	def load(cls, path, use_mmap=False):
+		import AVLTreeFile
+		return AVLTreeFile.load(path, "node", use_mmap)
+
+	"""returns the root of self as a detached subtree and empties self, used by the set operations
+	@type destroy: bool
+	@param destroy: when False the nodes of a copy are returned and self is kept
+	@rtype: AVLNode
+	complexity: O(1) if destroy and self has no snapshots, O(n) otherwise
+	"""
+	def take_root(self, destroy):
+		tree = self if destroy and not self.cow else self.copy()  # nodes shared with a snapshot are not handed over
+		root = tree.root if tree.root is not None else VIRTUAL_NODE
+		tree.set_root(None)
+		tree.update_min_max()
+		if destroy:
+			self.set_root(None)
+			self.update_min_max()
+			if self.cache is not None:
+				self.cache.clear()
+		return root
+
+	"""returns the roots of self and tree2 for a set operation (see take_root), with the aggregates
+	of the nodes of tree2 recomputed when tree2 does not have the augmentation of self
+	@rtype: (AVLNode, AVLNode)
+	complexity: as take_root, plus O(m) for the m nodes of tree2 when they are recomputed
+	"""
+	def take_roots(self, tree2, destroy):
+		root = self.take_root(destroy)
+		root2 = tree2.take_root(destroy)
+		if self.augment is not None and tree2.augment is not self.augment:
+			self.aggregate_nodes(root2)  # never shared: take_root copies a tree with snapshots
+		return root, root2
+
+	"""returns the union of self and tree2, for keys in both the value of tree2 is kept (like insert)
+	@type tree2: AVLTree
+	@param tree2: a dictionary
+	@type destroy: bool
+	@param destroy: reuse the nodes of both inputs, leaving self and tree2 empty
+	@rtype: AVLTree
+	complexity: O(m log(n/m + 1)) for sizes m <= n when destroy is True, since every node
+	of self splits tree2 once; without destroy the inputs are first copied in O(n + m),
+	and so are the inputs that have snapshots
+	"""
+	def union(self, tree2, destroy=False):
+		worker = self if not self.cow else AVLTree(self.augment)  # the nodes handed over are never shared, no need to own them
+		return self.tree_from_root(worker.union_nodes(*self.take_roots(tree2, destroy)))
+
+	"""returns the keys of self that also appear in tree2, with the values of self
+	@type tree2: AVLTree
+	@param tree2: a dictionary
+	@type destroy: bool
+	@param destroy: reuse the nodes of both inputs, leaving self and tree2 empty
+	@rtype: AVLTree
+	complexity: O(m log(n/m + 1)) when destroy is True, O(n + m) otherwise
+	"""
+	def intersection(self, tree2, destroy=False):
+		worker = self if not self.cow else AVLTree(self.augment)  # the nodes handed over are never shared, no need to own them
+		return self.tree_from_root(worker.intersection_nodes(*self.take_roots(tree2, destroy)))
+
+	"""returns the keys of self that do not appear in tree2
+	@type tree2: AVLTree
+	@param tree2: a dictionary
+	@type destroy: bool
+	@param destroy: reuse the nodes of both inputs, leaving self and tree2 empty
+	@rtype: AVLTree
+	complexity: O(m log(n/m + 1)) when destroy is True, O(n + m) otherwise
+	"""
+	def difference(self, tree2, destroy=False):
+		worker = self if not self.cow else AVLTree(self.augment)  # the nodes handed over are never shared, no need to own them
+		return self.tree_from_root(worker.difference_nodes(*self.take_roots(tree2, destroy)))
 
-		left_tree.update_height(left_tree.get_root())
-		right_tree.update_height(right_tree.get_root())
-		return left_tree, right_tree
+	"""union of two detached subtrees: split b by the root of a and recurse on both sides
+	@rtype: AVLNode
+	@returns: the root of the union, with no parent
+	complexity: O(m log(n/m + 1)), recursion depth is the height of a
+	"""
+	def union_nodes(self, a, b):
+		if not a.is_real_node():
+			b.set_parent(None)
+			return b
+		if not b.is_real_node():
+			a.set_parent(None)
+			return a
+		a_left, a_right = a.left, a.right
+		b_left, found, b_right = self.split_nodes(b, a.key)
+		if found is not None:
+			a.set_value(found.value)
+		left = self.union_nodes(a_left, b_left)
+		right = self.union_nodes(a_right, b_right)
+		self.link_between(left, a, right)
+		return self.join_nodes(left, a, right)
+
+	"""intersection of two detached subtrees, keeping the nodes of a
+	@rtype: AVLNode
+	@returns: the root of the intersection, with no parent
+	complexity: O(m log(n/m + 1)), recursion depth is the height of a
+	"""
+	def intersection_nodes(self, a, b):
+		if not a.is_real_node() or not b.is_real_node():
+			return VIRTUAL_NODE
+		a_left, a_right = a.left, a.right
+		b_left, found, b_right = self.split_nodes(b, a.key)
+		left = self.intersection_nodes(a_left, b_left)
+		right = self.intersection_nodes(a_right, b_right)
+		if found is not None:
+			self.link_between(left, a, right)
+			return self.join_nodes(left, a, right)
+		return self.join2_nodes(left, right)
+
+	"""difference of two detached subtrees, the keys of a that are not in b
+	@rtype: AVLNode
+	@returns: the root of the difference, with no parent
+	complexity: O(m log(n/m + 1)), recursion depth is the height of a
+	"""
+	def difference_nodes(self, a, b):
+		if not a.is_real_node():
+			return VIRTUAL_NODE
+		if not b.is_real_node():
+			a.set_parent(None)
+			return a
+		a_left, a_right = a.left, a.right
+		b_left, found, b_right = self.split_nodes(b, a.key)
+		left = self.difference_nodes(a_left, b_left)
+		right = self.difference_nodes(a_right, b_right)
+		if found is not None:
+			return self.join2_nodes(left, right)
+		self.link_between(left, a, right)
+		return self.join_nodes(left, a, right)
 
 	"""does an inorder run on the AVLTree
 	@type node: AVLNode
@@ -853,25 +2339,101 @@ class AVLTree(object):
 	"""returns an array representing dictionary 
 	@rtype: list
 	@returns: a sorted list according to key of touples (key, value) representing the data structure
-	complexity O(n)
+	complexity O(n), no recursion
 	"""
 	def avl_to_array(self):
-		arr = []
-		return self.inorder(self.root, arr)
+		return list(self.items())
+
+	"""lazily walks the nodes of the dictionary in key order, following the in-order links
+	@type lo: int
+	@param lo: smallest key to yield (inclusive), None for no lower bound
+	@type hi: int
+	@param hi: largest key to yield (inclusive), None for no upper bound
+	@type reverse: bool
+	@param reverse: walk from the largest key down instead
+	@rtype: generator of AVLNode
+	@pre: the dictionary is not modified while the generator is in use
+	complexity: O(log n) to reach the first node (O(1) without a bound), then O(1) per node,
+	so a range of k keys touches O(log n + k) nodes, with no stack
+	"""
+	def nodes(self, lo=None, hi=None, reverse=False):
+		bound = hi if reverse else lo
+		if bound is None:
+			node = self.max if reverse else self.min
+		else:  # the first node inside the bound
+			node = None
+			curr = self.root
+			while curr is not None and curr.is_real_node():
+				if curr.key == bound:
+					node = curr
+					break
+				if not reverse:
+					if curr.key < bound:
+						curr = curr.right
+					else:
+						node = curr
+						curr = curr.left
+				elif curr.key > bound:
+					curr = curr.left
+				else:
+					node = curr
+					curr = curr.right
+		if reverse:
+			while node is not None and (lo is None or node.key >= lo):
+				yield node
+				node = node.prev
+		else:
+			while node is not None and (hi is None or node.key <= hi):
+				yield node
+				node = node.next
+
+	"""lazily yields the (key, value) pairs of the dictionary in key order
+	@type lo: int
+	@param lo: smallest key to yield (inclusive), None for no lower bound
+	@type hi: int
+	@param hi: largest key to yield (inclusive), None for no upper bound
+	@rtype: generator of (int, any)
+	complexity: O(log n + k) for k yielded pairs
+	"""
+	def items(self, lo=None, hi=None):
+		for node in self.nodes(lo, hi):
+			yield node.key, node.value
+
+	"""lazily yields the keys of the dictionary in key order
+	@type lo: int
+	@param lo: smallest key to yield (inclusive), None for no lower bound
+	@type hi: int
+	@param hi: largest key to yield (inclusive), None for no upper bound
+	@rtype: generator of int
+	complexity: O(log n + k) for k yielded keys
+	"""
+	def keys(self, lo=None, hi=None):
+		for node in self.nodes(lo, hi):
+			yield node.key
+
+	"""iterates over the keys of the dictionary in increasing order
+	@rtype: generator of int
+	complexity: O(n) for the whole walk, O(1) per key
+	"""
+	def __iter__(self):
+		return self.keys()
+
+	"""iterates over the keys of the dictionary in decreasing order
+	@rtype: generator of int
+	complexity: O(n) for the whole walk, O(1) per key
+	"""
+	def __reversed__(self):
+		for node in self.nodes(reverse=True):
+			yield node.key
 
 
 	"""returns the node with the maximal key in the dictionary
 	@rtype: AVLNode
 	@returns: the maximal node, None if the dictionary is empty
-	complexity O(logn)
+	complexity O(1), the node is kept in self.max
 	"""
 	def max_node(self):
-		if self.root is None:
-			return None
-		current = self.root
-		while current.right is not None and current.right.is_real_node():
-			current = current.right
-		return current
+		return self.max
 
 	"""Helper function to calculate the size of the subtree rooted at the given node.
 	@type node: AVLNode
@@ -890,14 +2452,55 @@ class AVLTree(object):
 
 	"""returns the number of items in dictionary 
 	@rtype: int
-	@returns: the number of items in dictionary, should only work on trees that were made entirely of insert or delete or join without split
-	complexity O(n)
+	@returns: the number of items in dictionary (the size field of the root)
+	complexity O(1)
 	"""
 	def size(self): 
 		if self.root is None:
 			return 0
-		size = self.size_helper(self.root)
-		return size
+		return self.root.get_size()
+
+	"""returns the rank of a key in the dictionary
+	@type key: int
+	@param key: a key, not necessarily in the dictionary
+	@rtype: int
+	@returns: the number of keys in the dictionary that are smaller than or equal to key,
+	so a key in the dictionary gets its 1-based position in the sorted order
+	complexity O(logn)
+	"""
+	def rank(self, key):
+		rank = 0
+		curr = self.root
+		while curr is not None and curr.is_real_node():
+			if key < curr.get_key():
+				curr = curr.get_left()
+			else:
+				rank += curr.get_left().get_size() + 1
+				if key == curr.get_key():
+					break
+				curr = curr.get_right()
+		return rank
+
+	"""returns the node with the i-th smallest key in the dictionary
+	@type i: int
+	@param i: a 1-based position in the sorted order, select(rank(key)) is the node of key
+	@rtype: AVLNode
+	@returns: the node with the i-th smallest key, None if i is not between 1 and size()
+	complexity O(logn)
+	"""
+	def select(self, i):
+		if i < 1 or i > self.size():
+			return None
+		curr = self.root
+		while True:
+			left_size = curr.get_left().get_size()
+			if i == left_size + 1:
+				return curr
+			if i <= left_size:
+				curr = curr.get_left()
+			else:
+				i -= left_size + 1
+				curr = curr.get_right()
 
 	
 	"""returns the root of the tree representing the dictionary
@@ -908,3 +2511,110 @@ class AVLTree(object):
 	"""
 	def get_root(self):
 		return self.root
+
+
+"""
+A read-only, persistent version of an AVLTree, made by AVLTree.snapshot.
+It shares its nodes with the tree, which copies a node before changing it,
+so the snapshot stays unchanged however the tree is updated later.
+Only the child links of the nodes are meaningful here (the tree keeps the parent and in-order links
+for itself), so the snapshot offers the queries that go down from the root (and finger_search).
+"""
+class AVLTreeSnapshot(object):
+
+	"""
+	@type tree: AVLTree
+	@param tree: the tree to take a snapshot of
+	"""
+	def __init__(self, tree):
+		self.root = tree.root
+		self.min = tree.min
+		self.max = tree.max
+		self.augment = tree.augment
+		self.cache = None  # a snapshot has no cache, its nodes never change
+
+	search = AVLTree.search
+	search_many = AVLTree.search_many
+	aggregate = AVLTree.aggregate
+	get_root = AVLTree.get_root
+
+	"""searches for key starting at the max, like AVLTree.finger_search (with the same path length),
+	climbing a stack of the right spine since the parent pointers belong to the tree
+	@rtype: (AVLNode,int)
+	complexity: O(log n)
+	"""
+	def finger_search(self, key):
+		path_len = 0
+		if key is None or self.root is None:
+			return None, path_len
+		spine = []
+		curr_node = self.root
+		while curr_node.is_real_node():
+			spine.append(curr_node)
+			curr_node = curr_node.right
+		i = len(spine) - 1
+		curr_node = spine[i]
+		while i > 0 and spine[i - 1].key >= key:
+			path_len += 1
+			if key == curr_node.key:
+				return curr_node, path_len
+			i -= 1
+			curr_node = spine[i]
+		if curr_node.left.is_real_node() and curr_node.right.is_real_node():
+			if curr_node.key == key:
+				return curr_node, path_len + 1
+			curr_node = curr_node.left
+			path_len += 1
+		while curr_node.is_real_node():
+			path_len += 1
+			if key == curr_node.key:
+				return curr_node, path_len
+			curr_node = curr_node.left if key < curr_node.key else curr_node.right
+		return None, path_len
+	min_node = AVLTree.min_node
+	max_node = AVLTree.max_node
+	size = AVLTree.size
+	rank = AVLTree.rank
+	select = AVLTree.select
+
+	"""lazily walks the nodes in key order like AVLTree.nodes, using an explicit stack
+	since the in-order links belong to the tree
+	@type lo: int
+	@param lo: smallest key to yield (inclusive), None for no lower bound
+	@type hi: int
+	@param hi: largest key to yield (inclusive), None for no upper bound
+	@type reverse: bool
+	@param reverse: walk from the largest key down instead
+	@rtype: generator of AVLNode
+	complexity: O(log n) to reach the first node, then O(1) amortized per node,
+	so a range of k keys touches O(log n + k) nodes. The stack holds O(log n) nodes.
+	"""
+	def nodes(self, lo=None, hi=None, reverse=False):
+		if reverse:  # walk the mirrored tree, with the bounds swapped
+			near, far, bound, stop = "right", "left", hi, lo
+		else:
+			near, far, bound, stop = "left", "right", lo, hi
+		stack = []
+		curr = self.root
+		# descend to the first node inside the bound, stacking the nodes still to be visited
+		while curr is not None and curr.is_real_node():
+			if bound is not None and (curr.key < bound if not reverse else curr.key > bound):
+				curr = getattr(curr, far)
+			else:
+				stack.append(curr)
+				curr = getattr(curr, near)
+		while stack:
+			node = stack.pop()
+			if stop is not None and (node.key > stop if not reverse else node.key < stop):
+				return
+			yield node
+			curr = getattr(node, far)
+			while curr.is_real_node():
+				stack.append(curr)
+				curr = getattr(curr, near)
+
+	items = AVLTree.items
+	keys = AVLTree.keys
+	__iter__ = AVLTree.__iter__
+	__reversed__ = AVLTree.__reversed__
+	avl_to_array = AVLTree.avl_to_array
@@ -0,0 +1,543 @@
+"""Reproducible benchmarks for the AVLTree operations.
+
+usage: python AVLTreeBenchmark.py [--sizes 1000 10000 100000 1000000] [--orders random sorted reverse nearly]
+	[--engines node array] [--ops insert finger_insert ...] [--seed 0] [--no-memory]
+	[--out results.json] [--compare baseline.json] [--threshold 0.2]
+
+Every case (engine, key order, size, operation) starts from the same seeded key list, times one
+kind of operation over all the keys and reports ops/sec, together with the mean path length (e)
+and promotions (h) that the API returns. The peak traced memory of building the tree is measured
+once per (engine, order, size) in a separate run, since tracemalloc slows the timed runs down.
+The mixed cases are a threaded stress test: a ConcurrentAVLTree against a global mutex baseline
+(mixed_concurrent and the scan cases run on the node engine only, see ENGINE_OPS; other
+engines skip them). The scan cases add scans whose readers wait outside the GIL while holding
+a read, see bench_mixed and ConcurrentAVLTree.
+finger_append and finger_search_sorted time the finger operations on increasing keys, whatever
+the order, as an append-only workload does them from the max of the tree; split_rejoin splits one
+large tree at random keys and joins it back each time, so that no rebuild hides the cost of split.
+The results are written as JSON; with --compare, an operation that got slower than the baseline
+by more than the threshold is reported and the exit status is 1.
+"""
+import argparse
+import json
+import platform
+import random
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from AVLTree import AVLTree
+from AVLArrayTree import AVLArrayTree
+from ConcurrentAVLTree import ConcurrentAVLTree
+import AVLTreeParallel
+
+ENGINES = {"node": AVLTree, "array": AVLArrayTree}
+ORDERS = ("random", "sorted", "reverse", "nearly")
+OPS = ("insert", "finger_insert", "search", "finger_search", "search_many", "delete", "join", "split", "avl_to_array", "size",
+	"mixed_concurrent", "mixed_mutex", "load", "load_mmap", "build_parallel", "search_many_parallel",
+	"finger_append", "finger_search_sorted", "split_rejoin", "scan_concurrent", "scan_mutex")
+# the operations that only some engines run (AVLArrayTree has no range scan)
+ENGINE_OPS = {"mixed_concurrent": ("node",), "scan_concurrent": ("node",), "scan_mutex": ("node",)}
+REPEATS = 50  # joins / splits per case, each on freshly built trees (split_rejoin: on one tree)
+THREADS = 8  # threads of the mixed (95% search / 5% update) cases
+SCAN_KEYS = 64  # keys per scan of the scan cases
+SCAN_GROUP = 8  # keys handed out per write during a scan
+SCAN_WAIT = 0.0001  # seconds per write, spent outside the GIL
+
+
+"""returns the seeded list of n distinct keys in the given order
+@type order: str
+@param order: random, sorted, reverse, or nearly (sorted with 1% of the keys swapped at random)
+@rtype: list
+"""
+def make_keys(n, order, seed):
+	rnd = random.Random(seed)
+	keys = list(range(n))
+	if order == "random":
+		rnd.shuffle(keys)
+	elif order == "reverse":
+		keys.reverse()
+	elif order == "nearly":
+		for _ in range(max(1, n // 100)):
+			i = rnd.randrange(n)
+			j = rnd.randrange(n)
+			keys[i], keys[j] = keys[j], keys[i]
+	return keys
+
+
+"""builds a tree of the keys with insert
+@rtype: AVLTree or AVLArrayTree
+"""
+def build(engine, keys):
+	tree = ENGINES[engine]()
+	for key in keys:
+		tree.insert(key, key)
+	return tree
+
+
+"""times the updates of insert / finger_insert over all the keys on an empty tree
+@rtype: (float, float, float)
+@returns: seconds, mean e, mean h
+"""
+def bench_insert(engine, keys, op):
+	tree = ENGINES[engine]()
+	insert = getattr(tree, op)
+	path_len = 0
+	promotions = 0
+	start = time.perf_counter()
+	for key in keys:
+		_, e, h = insert(key, key)
+		path_len += e
+		promotions += h
+	elapsed = time.perf_counter() - start
+	return elapsed, path_len / len(keys), promotions / len(keys)
+
+
+"""times finger_insert of the keys in increasing order on an empty tree, each key going above the max
+@rtype: (float, float, float)
+@returns: seconds, mean e, mean h
+"""
+def bench_finger_append(engine, keys, op):
+	return bench_insert(engine, sorted(keys), "finger_insert")
+
+
+"""times finger_search of all the keys in increasing order on a tree built by finger_append
+@rtype: (float, float, None)
+"""
+def bench_finger_search_sorted(engine, keys, op):
+	ordered = sorted(keys)
+	tree = ENGINES[engine]()
+	for key in ordered:
+		tree.finger_insert(key, key)
+	search = tree.finger_search
+	path_len = 0
+	start = time.perf_counter()
+	for key in ordered:
+		_, e = search(key)
+		path_len += e
+	elapsed = time.perf_counter() - start
+	return elapsed, path_len / len(keys), None
+
+
+"""times search / finger_search of all the keys on a built tree
+@rtype: (float, float, None)
+"""
+def bench_search(engine, keys, op):
+	tree = build(engine, keys)
+	search = getattr(tree, op)
+	path_len = 0
+	start = time.perf_counter()
+	for key in keys:
+		_, e = search(key)
+		path_len += e
+	elapsed = time.perf_counter() - start
+	return elapsed, path_len / len(keys), None
+
+
+"""times one search_many of all the keys (in key list order) on a built tree
+@rtype: (float, None, None)
+"""
+def bench_search_many(engine, keys, op):
+	tree = build(engine, keys)
+	start = time.perf_counter()
+	_, found = tree.search_many(keys)
+	elapsed = time.perf_counter() - start
+	if not all(found):
+		raise AssertionError("search_many missed %d keys" % found.count(False))
+	return elapsed, None, None
+
+
+"""times deleting all the keys (in key list order) from a built tree, the nodes are found beforehand
+@rtype: (float, None, None)
+"""
+def bench_delete(engine, keys, op):
+	tree = build(engine, keys)
+	nodes = [tree.search(key)[0] for key in keys]
+	start = time.perf_counter()
+	for node in nodes:
+		tree.delete(node)
+	return time.perf_counter() - start, None, None
+
+
+"""times joining the two halves of the keys around the median, REPEATS times
+(array trees are built in one store, as they are after a split)
+@rtype: (float, None, None)
+"""
+def bench_join(engine, keys, op):
+	ordered = sorted(keys)
+	mid = len(ordered) // 2
+	elapsed = 0.0
+	for _ in range(REPEATS):
+		low = ENGINES[engine].from_sorted((key, key) for key in ordered[:mid])
+		if engine == "array":
+			high = AVLArrayTree.from_sorted(((key, key) for key in ordered[mid + 1:]), low.store)
+		else:
+			high = AVLTree.from_sorted((key, key) for key in ordered[mid + 1:])
+		start = time.perf_counter()
+		joined = low.join(high, ordered[mid], ordered[mid])
+		elapsed += time.perf_counter() - start
+		if joined.size() != len(ordered):
+			raise AssertionError("join returned %d keys instead of %d" % (joined.size(), len(ordered)))
+	return elapsed, None, None
+
+
+"""times splitting a built tree at a seeded random key, REPEATS times
+@rtype: (float, None, None)
+"""
+def bench_split(engine, keys, op):
+	ordered = sorted(keys)
+	rnd = random.Random(len(keys))
+	elapsed = 0.0
+	for _ in range(REPEATS):
+		tree = ENGINES[engine].from_sorted((key, key) for key in ordered)
+		node = tree.search(rnd.choice(ordered))[0]
+		start = time.perf_counter()
+		left, right = tree.split(node)
+		elapsed += time.perf_counter() - start
+		if left.size() + right.size() != len(ordered) - 1:
+			raise AssertionError("split returned %d keys instead of %d" % (left.size() + right.size(), len(ordered) - 1))
+	return elapsed, None, None
+
+
+"""times splitting one built tree at a seeded random key REPEATS times, joining the halves back
+around the split key after each split (untimed)
+@rtype: (float, None, None)
+"""
+def bench_split_rejoin(engine, keys, op):
+	ordered = sorted(keys)
+	rnd = random.Random(len(keys))
+	tree = ENGINES[engine].from_sorted((key, key) for key in ordered)
+	elapsed = 0.0
+	for _ in range(REPEATS):
+		key = rnd.choice(ordered)
+		node = tree.search(key)[0]
+		start = time.perf_counter()
+		left, right = tree.split(node)
+		elapsed += time.perf_counter() - start
+		tree = left.join(right, key, key)
+		if tree.size() != len(ordered):
+			raise AssertionError("split and join returned %d keys instead of %d" % (tree.size(), len(ordered)))
+	return elapsed, None, None
+
+
+"""times avl_to_array on a built tree, counted per key
+@rtype: (float, None, None)
+"""
+def bench_to_array(engine, keys, op):
+	tree = build(engine, keys)
+	start = time.perf_counter()
+	tree.avl_to_array()
+	return time.perf_counter() - start, None, None
+
+
+"""times AVLTreeParallel.build of the sorted keys (a pool of os.cpu_count() workers), counted per key
+@rtype: (float, None, None)
+"""
+def bench_build_parallel(engine, keys, op):
+	items = [(key, key) for key in sorted(keys)]
+	start = time.perf_counter()
+	tree = AVLTreeParallel.build(items, engine)
+	elapsed = time.perf_counter() - start
+	if tree.size() != len(keys):
+		raise AssertionError("build returned %d keys instead of %d" % (tree.size(), len(keys)))
+	return elapsed, None, None
+
+
+"""times one search of all the keys (in key list order) on an AVLTreeSearchPool of a built tree,
+the pool being started beforehand
+@rtype: (float, None, None)
+"""
+def bench_search_many_parallel(engine, keys, op):
+	tree = build(engine, keys)
+	with AVLTreeParallel.AVLTreeSearchPool(tree) as pool:
+		start = time.perf_counter()
+		_, found = pool.search_many(keys)
+		elapsed = time.perf_counter() - start
+	if not all(found):
+		raise AssertionError("search_many missed %d keys" % found.count(False))
+	return elapsed, None, None
+
+
+"""times size() called once per key on a built tree
+@rtype: (float, None, None)
+"""
+def bench_size(engine, keys, op):
+	tree = build(engine, keys)
+	size = tree.size
+	start = time.perf_counter()
+	for _ in keys:
+		size()
+	return time.perf_counter() - start, None, None
+
+
+"""times loading a built tree from a file written by dump (load_mmap maps the file and then
+searches every key, since mapping alone reads nothing), counted per key
+@rtype: (float, None, None)
+"""
+def bench_load(engine, keys, op):
+	tree = build(engine, keys)
+	fd, path = tempfile.mkstemp(suffix=".avl")
+	os.close(fd)
+	try:
+		tree.dump(path)
+		del tree
+		start = time.perf_counter()
+		loaded = ENGINES[engine].load(path, use_mmap=op == "load_mmap")
+		if op == "load_mmap":
+			for key in keys:
+				loaded.search(key)
+		elapsed = time.perf_counter() - start
+		if loaded.size() != len(keys):
+			raise AssertionError("load returned %d keys instead of %d" % (loaded.size(), len(keys)))
+		del loaded
+	finally:
+		os.remove(path)
+	return elapsed, None, None
+
+
+"""the baseline of the mixed cases: every operation of a tree under one global mutex"""
+
+class MutexTree(object):
+
+	def __init__(self, tree):
+		self.tree = tree
+		self.lock = threading.Lock()
+
+	def search(self, key):
+		with self.lock:
+			return self.tree.search(key)
+
+	def insert(self, key, val):
+		with self.lock:
+			return self.tree.insert(key, val)
+
+	def delete_many(self, keys):
+		deleted = 0
+		with self.lock:
+			for key in keys:
+				node = self.tree.search(key)[0]
+				if node is not None:
+					self.tree.delete(node)
+					deleted += 1
+		return deleted
+
+	def avl_to_array(self):
+		with self.lock:
+			return self.tree.avl_to_array()
+
+	def size(self):
+		with self.lock:
+			return self.tree.size()
+
+	"""yields the items between lo and hi, holding the mutex until the scan is done"""
+	def items(self, lo=None, hi=None):
+		with self.lock:
+			yield from self.tree.items(lo, hi)
+
+
+"""times THREADS threads sharing one built tree, doing n operations in all:
+95% searches of random keys, 5% inserts of new keys and deletes of random keys.
+The scan cases turn 1% of the searches into scans of SCAN_KEYS keys that hand the items
+out in groups of SCAN_GROUP, with a sleep of SCAN_WAIT per group standing for the write of
+a group to a socket or a file (outside the GIL).
+*_concurrent shares a ConcurrentAVLTree, *_mutex the same tree under one global mutex.
+The result is checked against the inserts and deletes that were done.
+@rtype: (float, None, None)
+"""
+def bench_mixed(engine, keys, op):
+	scans = 0.01 if op.startswith("scan_") else 0.0
+	if op.endswith("_concurrent"):
+		if engine != "node":
+			raise ValueError("ConcurrentAVLTree shares a node engine tree")
+		tree = ConcurrentAVLTree(build(engine, keys))
+	else:
+		tree = MutexTree(build(engine, keys))
+	n = len(keys)
+	changes = [0] * THREADS
+	errors = []
+
+	def work(t):
+		try:
+			run_thread(t)
+		except Exception as e:  # reported by the case, not lost in the thread
+			errors.append(e)
+
+	def run_thread(t):
+		rnd = random.Random(t)
+		for i in range(n // THREADS):
+			r = rnd.random()
+			if r < scans:
+				lo = rnd.randrange(n)
+				for j, _ in enumerate(tree.items(lo, lo + SCAN_KEYS - 1)):
+					if j % SCAN_GROUP == 0:
+						time.sleep(SCAN_WAIT)
+			elif r < 0.95:
+				tree.search(rnd.randrange(n))
+			elif r < 0.975:
+				tree.insert(n + t + THREADS * i, None)  # a key no other thread inserts
+				changes[t] += 1
+			else:
+				changes[t] -= tree.delete_many([rnd.randrange(n)])
+
+	threads = [threading.Thread(target=work, args=(t,)) for t in range(THREADS)]
+	start = time.perf_counter()
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	elapsed = time.perf_counter() - start
+	if errors:
+		raise errors[0]
+	keys_left = [key for key, _ in tree.avl_to_array()]
+	if keys_left != sorted(keys_left) or len(keys_left) != tree.size() or tree.size() != n + sum(changes):
+		raise AssertionError("the shared tree is inconsistent after the mixed run")
+	return elapsed, None, None
+
+
+BENCHES = {
+	"insert": bench_insert,
+	"finger_insert": bench_insert,
+	"search": bench_search,
+	"finger_search": bench_search,
+	"search_many": bench_search_many,
+	"delete": bench_delete,
+	"join": bench_join,
+	"split": bench_split,
+	"avl_to_array": bench_to_array,
+	"size": bench_size,
+	"mixed_concurrent": bench_mixed,
+	"mixed_mutex": bench_mixed,
+	"scan_concurrent": bench_mixed,
+	"scan_mutex": bench_mixed,
+	"load": bench_load,
+	"load_mmap": bench_load,
+	"build_parallel": bench_build_parallel,
+	"search_many_parallel": bench_search_many_parallel,
+	"finger_append": bench_finger_append,
+	"finger_search_sorted": bench_finger_search_sorted,
+	"split_rejoin": bench_split_rejoin,
+}
+
+
+"""measures the peak traced memory of building the tree with insert
+@rtype: int
+@returns: bytes
+"""
+def peak_memory(engine, keys):
+	tracemalloc.start()
+	tree = build(engine, keys)
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	del tree
+	return peak
+
+
+"""runs one case and returns its result record; a failing operation is recorded with its error
+@rtype: dict
+"""
+def run_case(engine, order, n, op, keys):
+	record = {"engine": engine, "order": order, "n": n, "op": op}
+	try:
+		elapsed, path_len, promotions = BENCHES[op](engine, keys, op)
+	except Exception as e:  # a broken operation must not hide the other results
+		record["error"] = "%s: %s" % (type(e).__name__, e)
+		return record
+	count = REPEATS if op in ("join", "split", "split_rejoin") else n
+	record["seconds"] = elapsed
+	record["ops_per_sec"] = count / elapsed if elapsed > 0 else float("inf")
+	if path_len is not None:
+		record["mean_path_len"] = path_len
+	if promotions is not None:
+		record["mean_promotions"] = promotions
+	return record
+
+
+"""returns the current git commit of the tree, None outside a git checkout"""
+def git_commit():
+	try:
+		return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+"""compares results with a baseline run
+@rtype: list
+@returns: (case, old ops/sec, new ops/sec) for every case slower than the baseline by more than threshold
+"""
+def compare(results, baseline, threshold):
+	old = {}
+	for record in baseline["results"]:
+		if "ops_per_sec" in record:
+			old[(record["engine"], record["order"], record["n"], record["op"])] = record["ops_per_sec"]
+	regressions = []
+	for record in results:
+		case = (record["engine"], record["order"], record["n"], record["op"])
+		if case in old and "ops_per_sec" in record and record["ops_per_sec"] < old[case] * (1 - threshold):
+			regressions.append((case, old[case], record["ops_per_sec"]))
+	return regressions
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Benchmark the AVLTree operations.")
+	parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+	parser.add_argument("--orders", nargs="+", choices=ORDERS, default=list(ORDERS))
+	parser.add_argument("--engines", nargs="+", choices=sorted(ENGINES), default=["node"])
+	parser.add_argument("--ops", nargs="+", choices=OPS, default=list(OPS))
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc build runs")
+	parser.add_argument("--out", help="write the results as JSON to this path")
+	parser.add_argument("--compare", help="a JSON file of an earlier run to check for regressions")
+	parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown, as a fraction")
+	args = parser.parse_args(argv)
+	sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+
+	results = []
+	for engine in args.engines:
+		for order in args.orders:
+			for n in args.sizes:
+				keys = make_keys(n, order, args.seed)
+				peak = None if args.no_memory else peak_memory(engine, keys)
+				for op in args.ops:
+					if engine not in ENGINE_OPS.get(op, (engine,)):
+						continue
+					record = run_case(engine, order, n, op, keys)
+					if peak is not None:
+						record["peak_build_bytes"] = peak
+					results.append(record)
+					if "error" in record:
+						print("%-6s %-8s %8d %-20s ERROR %s" % (engine, order, n, op, record["error"]))
+					else:
+						print("%-6s %-8s %8d %-20s %12.0f ops/s  e=%-6s h=%s" % (engine, order, n, op,
+							record["ops_per_sec"], "%.2f" % record["mean_path_len"] if "mean_path_len" in record else "-",
+							"%.2f" % record["mean_promotions"] if "mean_promotions" in record else "-"))
+					sys.stdout.flush()
+
+	report = {
+		"meta": {
+			"commit": git_commit(),
+			"python": platform.python_version(),
+			"platform": platform.platform(),
+			"seed": args.seed,
+			"repeats": REPEATS,
+		},
+		"results": results,
+	}
+	if args.out:
+		with open(args.out, "w") as f:
+			json.dump(report, f, indent=1)
+	if args.compare:
+		with open(args.compare) as f:
+			regressions = compare(results, json.load(f), args.threshold)
+		for case, old_rate, new_rate in regressions:
+			print("REGRESSION %s: %.0f -> %.0f ops/s" % ("/".join(map(str, case)), old_rate, new_rate))
+		if regressions:
+			return 1
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,314 @@
+"""A compact binary file format for AVLTree and AVLArrayTree, and memory-mapped loading.
+
+The file holds the nodes numbered in key order (node i, 1 <= i <= n, has the i-th smallest key,
+and 0 is the virtual node), in the buffers of AVLArrayStore: keys, sizes, left/right/parent
+links and heights, then the values. So loading copies a few flat buffers and never inserts,
+and with mmap the buffers are used in place: the tree is searchable right after open, and
+only the pages a query touches are read.
+
+layout (every section starts at a multiple of 8 bytes):
+	header: magic "AVLT", version, byte order of the buffers, n, root, size of the values blob
+	keys (int64), sizes, lefts, rights, parents (int32), heights (int8): n + 1 entries each
+	value offsets (int64): n + 2 entries, the value of node i is blob[offsets[i]:offsets[i + 1]]
+	values blob: per value a tag byte (None, str, bytes or pickle) and the encoded value
+"""
+from array import array
+import mmap
+import pickle
+import struct
+import sys
+
+from AVLArrayTree import AVLArrayStore, AVLArrayTree
+from AVLTree import AVLNode, AVLTree, VIRTUAL_NODE
+
+MAGIC = b"AVLT"
+VERSION = 1
+HEADER = struct.Struct("<4sBBxxQQQ")  # magic, version, little endian?, n, root, values blob size
+BUFFERS = (("keys", "q"), ("sizes", "i"), ("lefts", "i"), ("rights", "i"), ("parents", "i"), ("heights", "b"))
+TAG_NONE, TAG_STR, TAG_BYTES, TAG_PICKLE = b"\x00", b"\x01", b"\x02", b"\x03"
+
+
+"""returns the tag byte and encoding of a value"""
+def encode_value(val):
+	if val is None:
+		return TAG_NONE
+	if type(val) is str:
+		return TAG_STR + val.encode("utf-8", "surrogatepass")
+	if type(val) is bytes:
+		return TAG_BYTES + val
+	return TAG_PICKLE + pickle.dumps(val, pickle.HIGHEST_PROTOCOL)
+
+
+"""returns the value of an encoding made by encode_value, None for an empty one (the virtual node)"""
+def decode_value(data):
+	if len(data) == 0:
+		return None
+	tag = data[:1]
+	if tag == TAG_NONE:
+		return None
+	if tag == TAG_STR:
+		return str(data[1:], "utf-8", "surrogatepass")
+	if tag == TAG_BYTES:
+		return bytes(data[1:])
+	return pickle.loads(data[1:])
+
+
+"""decodes all the values of a file at once
+@rtype: list
+@returns: the value of every node, None for the virtual node
+complexity: O(n + size of the blob)
+"""
+def decode_values(offsets, blob):
+	blob = bytes(blob)
+	offsets = offsets.tolist()
+	values = [None] * (len(offsets) - 1)
+	tag_str = TAG_STR[0]
+	for i in range(1, len(values)):
+		start = offsets[i]
+		end = offsets[i + 1]
+		if blob[start] == tag_str:  # the common case, inlined
+			values[i] = blob[start + 1:end].decode("utf-8", "surrogatepass")
+		else:
+			values[i] = decode_value(blob[start:end])
+	return values
+
+
+"""returns the number of padding bytes that bring size to a multiple of 8"""
+def padding(size):
+	return -size % 8
+
+
+"""numbers the nodes of an AVLTree in key order into fresh buffers
+@rtype: (dict, list, int)
+@returns: the buffers by name, the values and the index of the root
+complexity: O(n), using the subtree sizes instead of a map from nodes to indices
+"""
+def node_buffers(tree):
+	n = tree.size()
+	buffers = {name: array(code, [0]) * (n + 1) for name, code in BUFFERS}
+	buffers["heights"][0] = -1
+	keys, sizes, lefts, rights, parents, heights = (buffers[name] for name, _ in BUFFERS)
+	values = [None] * (n + 1)
+	if n == 0:
+		return buffers, values, 0
+	root = tree.get_root()
+	root_index = root.left.size + 1
+	stack = [(root, root_index, 0)]  # a node, its index and the index of its parent
+	while stack:
+		node, i, parent = stack.pop()
+		keys[i] = node.key
+		values[i] = node.value
+		sizes[i] = node.size
+		heights[i] = node.height
+		parents[i] = parent
+		left, right = node.left, node.right
+		if left is not VIRTUAL_NODE:
+			lefts[i] = j = i - left.right.size - 1
+			stack.append((left, j, i))
+		if right is not VIRTUAL_NODE:
+			rights[i] = j = i + right.left.size + 1
+			stack.append((right, j, i))
+	return buffers, values, root_index
+
+
+"""numbers the nodes of an AVLArrayTree in key order into fresh buffers (its store may hold
+other trees and free slots)
+@rtype: (dict, list, int)
+complexity: O(n)
+"""
+def array_buffers(tree):
+	s = tree.store
+	K, S, L, R, H, V = s.keys, s.sizes, s.lefts, s.rights, s.heights, s.values
+	n = tree.size()
+	buffers = {name: array(code, [0]) * (n + 1) for name, code in BUFFERS}
+	buffers["heights"][0] = -1
+	keys, sizes, lefts, rights, parents, heights = (buffers[name] for name, _ in BUFFERS)
+	values = [None] * (n + 1)
+	if n == 0:
+		return buffers, values, 0
+	root_index = S[L[tree.root]] + 1
+	stack = [(tree.root, root_index, 0)]
+	while stack:
+		node, i, parent = stack.pop()
+		keys[i] = K[node]
+		values[i] = V[node]
+		sizes[i] = S[node]
+		heights[i] = H[node]
+		parents[i] = parent
+		left, right = L[node], R[node]
+		if left:
+			lefts[i] = j = i - S[R[left]] - 1
+			stack.append((left, j, i))
+		if right:
+			rights[i] = j = i + S[L[right]] + 1
+			stack.append((right, j, i))
+	return buffers, values, root_index
+
+
+"""writes a tree to a file in the compact binary format
+@type tree: AVLTree or AVLArrayTree
+@type path: str
+@param path: the file to write (replaced if it exists)
+@pre: the keys are integers that fit in 64 bits
+complexity: O(n)
+"""
+def dump(tree, path):
+	with open(path, "wb") as f:
+		for part in encode(tree):
+			f.write(part)
+
+
+"""encodes a tree in the compact binary format
+@type tree: AVLTree or AVLArrayTree
+@rtype: list of bytes
+@returns: the parts of the encoding, to be written one after the other
+complexity: O(n)
+"""
+def encode(tree):
+	if isinstance(tree, AVLArrayTree):
+		buffers, values, root = array_buffers(tree)
+	else:
+		buffers, values, root = node_buffers(tree)
+	offsets = array("q", [0]) * (len(values) + 1)
+	blob = [b""]  # the virtual node has no value
+	end = 0
+	for i in range(1, len(values)):
+		data = encode_value(values[i])
+		blob.append(data)
+		end += len(data)
+		offsets[i + 1] = end
+	parts = [HEADER.pack(MAGIC, VERSION, sys.byteorder == "little", len(values) - 1, root, end)]
+	for buffer in [buffers[name] for name, _ in BUFFERS] + [offsets]:
+		data = buffer.tobytes()
+		parts.append(data)
+		parts.append(bytes(padding(len(data))))
+	parts.append(b"".join(blob))
+	return parts
+
+
+"""reads the header of a file and returns the (start, size) of its sections
+@rtype: (int, int, list, (int, int))
+@returns: n, the root, (start, size) of each of BUFFERS and of the offsets, and of the blob
+"""
+def read_layout(data):
+	if len(data) < HEADER.size:
+		raise ValueError("not an AVLTree file: too short")
+	magic, version, little, n, root, blob_size = HEADER.unpack_from(data, 0)
+	if magic != MAGIC:
+		raise ValueError("not an AVLTree file: bad magic %r" % magic)
+	if version != VERSION:
+		raise ValueError("unsupported AVLTree file version %d" % version)
+	if bool(little) != (sys.byteorder == "little"):
+		raise ValueError("the AVLTree file was written on a machine of the other byte order")
+	sections = []
+	start = HEADER.size
+	for _, code in BUFFERS + (("offsets", "q"),):
+		size = array(code).itemsize * (n + 2 if len(sections) == len(BUFFERS) else n + 1)
+		sections.append((start, size))
+		start += size + padding(size)
+	if start + blob_size > len(data):
+		raise ValueError("the AVLTree file is truncated")
+	return n, root, sections, (start, blob_size)
+
+
+"""The values of a file, decoded on access: a read-only sequence indexed by node"""
+
+class FileValues(object):
+
+	def __init__(self, offsets, blob):
+		self.offsets = offsets
+		self.blob = blob
+
+	def __len__(self):
+		return len(self.offsets) - 1
+
+	def __getitem__(self, i):
+		return decode_value(self.blob[self.offsets[i]:self.offsets[i + 1]])
+
+
+"""loads a file written by dump
+@type path: str
+@type engine: str
+@param engine: "node" for an AVLTree, "array" for an AVLArrayTree
+@type use_mmap: bool
+@param use_mmap: map the file instead of reading it; the result is then an AVLArrayTree whose
+buffers are read-only views of the file, whatever the engine: it answers queries and iterates,
+but cannot be updated
+@rtype: AVLTree or AVLArrayTree
+complexity: O(1) plus O(log n) for the min and max with use_mmap; otherwise O(n) buffer copies,
+plus one AVLNode per key for the node engine
+"""
+def load(path, engine="node", use_mmap=False):
+	with open(path, "rb") as f:
+		if use_mmap:
+			data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+		else:
+			data = memoryview(f.read())
+	return from_buffer(data, engine, use_mmap)
+
+
+"""loads a tree from an encoding held in memory (see load)
+@type data: memoryview
+@param data: the encoding, e.g. a mapped file or a shared memory block
+@type in_place: bool
+@param in_place: use the buffers of data directly instead of copying them, like use_mmap
+@rtype: AVLTree or AVLArrayTree
+"""
+def from_buffer(data, engine="node", in_place=False):
+	n, root, sections, (blob_start, blob_size) = read_layout(data)
+	views = [data[start:start + size].cast(code) for (start, size), (_, code) in zip(sections, BUFFERS + (("offsets", "q"),))]
+	blob = data[blob_start:blob_start + blob_size]
+	if in_place:
+		store = AVLArrayStore.__new__(AVLArrayStore)
+		for (name, _), view in zip(BUFFERS, views):
+			setattr(store, name, view)
+		store.values = FileValues(views[-1], blob)
+		store.free = 0
+		tree = AVLArrayTree(store)
+		tree.root = root
+		tree.update_min_max()
+		return tree
+	values = decode_values(views[-1], blob)
+	if engine == "array":
+		store = AVLArrayStore()
+		for (name, code), view in zip(BUFFERS, views):
+			setattr(store, name, array(code, view.tobytes()))
+		store.values = values
+		tree = AVLArrayTree(store)
+		tree.root = root
+		tree.update_min_max()
+		return tree
+	return node_tree(n, root, views[:len(BUFFERS)], values)
+
+
+"""makes an AVLTree of nodes numbered in key order, as in the file
+@type buffers: list
+@param buffers: the keys, sizes, lefts, rights, parents and heights of the nodes, in the order of BUFFERS
+@type values: list
+@param values: the value of every node, index 0 for the virtual node
+@rtype: AVLTree
+complexity: O(n), one AVLNode per key
+"""
+def node_tree(n, root, buffers, values):
+	keys, sizes, lefts, rights, parents, heights = buffers
+	nodes = [VIRTUAL_NODE] * (n + 1)
+	for i in range(1, n + 1):
+		node = AVLNode(keys[i], values[i])
+		node.size = sizes[i]
+		node.height = heights[i]
+		nodes[i] = node
+	for i in range(1, n + 1):
+		node = nodes[i]
+		node.left = nodes[lefts[i]]
+		node.right = nodes[rights[i]]
+		if parents[i]:
+			node.parent = nodes[parents[i]]
+		if i > 1:  # the nodes are numbered in key order
+			node.prev = nodes[i - 1]
+			nodes[i - 1].next = node
+	tree = AVLTree()
+	if n:
+		tree.set_root(nodes[root])
+		tree.min = nodes[1]
+		tree.max = nodes[n]
+	return tree
@@ -0,0 +1,220 @@
+"""Bulk building and bulk searching of AVLTree and AVLArrayTree with a pool of worker processes.
+
+build cuts the sorted keys into one contiguous range per worker, leaving one separator key out
+between every two ranges. The nodes are numbered in key order (as in AVLTreeFile), so a worker
+needs only the bounds of its range: it lays out a height-balanced subtree of those numbers in the
+buffers of AVLArrayStore (sizes, links and heights) and sends them back as a few bytes objects,
+with no per-node pickling. The parent, which has the keys and values already, concatenates the
+buffers and stitches the subtrees together with join_nodes around the separators.
+
+search_many copies the tree once into a shared memory block, in the AVLTreeFile format. Every
+worker uses the block in place as a read-only AVLArrayTree (see AVLTreeFile.from_buffer) and
+answers a slice of the keys with AVLArrayTree.search_many.
+"""
+from array import array
+import itertools
+import multiprocessing
+from multiprocessing import shared_memory
+import operator
+import os
+
+from AVLArrayTree import AVLArrayStore, AVLArrayTree
+import AVLTreeFile
+
+MIN_RANGE = 50000  # the fewest keys worth a worker, smaller inputs use fewer ranges
+LAYOUT_BUFFERS = AVLTreeFile.BUFFERS[1:]  # what a worker lays out: every buffer but the keys
+
+
+"""lays out a height-balanced subtree of the node numbers lo..hi-1, splitting each range at its
+middle like AVLTree.build_sorted (runs in a worker)
+@type lo: int
+@type hi: int
+@rtype: (int, list)
+@returns: the root and the bytes of the entries lo..hi-1 of each of LAYOUT_BUFFERS
+complexity: O(hi - lo), no recursion
+"""
+def layout_range(lo, hi):
+	first = lo
+	buffers = {name: array(code, [0]) * (hi - lo) for name, code in LAYOUT_BUFFERS}
+	sizes, lefts, rights, parents, heights = (buffers[name] for name, _ in LAYOUT_BUFFERS)
+	root = (lo + hi) // 2
+	sizes[root - first] = hi - lo
+	heights[root - first] = (hi - lo).bit_length() - 1
+	stack = [(root, lo, hi)]
+	while stack:
+		node, lo, hi = stack.pop()
+		if lo < node:  # lay out the left half
+			child = (lo + node) // 2
+			sizes[child - first] = node - lo
+			heights[child - first] = (node - lo).bit_length() - 1
+			parents[child - first] = node
+			lefts[node - first] = child
+			stack.append((child, lo, node))
+		if node + 1 < hi:  # lay out the right half
+			child = (node + 1 + hi) // 2
+			sizes[child - first] = hi - node - 1
+			heights[child - first] = (hi - node - 1).bit_length() - 1
+			parents[child - first] = node
+			rights[node - first] = child
+			stack.append((child, node + 1, hi))
+	return root, [buffers[name].tobytes() for name, _ in LAYOUT_BUFFERS]
+
+
+"""builds a dictionary from (key, value) pairs sorted by key, like from_sorted, with the
+subtrees laid out in parallel
+@type items: iterable
+@param items: (key, value) pairs in increasing key order, for equal keys the last value is kept
+@type engine: str
+@param engine: "node" for an AVLTree, "array" for an AVLArrayTree
+@type workers: int
+@param workers: the number of worker processes, os.cpu_count() if None
+@pre: the keys are integers that fit in 64 bits
+@rtype: AVLTree or AVLArrayTree
+complexity: O(n / workers) per worker, plus O(n) buffer copies and O(workers log n) joins in the
+parent; the node engine then makes one AVLNode per key in the parent, as AVLTreeFile.load does
+"""
+def build(items, engine="node", workers=None):
+	items = list(items)
+	keys = [key for key, _ in items]
+	if any(map(operator.ge, keys, itertools.islice(keys, 1, None))):
+		last = dict(items)  # the last value of every key
+		keys = list(last)
+		if any(map(operator.ge, keys, itertools.islice(keys, 1, None))):
+			raise ValueError("build got the keys out of order")
+		values = list(last.values())
+	else:
+		values = [val for _, val in items]
+	del items
+	n = len(keys)
+	workers = workers or os.cpu_count() or 1
+	ranges = max(1, min(workers, n // MIN_RANGE))
+	# the separators are the nodes s_1 < ... < s_{ranges-1}, range j holds the nodes strictly between s_j and s_{j+1}
+	separators = [j * (n + 1) // ranges for j in range(1, ranges)]
+	bounds = list(zip([0] + separators, separators + [n + 1]))
+	bounds = [(lo + 1, hi) for lo, hi in bounds]
+	if ranges == 1:
+		laid = [layout_range(*bounds[0])] if n else [(0, [b""] * len(LAYOUT_BUFFERS))]
+	else:
+		with multiprocessing.Pool(ranges) as pool:
+			laid = pool.starmap(layout_range, bounds)
+	store = AVLArrayStore()
+	store.keys.extend(keys)
+	store.values.extend(values)
+	del keys, values
+	for i, (name, code) in enumerate(LAYOUT_BUFFERS):
+		buffer = getattr(store, name)
+		for j, (_, parts) in enumerate(laid):
+			buffer.frombytes(parts[i])
+			parts[i] = None
+			if j < len(separators):
+				buffer.append(1 if name == "sizes" else 0)  # the separator, a single detached node
+	tree = AVLArrayTree(store)
+	root = laid[0][0]
+	for separator, (right, _) in zip(separators, laid[1:]):
+		root = tree.join_nodes(root, separator, right)
+	tree.root = root
+	tree.update_min_max()
+	if engine == "array":
+		return tree
+	return AVLTreeFile.node_tree(n, root, [getattr(store, name) for name, _ in AVLTreeFile.BUFFERS], store.values)
+
+
+"""searches for a batch of keys with a pool of worker processes, see AVLTreeSearchPool
+@type tree: AVLTree or AVLArrayTree
+@type keys: list or numpy.ndarray
+@rtype: (list, list)
+@returns: a tuple (results, found) in the order of keys, as AVLTree.search_many with nodes False
+"""
+def search_many(tree, keys, workers=None):
+	with AVLTreeSearchPool(tree, workers) as pool:
+		return pool.search_many(keys)
+
+
+# the tree of a worker process of AVLTreeSearchPool, with its shared memory block
+worker_block = None
+worker_tree = None
+
+
+"""the initializer of the workers of AVLTreeSearchPool: maps the tree in place"""
+def attach(name):
+	global worker_block, worker_tree
+	worker_block = shared_memory.SharedMemory(name=name)
+	worker_tree = AVLTreeFile.from_buffer(worker_block.buf, "array", True)
+
+
+"""answers a slice of the keys (runs in a worker)
+@rtype: (list, list)
+"""
+def search_slice(keys):
+	return worker_tree.search_many(keys)
+
+
+"""A pool of worker processes searching one read-only copy of a tree in shared memory.
+The copy is made once, so a pool answers any number of batches; updates of the tree made
+afterwards are not seen. Use it as a context manager, or call close.
+"""
+
+class AVLTreeSearchPool(object):
+
+	"""
+	@type tree: AVLTree or AVLArrayTree
+	@param tree: the tree to search, its keys must be integers that fit in 64 bits
+	@type workers: int
+	@param workers: the number of worker processes, os.cpu_count() if None
+	complexity: O(n) to encode the tree into the shared memory block
+	"""
+	def __init__(self, tree, workers=None):
+		self.workers = workers or os.cpu_count() or 1
+		parts = AVLTreeFile.encode(tree)
+		self.block = shared_memory.SharedMemory(create=True, size=sum(len(part) for part in parts))
+		try:
+			offset = 0
+			for part in parts:
+				self.block.buf[offset:offset + len(part)] = part
+				offset += len(part)
+			del parts
+			self.pool = multiprocessing.Pool(self.workers, attach, (self.block.name,))
+		except BaseException:
+			self.block.close()
+			self.block.unlink()
+			raise
+
+	"""searches for a batch of keys: the batch is cut into one contiguous slice per worker
+	@type keys: list or numpy.ndarray
+	@param keys: the keys to search for, in any order and possibly repeated
+	@rtype: (list, list)
+	@returns: a tuple (results, found) in the order of keys, where results[i] is the value of keys[i]
+	(None if it is not in the dictionary) and found[i] tells whether it is; found is a NumPy
+	bool array when keys is a NumPy array
+	complexity: O(m log m / workers + (m / workers) log(n / m + 1)) per worker for m keys,
+	plus shipping the keys and the values between the processes
+	"""
+	def search_many(self, keys):
+		is_array = hasattr(keys, "argsort") and hasattr(keys, "tolist")
+		if not is_array:
+			keys = list(keys)
+		step = -(-len(keys) // self.workers) or 1
+		answers = self.pool.map(search_slice, [keys[i:i + step] for i in range(0, len(keys), step)])
+		results = [result for answer, _ in answers for result in answer]
+		if is_array:
+			import numpy  # keys was a NumPy array, so NumPy is there
+			found = numpy.concatenate([found for _, found in answers] or [numpy.zeros(0, dtype=bool)])
+		else:
+			found = [hit for _, answer in answers for hit in answer]
+		return results, found
+
+	"""stops the workers and frees the shared memory block"""
+	def close(self):
+		if self.pool is None:
+			return
+		self.pool.terminate()
+		self.pool.join()
+		self.pool = None
+		self.block.close()
+		self.block.unlink()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
@@ -0,0 +1,220 @@
+"""A thread-safe AVLTree for sharing one dictionary across threads.
+
+Writers (insert, finger_insert, delete, batches) run one at a time under a lock. Readers (search,
+finger_search, rank, select, size, iteration, ...) run on the last published snapshot of the
+tree (see AVLTree.snapshot), which no writer ever changes, so they never see a half-rotated
+subtree. A reader sees every write that returned before the read started.
+
+Publication is deferred: a write only marks the published snapshot stale, and the first read
+after it publishes a new one under the lock. Taking a snapshot makes the next write copy the
+nodes of its path, so a run of writes with no read in between copies each path once, and the
+reads between two writes take no lock at all. A read waits for a writer only when it is the
+first read after a write and another write is in progress.
+
+Under the GIL, lock-free reads do not run a CPU-bound mix faster than one global mutex: in the
+95% search / 5% update cases of AVLTreeBenchmark (mixed_concurrent against mixed_mutex) the two
+are within the noise of each other. The tree wins when readers spend time outside the GIL while
+they read, e.g. a scan that writes its items out as it goes: such a reader holds the mutex for
+the whole scan, and nobody else. In the scan cases (1% of the searches turned into scans of 64
+keys written out 8 at a time, 0.1 ms per write), ConcurrentAVLTree did about 2.3 times the
+operations of the mutex at 2000 keys and 1.8 times at 100000 keys.
+"""
+import threading
+
+from AVLTree import AVLTree
+
+
+"""
+A thread-safe dictionary over an AVLTree, with the AVLTree API.
+The nodes returned by the queries belong to snapshots: read their key and value, and pass
+them back only to delete, which looks the key up again in the live tree.
+"""
+
+class ConcurrentAVLTree(object):
+
+	"""
+	@type tree: AVLTree
+	@param tree: the tree to share, a new empty tree if None; it must not be used directly afterwards
+	"""
+	def __init__(self, tree=None):
+		self.tree = AVLTree() if tree is None else tree
+		self.lock = threading.Lock()  # held by the writers, and by a read that publishes
+		self.view = self.tree.snapshot()  # the last published version, replaced whole on publishing
+		self.stale = False  # a write returned since the view was published
+
+	"""returns the published snapshot, publishing the writes made since first
+	@rtype: AVLTreeSnapshot
+	complexity: O(1)
+	"""
+	def current(self):
+		if self.stale:
+			with self.lock:
+				if self.stale:
+					self.view = self.tree.snapshot()
+					self.stale = False
+		return self.view
+
+	"""returns a read-only snapshot of the dictionary as of the last write
+	@rtype: AVLTreeSnapshot
+	complexity: O(1)
+	"""
+	def snapshot(self):
+		return self.current()
+
+	"""see AVLTree.search
+	@rtype: (AVLNode,int)
+	"""
+	def search(self, key):
+		return self.current().search(key)
+
+	"""see AVLTree.finger_search
+	@rtype: (AVLNode,int)
+	"""
+	def finger_search(self, key):
+		return self.current().finger_search(key)
+
+	"""see AVLTree.search_many, the whole batch is answered from one snapshot
+	@rtype: (list, list)
+	"""
+	def search_many(self, keys, nodes=False):
+		return self.current().search_many(keys, nodes)
+
+	"""returns the value of key, or default if key is not in the dictionary
+	@rtype: any
+	"""
+	def get(self, key, default=None):
+		node = self.current().search(key)[0]
+		return default if node is None else node.value
+
+	def __contains__(self, key):
+		return self.current().search(key)[0] is not None
+
+	def size(self):
+		return self.current().size()
+
+	def __len__(self):
+		return self.current().size()
+
+	def rank(self, key):
+		return self.current().rank(key)
+
+	def select(self, i):
+		return self.current().select(i)
+
+	def min_node(self):
+		return self.current().min_node()
+
+	def max_node(self):
+		return self.current().max_node()
+
+	def avl_to_array(self):
+		return self.current().avl_to_array()
+
+	"""see AVLTree.aggregate
+	@rtype: any
+	"""
+	def aggregate(self, lo=None, hi=None):
+		return self.current().aggregate(lo, hi)
+
+	"""lazily yields the (key, value) pairs in key order, as of the call,
+	so the caller may take as long as it likes (or update the tree) while iterating
+	@rtype: generator of (int, any)
+	complexity: O(log n + k) for k yielded pairs
+	"""
+	def items(self, lo=None, hi=None):
+		return self.current().items(lo, hi)
+
+	def keys(self, lo=None, hi=None):
+		return self.current().keys(lo, hi)
+
+	def __iter__(self):
+		return iter(self.current())
+
+	"""see AVLTree.insert
+	@rtype: (AVLNode,int,int)
+	complexity: O(log n), the first update of a path after a publish copies its O(log n) nodes
+	"""
+	def insert(self, key, val):
+		with self.lock:
+			result = self.tree.insert(key, val)
+			self.stale = True
+			return result
+
+	"""see AVLTree.finger_insert, key must still be bigger than all the keys when the lock is taken
+	@rtype: (AVLNode,int,int)
+	"""
+	def finger_insert(self, key, val):
+		with self.lock:
+			result = self.tree.finger_insert(key, val)
+			self.stale = True
+			return result
+
+	"""inserts a batch of items under a single lock, see AVLTree.insert_many
+	@rtype: (int,int,int)
+	"""
+	def insert_many(self, pairs):
+		with self.lock:
+			result = self.tree.insert_many(pairs)
+			self.stale = True
+			return result
+
+	"""deletes the key of node, if another thread did not delete it first
+	@type node: AVLNode
+	@rtype: bool
+	@returns: True if the key was deleted
+	complexity: O(log n)
+	"""
+	def delete(self, node):
+		with self.lock:
+			live = self.tree.search(node.get_key())[0]
+			if live is None:
+				return False
+			self.tree.delete(live)
+			self.stale = True
+			return True
+
+	"""deletes a batch of keys under a single lock
+	@type keys: iterable of int
+	@rtype: int
+	@returns: the number of keys that were deleted
+	"""
+	def delete_many(self, keys):
+		deleted = 0
+		with self.lock:
+			for key in keys:
+				node = self.tree.search(key)[0]
+				if node is not None:
+					self.tree.delete(node)
+					deleted += 1
+			if deleted:
+				self.stale = True
+		return deleted
+
+	"""returns a context manager that holds the write lock and gives the live tree itself,
+	for a batch of any updates; the readers see none of them until the batch ends
+	@rtype: ConcurrentAVLTreeBatch
+	"""
+	def batch(self):
+		return ConcurrentAVLTreeBatch(self)
+
+
+"""the context manager of ConcurrentAVLTree.batch, marking the published snapshot stale on exit"""
+
+class ConcurrentAVLTreeBatch(object):
+
+	def __init__(self, owner):
+		self.owner = owner
+
+	def __enter__(self):
+		owner = self.owner
+		owner.lock.acquire()
+		if owner.stale:  # publish now, so that reads inside the batch need not take the lock
+			owner.view = owner.tree.snapshot()
+			owner.stale = False
+		return owner.tree
+
+	def __exit__(self, *exc):
+		try:
+			self.owner.stale = True
+		finally:
+			self.owner.lock.release()
@@ -0,0 +1,347 @@
+"""A crash-safe AVLTree: updates go to an append-only write-ahead log before they are applied.
+
+A directory holds a checkpoint (the whole tree, in the AVLTreeFile format) and the log of the
+updates made since. Opening the directory loads the checkpoint and replays the log.
+
+log record: crc32 of the rest, op (insert or delete), key (int64), value size (uint32), and the
+value encoded as in AVLTreeFile (absent for a delete). A record cut short by a crash, or one
+that fails its crc, ends the log: it and anything after it are dropped on replay.
+
+Group commit: the log is flushed and fsynced every sync_every updates, and (with sync_ms) by a
+background thread at most sync_ms milliseconds after an update, so one fsync covers a whole
+group of updates; an update is durable once its group is synced, and a crash loses at most the
+updates of the last group. A checkpoint dumps the tree to a new file, renames it over the old
+one and empties the log. The log records set or remove a key, so replaying a log over a
+checkpoint that already holds some of its updates (a crash between the rename and the emptying)
+gives the same tree.
+"""
+import os
+import struct
+import threading
+import time
+import zlib
+
+from AVLTree import AVLTree
+import AVLTreeFile
+
+CHECKPOINT = "checkpoint.avl"
+LOG = "wal.log"
+RECORD = struct.Struct("<IBqI")  # crc32, op, key, value size
+OP_INSERT, OP_DELETE = 1, 2
+REPLAY_BATCH = 4096  # records applied per batch on replay
+SHORT_RUN = 16  # shorter runs of increasing keys are finger inserted instead of joined
+
+
+"""encodes one log record
+@type op: int
+@param op: OP_INSERT or OP_DELETE
+@rtype: bytes
+"""
+def encode_record(op, key, val=None):
+	data = AVLTreeFile.encode_value(val) if op == OP_INSERT else b""
+	body = RECORD.pack(0, op, key, len(data))[4:] + data
+	return struct.pack("<I", zlib.crc32(body)) + body
+
+
+"""decodes the records of a log, up to the first torn or corrupt one
+@type data: bytes
+@rtype: (list, int)
+@returns: the (op, key, value) records and the size of the valid prefix of data
+complexity: O(size of data)
+"""
+def decode_records(data):
+	records = []
+	pos = 0
+	end = len(data)
+	view = memoryview(data)
+	while pos + RECORD.size <= end:
+		crc, op, key, size = RECORD.unpack_from(data, pos)
+		stop = pos + RECORD.size + size
+		if stop > end or zlib.crc32(view[pos + 4:stop]) != crc or op not in (OP_INSERT, OP_DELETE):
+			break
+		val = AVLTreeFile.decode_value(view[pos + RECORD.size:stop]) if op == OP_INSERT else None
+		records.append((op, key, val))
+		pos = stop
+	return records, pos
+
+
+"""applies log records to a tree in batches. A run of inserts of increasing keys above the max
+(the log of an append-mostly workload) is built into a subtree with from_sorted and joined on at
+the max, or finger inserted when it is short; any other run of inserts goes through insert_many,
+and deletes are applied one by one
+@type tree: AVLTree
+@type records: list
+@param records: (op, key, value) records in log order
+complexity: O(k + log n) for a run of k increasing keys, O(log n) per other update
+"""
+def apply_records(tree, records):
+	for start in range(0, len(records), REPLAY_BATCH):
+		run = []
+		for op, key, val in records[start:start + REPLAY_BATCH]:
+			if op == OP_INSERT:
+				run.append((key, val))
+				continue
+			apply_inserts(tree, run)
+			run = []
+			node = tree.search(key)[0]
+			if node is not None:
+				tree.delete(node)
+		apply_inserts(tree, run)
+
+
+"""inserts a run of (key, value) pairs of the log, see apply_records"""
+def apply_inserts(tree, run):
+	if not run:
+		return
+	monotonic = tree.max is None or run[0][0] > tree.max.key
+	for i in range(1, len(run)):
+		if not monotonic:
+			break
+		monotonic = run[i][0] > run[i - 1][0]
+	if not monotonic:
+		tree.insert_many(run)
+	elif len(run) < SHORT_RUN and tree.max is not None:
+		for key, val in run:
+			tree.finger_insert(key, val)
+	else:
+		key, val = run[0]
+		tree.join(AVLTree.from_sorted(run[1:]), key, val)
+
+
+"""
+An AVLTree made durable by a write-ahead log in a directory, with the AVLTree API.
+The updates (insert, finger_insert, insert_many, delete) are logged and then applied, under a
+lock; the queries read the tree directly. Use it as a context manager, or call close.
+"""
+
+class DurableAVLTree(object):
+
+	"""opens a directory, creating it if needed, and recovers its tree
+	@type directory: str
+	@type sync_every: int
+	@param sync_every: fsync the log after this many updates, 1 to sync every update
+	@type sync_ms: float
+	@param sync_ms: also fsync the pending updates at most this many milliseconds after the first
+	of them, from a background thread; None for no time limit
+	@type checkpoint_every: int
+	@param checkpoint_every: checkpoint after this many updates, None for explicit checkpoints only
+	@pre: the keys are integers that fit in 64 bits
+	complexity: O(n) to load the checkpoint, plus the replay of the log (see apply_records)
+	"""
+	def __init__(self, directory, sync_every=1, sync_ms=None, checkpoint_every=None):
+		self.directory = directory
+		self.sync_every = max(1, sync_every)
+		self.sync_ms = sync_ms
+		self.checkpoint_every = checkpoint_every
+		self.lock = threading.Lock()
+		self.pending = 0  # updates written since the last fsync
+		self.first_pending = None  # when the oldest of them was written
+		self.logged = 0  # updates logged since the last checkpoint
+		self.syncs = 0
+		os.makedirs(directory, exist_ok=True)
+		checkpoint = os.path.join(directory, CHECKPOINT)
+		self.tree = AVLTree.load(checkpoint) if os.path.exists(checkpoint) else AVLTree()
+		self.log = open(os.path.join(directory, LOG), "a+b")
+		self.replayed = self.replay()
+		self.closed = threading.Event()
+		self.syncer = None
+		if sync_ms is not None:
+			self.syncer = threading.Thread(target=self.sync_loop, daemon=True)
+			self.syncer.start()
+
+	"""applies the log to the tree and cuts off a torn tail, so new records follow the valid ones
+	@rtype: int
+	@returns: the number of records replayed
+	"""
+	def replay(self):
+		self.log.seek(0)
+		records, valid = decode_records(self.log.read())
+		if valid < self.log.tell():
+			self.log.truncate(valid)
+			os.fsync(self.log.fileno())
+		apply_records(self.tree, records)
+		self.logged = len(records)
+		return len(records)
+
+	"""writes records to the log and counts them toward the next group commit, the lock must be held"""
+	def append(self, records):
+		self.log.write(records)
+		if self.pending == 0:
+			self.first_pending = time.monotonic()
+
+	"""ends an update: syncs the group if it is full and checkpoints when due, the lock must be held"""
+	def commit(self, count):
+		self.pending += count
+		self.logged += count
+		if self.pending >= self.sync_every:
+			self.sync_locked()
+		if self.checkpoint_every is not None and self.logged >= self.checkpoint_every:
+			self.checkpoint_locked()
+
+	"""see AVLTree.insert
+	@rtype: (AVLNode,int,int)
+	"""
+	def insert(self, key, val):
+		with self.lock:
+			self.append(encode_record(OP_INSERT, key, val))
+			result = self.tree.insert(key, val)
+			self.commit(1)
+			return result
+
+	"""see AVLTree.finger_insert
+	@rtype: (AVLNode,int,int)
+	"""
+	def finger_insert(self, key, val):
+		with self.lock:
+			self.append(encode_record(OP_INSERT, key, val))
+			result = self.tree.finger_insert(key, val)
+			self.commit(1)
+			return result
+
+	"""see AVLTree.insert_many, the batch is logged with one write
+	@rtype: (int,int,int)
+	"""
+	def insert_many(self, pairs):
+		pairs = list(pairs)
+		with self.lock:
+			self.append(b"".join([encode_record(OP_INSERT, key, val) for key, val in pairs]))
+			result = self.tree.insert_many(pairs)
+			self.commit(len(pairs))
+			return result
+
+	"""see AVLTree.delete
+	@type node: AVLNode
+	@pre: node is a real pointer to a node in self
+	"""
+	def delete(self, node):
+		if node is None:
+			return
+		with self.lock:
+			self.append(encode_record(OP_DELETE, node.get_key()))
+			self.tree.delete(node)
+			self.commit(1)
+
+	"""makes every update so far durable
+	complexity: one flush and one fsync, nothing if no update is pending
+	"""
+	def sync(self):
+		with self.lock:
+			self.sync_locked()
+
+	def sync_locked(self):
+		if self.pending == 0:
+			return
+		self.log.flush()
+		os.fsync(self.log.fileno())
+		self.pending = 0
+		self.first_pending = None
+		self.syncs += 1
+
+	"""the background thread of sync_ms: syncs a group once its oldest update is sync_ms old"""
+	def sync_loop(self):
+		limit = self.sync_ms / 1000.0
+		delay = limit
+		while not self.closed.wait(delay):
+			with self.lock:
+				age = 0.0 if self.first_pending is None else time.monotonic() - self.first_pending
+				if age >= limit:
+					self.sync_locked()
+					age = 0.0
+			delay = max(limit - age, 0.001)
+
+	"""writes the whole tree to a new checkpoint and empties the log
+	complexity: O(n)
+	"""
+	def checkpoint(self):
+		with self.lock:
+			self.checkpoint_locked()
+
+	def checkpoint_locked(self):
+		self.sync_locked()
+		path = os.path.join(self.directory, CHECKPOINT)
+		self.tree.dump(path + ".tmp")
+		with open(path + ".tmp", "rb") as f:
+			os.fsync(f.fileno())
+		os.replace(path + ".tmp", path)
+		sync_directory(self.directory)
+		self.log.truncate(0)
+		self.log.flush()
+		os.fsync(self.log.fileno())
+		self.logged = 0
+
+	"""syncs the pending updates and closes the log"""
+	def close(self):
+		if self.closed.is_set():
+			return
+		self.closed.set()
+		if self.syncer is not None:
+			self.syncer.join()
+		with self.lock:
+			self.sync_locked()
+			self.log.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def search(self, key):
+		return self.tree.search(key)
+
+	def finger_search(self, key, finger=None):
+		return self.tree.finger_search(key, finger)
+
+	"""returns the value of key, or default if key is not in the dictionary
+	@rtype: any
+	"""
+	def get(self, key, default=None):
+		node = self.tree.search(key)[0]
+		return default if node is None else node.value
+
+	def __contains__(self, key):
+		return self.tree.search(key)[0] is not None
+
+	def size(self):
+		return self.tree.size()
+
+	def __len__(self):
+		return self.tree.size()
+
+	def rank(self, key):
+		return self.tree.rank(key)
+
+	def select(self, i):
+		return self.tree.select(i)
+
+	def min_node(self):
+		return self.tree.min_node()
+
+	def max_node(self):
+		return self.tree.max_node()
+
+	def avl_to_array(self):
+		return self.tree.avl_to_array()
+
+	def items(self, lo=None, hi=None):
+		return self.tree.items(lo, hi)
+
+	def keys(self, lo=None, hi=None):
+		return self.tree.keys(lo, hi)
+
+	def __iter__(self):
+		return iter(self.tree)
+
+
+"""fsyncs a directory, so that a rename in it is durable (not possible on every platform)"""
+def sync_directory(directory):
+	try:
+		fd = os.open(directory, os.O_RDONLY)
+	except OSError:
+		return
+	try:
+		os.fsync(fd)
+	except OSError:
+		pass
+	finally:
+		os.close(fd)
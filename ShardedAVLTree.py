@@ -0,0 +1,510 @@
+"""A dictionary sharded by key range over worker processes, each owning one AVLTree.
+
+The key space is cut at sorted bounds into ranges, and the range of every shard is served by
+its own process, so the shards update their trees on separate cores instead of sharing one GIL.
+Single-key operations go to the owning shard; batches (insert_many, delete_many, search_many)
+and range scans are sent to all the shards involved before any answer is read, so the shards
+work on them at the same time, and scans are merged in key order by concatenation since the
+ranges are disjoint and sorted.
+
+Every request to a shard holds the lock of that shard only, so client threads that reach
+different shards are served in parallel (the GIL is released while they wait on the pipes).
+The routing lock is held only to look the shards up. split_shard and merge_shards move the
+ranges online: they hold the routing lock, which new lookups wait for, and the locks of the
+shards they change, while the worker cuts its tree with AVLTree.split or glues a neighbour on
+with AVLTree.join; a request that looked its shard up before the move looks it up again. Each
+shard counts its own operations and busy time, see shard_stats.
+"""
+import bisect
+from collections import Counter
+import multiprocessing
+import operator
+import threading
+import time
+
+from AVLTree import AVLTree
+
+
+"""the loop of a shard process: answers the requests of the pipe on its AVLTree
+@type conn: multiprocessing.connection.Connection
+@type items: list
+@param items: the sorted (key, value) pairs the shard starts with
+"""
+def serve(conn, items):
+	tree = AVLTree.from_sorted(items)
+	del items
+	counts = Counter()
+	busy = 0.0
+	started = time.time()
+	while True:
+		op, args = conn.recv()
+		start = time.perf_counter()
+		weight = 1  # the number of operations the request counts for
+		try:
+			if op == "insert":
+				key, val = args
+				before = tree.size()
+				if tree.max is not None and key > tree.max.key:
+					tree.finger_insert(key, val)
+				else:
+					tree.insert(key, val)
+				result = tree.size() > before
+			elif op == "insert_many":
+				result = tree.insert_many(args)[0]
+				weight = len(args)
+			elif op == "delete":
+				node = tree.search(args)[0]
+				if node is not None:
+					tree.delete(node)
+				result = node is not None
+			elif op == "delete_many":
+				result = 0
+				for key in args:
+					node = tree.search(key)[0]
+					if node is not None:
+						tree.delete(node)
+						result += 1
+				weight = len(args)
+			elif op == "search":
+				node = tree.search(args)[0]
+				result = (False, None) if node is None else (True, node.value)
+			elif op == "search_many":
+				result = tree.search_many(args)
+				weight = len(args)
+			elif op == "items":
+				result = list(tree.items(*args))
+			elif op == "size":
+				result = tree.size()
+				weight = 0
+			elif op == "stats":
+				result = {"ops": sum(counts.values()), "by_op": dict(counts), "busy_seconds": busy,
+					"seconds": time.time() - started, "keys": tree.size()}
+				weight = 0
+			elif op == "cut":
+				# split off the keys from args on (the median if None), they leave the shard
+				node = tree.select(tree.size() // 2 + 1) if args is None else tree.cursor(args).node
+				if node is None:
+					result = (None, [])
+				else:
+					left, right = tree.split(node)
+					result = (node.key, [(node.key, node.value)] + list(right.items()))
+					tree = left
+				weight = 0
+			elif op == "drain":
+				result = list(tree.items())
+				tree = AVLTree()
+				weight = 0
+			elif op == "absorb":
+				# join the items of the next range onto the tree, the smallest one separating them
+				if args:
+					other = AVLTree.from_sorted(args[1:])
+					tree.join(other, args[0][0], args[0][1])
+				result = None
+				weight = 0
+			elif op == "close":
+				conn.send((True, None))
+				return
+			else:
+				raise ValueError("unknown shard operation %r" % op)
+		except Exception as e:  # the request fails, the shard keeps serving
+			conn.send((False, e))
+			continue
+		if weight:
+			busy += time.perf_counter() - start
+			counts[op] += weight
+		conn.send((True, result))
+
+
+"""One shard of a ShardedAVLTree: a worker process and the pipe to it"""
+
+class ShardedAVLTreeShard(object):
+
+	"""
+	@type lo: any
+	@param lo: the smallest key of the range (inclusive), None for no lower bound
+	@type hi: any
+	@param hi: the end of the range (exclusive), None for no upper bound
+	@type items: list
+	@param items: the sorted (key, value) pairs of the range
+	"""
+	def __init__(self, lo, hi, items, context):
+		self.lo = lo
+		self.hi = hi
+		self.lock = threading.Lock()  # held for a whole request, so the answers come back in order
+		self.mark = 0  # the operations counted by the shard at the last rebalance
+		self.conn, child = context.Pipe()
+		self.process = context.Process(target=serve, args=(child, items), daemon=True)
+		self.process.start()
+		child.close()
+
+	"""sends a request without waiting for its answer, the lock must be held"""
+	def send(self, op, args=None):
+		self.conn.send((op, args))
+
+	"""waits for the answer of the last request sent
+	@returns: the result, the error of the shard is raised here
+	"""
+	def receive(self):
+		ok, result = self.conn.recv()
+		if not ok:
+			raise result
+		return result
+
+	"""sends a request and waits for its answer, the lock must be held"""
+	def call(self, op, args=None):
+		self.send(op, args)
+		return self.receive()
+
+	"""stops the process, the lock must be held"""
+	def stop(self):
+		self.call("close")
+		self.process.join()
+		self.conn.close()
+
+
+"""
+A dictionary over key-range shards, each an AVLTree in its own process.
+Keys must be comparable with the bounds; keys and values are pickled to reach the shards.
+Use it as a context manager, or call close.
+"""
+
+class ShardedAVLTree(object):
+
+	"""
+	@type bounds: list
+	@param bounds: the sorted keys where the shards start, every key below bounds[0] goes to the first
+	shard, so there are len(bounds) + 1 shards
+	@type items: iterable
+	@param items: (key, value) pairs sorted by key to start with
+	"""
+	def __init__(self, bounds=(), items=()):
+		bounds = list(bounds)
+		if any(a >= b for a, b in zip(bounds, bounds[1:])):
+			raise ValueError("the bounds of the shards must be strictly increasing")
+		self.context = multiprocessing.get_context()
+		self.lock = threading.Lock()  # the routing lock, held to look up the shards of a request
+		self.bounds = bounds
+		items = list(items)
+		los = [None] + bounds
+		his = bounds + [None]
+		self.shards = []
+		for lo, hi in zip(los, his):
+			start = 0 if lo is None else bisect.bisect_left(items, lo, key=operator.itemgetter(0))
+			end = len(items) if hi is None else bisect.bisect_left(items, hi, key=operator.itemgetter(0))
+			self.shards.append(ShardedAVLTreeShard(lo, hi, items[start:end], self.context))
+
+	"""builds a dictionary of sorted (key, value) pairs cut into shards of about the same size
+	@type items: iterable
+	@type shards: int
+	@param shards: the number of shards, os.cpu_count() if None
+	@rtype: ShardedAVLTree
+	complexity: O(n), the shards build their trees with from_sorted in parallel
+	"""
+	@classmethod
+	def from_sorted(cls, items, shards=None):
+		items = list(items)
+		shards = shards or multiprocessing.cpu_count()
+		bounds = []
+		for j in range(1, shards):
+			key = items[j * len(items) // shards][0] if items else None
+			if key is not None and (not bounds or key > bounds[-1]):
+				bounds.append(key)
+		return cls(bounds, items)
+
+	"""returns the shard whose range holds key, the routing lock must be held
+	@rtype: ShardedAVLTreeShard
+	complexity: O(log s) for s shards
+	"""
+	def route(self, key):
+		return self.shards[bisect.bisect_right(self.bounds, key)]
+
+	"""sends one request to the shard of key and waits for its answer. The routing lock is released
+	before the lock of the shard is taken, so a busy shard holds up its own requests only; if the
+	ranges moved in between, the shard is looked up again
+	"""
+	def request(self, key, op, args):
+		while True:
+			with self.lock:
+				bounds = self.bounds
+				shard = self.route(key)
+			with shard.lock:
+				if self.bounds is bounds:  # the ranges only move under the locks of the shards they change
+					return shard.call(op, args)
+
+	"""sends a request to several shards and then waits for all the answers, so the shards serve it
+	at the same time
+	@type batches: dict
+	@param batches: the argument of the request of each shard index
+	@type bounds: list
+	@param bounds: the bounds the shard indices were computed with, None for the current ones
+	@rtype: dict
+	@returns: the answer of each shard index, None if a rebalance changed the bounds in between
+	"""
+	def scatter(self, op, batches, bounds=None):
+		with self.lock:
+			if bounds is None:
+				bounds = self.bounds
+			elif bounds is not self.bounds:
+				return None
+			shards = [(i, self.shards[i]) for i in sorted(batches)]
+		for _, shard in shards:  # in key order, like every holder of several shard locks
+			shard.lock.acquire()
+		try:
+			if self.bounds is not bounds:  # a rebalance came between the lookup and the locks
+				return None
+			for i, shard in shards:
+				shard.send(op, batches[i])
+			answers = {}
+			error = None
+			for i, shard in shards:  # read every answer, so that no pipe gets out of step
+				try:
+					answers[i] = shard.receive()
+				except Exception as e:
+					error = error or e
+			if error is not None:
+				raise error
+			return answers
+		finally:
+			for _, shard in shards:
+				shard.lock.release()
+
+	"""sends a batch of keys (or of entries with keys) to the shards, each getting its part
+	@type entries: list
+	@type keys: list
+	@param keys: the key of every entry
+	@rtype: (dict, dict)
+	@returns: the positions in entries of the part of each shard index, and the answers of the shards
+	"""
+	def scatter_keys(self, op, entries, keys):
+		while True:
+			with self.lock:
+				bounds = self.bounds
+			groups = {}
+			for position, key in enumerate(keys):
+				groups.setdefault(bisect.bisect_right(bounds, key), []).append(position)
+			batches = {i: [entries[j] for j in positions] for i, positions in groups.items()}
+			answers = self.scatter(op, batches, bounds)
+			if answers is not None:
+				return groups, answers
+
+	"""inserts key with its value, or updates the value of an existing key
+	@rtype: bool
+	@returns: True if the key is new
+	complexity: O(log(n/s)) in the shard (finger_insert for a key above its max), plus a round trip
+	"""
+	def insert(self, key, val):
+		return self.request(key, "insert", (key, val))
+
+	"""inserts a batch of items, every shard inserting its part at the same time (see AVLTree.insert_many)
+	@type pairs: iterable
+	@param pairs: (key, value) pairs in any order, for equal keys the last value is kept
+	@rtype: int
+	@returns: the number of new keys
+	"""
+	def insert_many(self, pairs):
+		pairs = list(pairs)
+		return sum(self.scatter_keys("insert_many", pairs, [key for key, _ in pairs])[1].values())
+
+	"""deletes key
+	@rtype: bool
+	@returns: True if the key was in the dictionary
+	"""
+	def delete(self, key):
+		return self.request(key, "delete", key)
+
+	"""deletes a batch of keys, every shard deleting its part at the same time
+	@rtype: int
+	@returns: the number of deleted keys
+	"""
+	def delete_many(self, keys):
+		keys = list(keys)
+		return sum(self.scatter_keys("delete_many", keys, keys)[1].values())
+
+	"""returns the value of key, or default if key is not in the dictionary
+	@rtype: any
+	"""
+	def get(self, key, default=None):
+		found, val = self.request(key, "search", key)
+		return val if found else default
+
+	def __contains__(self, key):
+		return self.request(key, "search", key)[0]
+
+	"""searches for a batch of keys, every shard searching its part at the same time
+	@type keys: iterable
+	@rtype: (list, list)
+	@returns: a tuple (results, found) in the order of keys, where results[i] is the value of keys[i]
+	(None if it is not in the dictionary) and found[i] tells whether it is
+	"""
+	def search_many(self, keys):
+		keys = list(keys)
+		results = [None] * len(keys)
+		found = [False] * len(keys)
+		groups, answers = self.scatter_keys("search_many", keys, keys)
+		for i, positions in groups.items():
+			shard_results, shard_found = answers[i]
+			for j, result, hit in zip(positions, shard_results, shard_found):
+				results[j] = result
+				found[j] = hit
+		return results, found
+
+	"""returns the (key, value) pairs between lo and hi (inclusive) in key order, every shard
+	of the range reading its part at the same time
+	@type lo: any
+	@param lo: smallest key, None for no lower bound
+	@type hi: any
+	@param hi: largest key, None for no upper bound
+	@rtype: list
+	complexity: O(s log(n/s) + k) for k pairs in s shards, plus shipping the pairs
+	"""
+	def items(self, lo=None, hi=None):
+		answers = None
+		while answers is None:
+			with self.lock:
+				bounds = self.bounds
+			first_shard = 0 if lo is None else bisect.bisect_right(bounds, lo)
+			last_shard = len(bounds) if hi is None else bisect.bisect_right(bounds, hi)
+			answers = self.scatter("items", {i: (lo, hi) for i in range(first_shard, last_shard + 1)}, bounds)
+		return [pair for i in sorted(answers) for pair in answers[i]]
+
+	"""returns the keys between lo and hi (inclusive) in key order
+	@rtype: list
+	"""
+	def keys(self, lo=None, hi=None):
+		return [key for key, _ in self.items(lo, hi)]
+
+	def __iter__(self):
+		return iter(self.keys())
+
+	"""sends a request to every shard (see scatter)
+	@rtype: list
+	@returns: (shard, answer) pairs in key order
+	"""
+	def scatter_all(self, op):
+		answers = None
+		while answers is None:
+			with self.lock:
+				bounds = self.bounds
+				shards = list(self.shards)
+			answers = self.scatter(op, {i: None for i in range(len(shards))}, bounds)
+		return [(shard, answers[i]) for i, shard in enumerate(shards)]
+
+	"""returns the number of keys, the sum of the sizes of the shards
+	@rtype: int
+	"""
+	def size(self):
+		return sum(size for _, size in self.scatter_all("size"))
+
+	def __len__(self):
+		return self.size()
+
+	"""returns the statistics of every shard, in key order
+	@rtype: list of dict
+	@returns: per shard its range (lo, hi), keys, ops (by_op per operation, a batch counting one per key),
+	busy_seconds spent serving them, seconds since it started, ops_per_sec over its busy time
+	and load, the fraction of its time it was busy
+	"""
+	def shard_stats(self):
+		return [record for _, record in self.collect_stats()]
+
+	"""the statistics of shard_stats, with the shard of each
+	@rtype: list of (ShardedAVLTreeShard, dict)
+	"""
+	def collect_stats(self):
+		collected = self.scatter_all("stats")
+		for shard, record in collected:
+			record["lo"], record["hi"] = shard.lo, shard.hi
+			busy = record["busy_seconds"]
+			record["ops_per_sec"] = record["ops"] / busy if busy > 0 else 0.0
+			record["load"] = busy / record["seconds"] if record["seconds"] > 0 else 0.0
+		return collected
+
+	"""splits a shard in two with AVLTree.split, the keys from key on moving to a new shard process
+	@type i: int
+	@param i: the index of the shard in key order
+	@type key: any
+	@param key: the first key of the new shard (rounded up to a key of the shard), None for the median
+	@rtype: bool
+	@returns: False if the shard has no key to split at (it is empty, or would keep no range)
+	complexity: O(log n) for the split, plus O(m) to move the m keys to the new process
+	"""
+	def split_shard(self, i, key=None):
+		with self.lock:
+			shard = self.shards[i]
+			with shard.lock:
+				if key is not None and ((shard.lo is not None and key <= shard.lo) or (shard.hi is not None and key >= shard.hi)):
+					raise ValueError("key %r is not inside the range of shard %d" % (key, i))
+				bound, moved = shard.call("cut", key)
+				if bound is None or (shard.lo is not None and bound <= shard.lo):
+					if moved:
+						shard.call("absorb", moved)  # nothing stays below the bound, put the keys back
+					return False
+				new = ShardedAVLTreeShard(bound, shard.hi, moved, self.context)
+				shard.hi = bound
+				self.shards = self.shards[:i + 1] + [new] + self.shards[i + 1:]
+				self.bounds = self.bounds[:i] + [bound] + self.bounds[i:]  # a new list, see scatter
+		return True
+
+	"""merges a shard with the next one using AVLTree.join, and stops the process of the next one
+	@type i: int
+	@param i: the index of the first of the two shards, in key order
+	complexity: O(m) to move the m keys of the next shard, plus O(log n) for the join
+	"""
+	def merge_shards(self, i):
+		with self.lock:
+			shard, next_shard = self.shards[i], self.shards[i + 1]
+			with shard.lock, next_shard.lock:
+				shard.call("absorb", next_shard.call("drain"))
+				next_shard.stop()
+				shard.hi = next_shard.hi
+				self.shards = self.shards[:i + 1] + self.shards[i + 2:]
+				self.bounds = self.bounds[:i] + self.bounds[i + 1:]
+
+	"""merges cold neighbours and splits the hot shards at their median, by the operations
+	they served since the last call (or since they started); one thread at a time may rebalance
+	@type hot: float
+	@param hot: split a shard that served more than hot times the mean number of operations
+	@type cold: float
+	@param cold: merge two neighbours that together served less than cold times the mean
+	@rtype: (int, int)
+	@returns: the number of splits and the number of merges
+	"""
+	def rebalance(self, hot=2.0, cold=0.5):
+		entries = []  # [shard, recent ops, keys] in key order
+		for shard, record in self.collect_stats():
+			entries.append([shard, record["ops"] - shard.mark, record["keys"]])
+			shard.mark = record["ops"]
+		mean = sum(ops for _, ops, _ in entries) / len(entries)
+		splits = merges = 0
+		if mean == 0:
+			return splits, merges
+		i = 0
+		while i + 1 < len(entries):
+			if entries[i][1] + entries[i + 1][1] < cold * mean:
+				self.merge_shards(self.shards.index(entries[i][0]))
+				entries[i][1] += entries[i + 1][1]
+				entries[i][2] += entries[i + 1][2]
+				del entries[i + 1]
+				merges += 1
+			else:
+				i += 1
+		for shard, ops, keys in entries:
+			if ops > hot * mean and keys > 1 and self.split_shard(self.shards.index(shard)):
+				splits += 1
+		return splits, merges
+
+	"""stops all the shard processes"""
+	def close(self):
+		with self.lock:
+			for shard in self.shards:
+				with shard.lock:
+					shard.stop()
+			self.shards = []
+			self.bounds = []
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
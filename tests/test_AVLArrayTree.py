@@ -0,0 +1,122 @@
+import random
+
+import pytest
+
+from AVLArrayTree import AVLArrayStore, AVLArrayTree
+from treecheck import array_keys, check_array_tree
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_updates_keep_invariants(seed):
+	rnd = random.Random(seed)
+	tree = AVLArrayTree()
+	ref = {}
+	for step in range(300):
+		op = rnd.random()
+		key = rnd.randrange(300)
+		if op < 0.35:
+			node, e, h = tree.insert(key, step)
+			assert tree.get_key(node) == key and e >= 0 and h >= 0
+			ref[key] = step
+		elif op < 0.45:
+			if key in ref:
+				continue
+			assert tree.get_key(tree.finger_insert(key, step)[0]) == key
+			ref[key] = step
+		elif op < 0.7:
+			node = tree.search(key)[0]
+			assert (node is not None) == (key in ref)
+			if node is not None:
+				assert tree.get_value(node) == ref.pop(key)
+				tree.delete(node)
+		elif op < 0.8:
+			if not ref:
+				continue
+			key = rnd.choice(list(ref))
+			left, right = tree.split(tree.search(key)[0])
+			assert check_array_tree(left) == [k for k in sorted(ref) if k < key]
+			assert check_array_tree(right) == [k for k in sorted(ref) if k > key]
+			tree = left.join(right, key, step)
+			ref[key] = step
+		else:
+			keys = [rnd.randrange(300) for _ in range(10)]
+			results, found = tree.search_many(keys)
+			assert found == [k in ref for k in keys]
+			assert results == [ref.get(k) for k in keys]
+			node = tree.finger_search(key)[0]
+			assert (node is not None) == (key in ref)
+		assert check_array_tree(tree) == sorted(ref)
+		assert list(tree.items()) == sorted(ref.items())
+
+
+def test_deleted_slots_are_reused():
+	tree = AVLArrayTree.from_sorted((key, key) for key in range(100))
+	slots = len(tree.store.keys)
+	for key in range(0, 100, 2):
+		tree.delete(tree.search(key)[0])
+	for key in range(100, 150):
+		tree.insert(key, key)
+	assert len(tree.store.keys) == slots
+	assert check_array_tree(tree) == list(range(1, 100, 2)) + list(range(100, 150))
+
+
+def test_join_trees_of_other_stores():
+	low = AVLArrayTree.from_sorted((key, key) for key in range(50))
+	high = AVLArrayTree.from_sorted((key, key) for key in range(51, 60))
+	assert low.store is not high.store
+	joined = low.join(high, 50, 50)
+	assert check_array_tree(joined) == list(range(60))
+	assert check_array_tree(high) == []
+	shared = AVLArrayStore()
+	a = AVLArrayTree.from_sorted([(1, None)], shared)
+	b = AVLArrayTree.from_sorted([(3, None)], shared)
+	assert check_array_tree(b.join(a, 2, None)) == [1, 2, 3]
+
+
+@pytest.mark.parametrize("n", [0, 1, 2, 5, 64, 1000])
+def test_from_sorted(n):
+	tree = AVLArrayTree.from_sorted((key, -key) for key in range(n))
+	assert check_array_tree(tree) == list(range(n))
+	assert [key for key, _ in tree.avl_to_array()] == list(range(n))
+
+
+def test_join_frees_the_slots_of_the_other_store():
+	low = AVLArrayTree.from_sorted((key, key) for key in range(50))
+	high = AVLArrayTree.from_sorted((key, key) for key in range(51, 60))
+	store = high.store
+	slots = len(store.keys)
+	low.join(high, 50, 50)
+	assert check_array_tree(high) == []
+	# the 9 slots of high are reused by the next trees of its store
+	again = AVLArrayTree(store)
+	for key in range(9):
+		again.insert(key, key)
+	assert len(store.keys) == slots
+	assert check_array_tree(again) == list(range(9))
+
+
+def test_split_of_none_and_of_an_empty_tree():
+	tree = AVLArrayTree.from_sorted((key, key) for key in range(10))
+	assert tree.split(None) == (None, None)
+	assert check_array_tree(tree) == list(range(10))
+	assert AVLArrayTree().split(None) == (None, None)
+
+
+def test_finger_insert_updates_an_existing_key():
+	tree = AVLArrayTree.from_sorted((key, key) for key in range(10))
+	node, _, h = tree.finger_insert(7, "new")
+	assert tree.get_key(node) == 7 and tree.get_value(node) == "new" and h == 0
+	assert check_array_tree(tree) == list(range(10))
+	assert len(tree.store.keys) == 11
+
+
+@pytest.mark.parametrize("kind", ["numpy", "fake"])
+def test_search_many_of_an_array(monkeypatch, kind):
+	tree = AVLArrayTree.from_sorted((key, str(key)) for key in range(0, 100, 3))
+	keys = [42, 7, 42, 99, -1, 0, 7, 1000, 3]
+	array, flags = array_keys(kind, keys, monkeypatch)
+	results, found = tree.search_many(array)
+	assert flags(found) == [key % 3 == 0 and 0 <= key < 100 for key in keys]
+	assert results == [str(key) if key % 3 == 0 and 0 <= key < 100 else None for key in keys]
+	nodes, _ = tree.search_many(array, nodes=True)
+	assert [node and tree.get_key(node) for node in nodes] == [key if result else None for key, result in zip(keys, results)]
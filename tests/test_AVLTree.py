@@ -0,0 +1,444 @@
+import random
+
+import pytest
+
+from AVLTree import AVLAugmentation, AVLNode, AVLTree, AVLTreeCache
+from treecheck import array_keys, check_snapshot, check_tree
+
+
+def make_tree(keys):
+	tree = AVLTree()
+	for key in keys:
+		tree.insert(key, str(key))
+	return tree
+
+
+@pytest.mark.parametrize("keys, lo, hi", [
+	([1, 2, 3, 4, 11, 12, 16, 17, 18, 20, 26], 2, 5),
+	([16, 27, 3, 10, 28, 9, 5, 6, 11, 25, 14, 19, 29, 8, 18, 2, 23, 4, 17, 24], 16, 16),
+])
+def test_delete_range_keep_with_snapshot(keys, lo, hi):
+	tree = make_tree(keys)
+	items = sorted((key, str(key)) for key in keys)
+	snapshot = tree.snapshot()
+	removed = tree.delete_range(lo, hi, True)
+	assert check_tree(removed) == [key for key, _ in items if lo <= key <= hi]
+	assert check_tree(tree) == [key for key, _ in items if not lo <= key <= hi]
+	assert list(tree.keys()) == check_tree(tree)
+	check_snapshot(snapshot, items)
+
+
+def test_delete_range_of_an_empty_range_keeps_the_augmentation():
+	tree = AVLTree.from_sorted((key, key) for key in range(10))
+	tree.set_augmentation(AUGMENTS["sum"])
+	removed = tree.delete_range(5, 2, True)
+	assert removed.augment is tree.augment
+	assert check_tree(removed) == [] and removed.aggregate() == 0
+	removed.insert(3, 3)
+	assert removed.aggregate() == 3
+	assert tree.delete_range(5, 2) == 0
+	assert check_tree(tree) == list(range(10))
+
+
+@pytest.mark.parametrize("seed", range(300))
+@pytest.mark.parametrize("snap", [False, True])
+def test_range_deletes(seed, snap):
+	rnd = random.Random(seed)
+	keys = rnd.sample(range(60), rnd.randrange(1, 40))
+	tree = make_tree(keys)
+	items = sorted((key, str(key)) for key in keys)
+	snapshot = tree.snapshot() if snap else None
+	lo = rnd.randrange(60)
+	hi = lo + rnd.randrange(20)
+	keep = rnd.random() < 0.5
+	op = rnd.choice(["delete_range", "delete_below", "delete_above"])
+	if op == "delete_range":
+		inside = lambda key: lo <= key <= hi
+		removed = tree.delete_range(lo, hi, keep)
+	elif op == "delete_below":
+		inside = lambda key: key < lo
+		removed = tree.delete_below(lo, keep)
+	else:
+		inside = lambda key: key > lo
+		removed = tree.delete_above(lo, keep)
+	gone = [key for key, _ in items if inside(key)]
+	assert check_tree(tree) == [key for key, _ in items if not inside(key)]
+	if keep:
+		assert check_tree(removed) == gone
+		assert list(removed.items()) == [(key, str(key)) for key in gone]
+	else:
+		assert removed == len(gone)
+	if snapshot is not None:
+		check_snapshot(snapshot, items)
+	# the parts stay usable as live trees
+	tree.insert(lo, "x")
+	check_tree(tree)
+	if keep:
+		removed.insert(-1, "x")
+		check_tree(removed)
+
+
+def items_of(ref):
+	return sorted(ref.items())
+
+
+"""runs a random mix of updates on a tree and a dict, checking every invariant after each one"""
+def run_updates(rnd, steps, snap, cache, space=200, augment=None):
+	tree = AVLTree(augment)
+	if cache:
+		tree.enable_cache(8)
+	ref = {}
+	snapshots = []  # (snapshot, its items)
+	stale = []  # nodes of tree returned before a snapshot, delete accepts them
+	for step in range(steps):
+		op = rnd.random()
+		key = rnd.randrange(space)
+		val = "v%d" % step
+		if op < 0.25:
+			node, e, h = tree.insert(key, val)
+			assert node.key == key and e >= 0 and h >= 0
+			ref[key] = val
+		elif op < 0.35:
+			if key in ref:
+				continue
+			node = tree.finger_insert(key, val)[0]
+			assert node.key == key
+			ref[key] = val
+		elif op < 0.5:
+			if not ref:
+				continue
+			key = rnd.choice(list(ref))
+			node = rnd.choice([node for node in stale if node.key == key] or [tree.search(key)[0]])
+			tree.delete(node)
+			del ref[key]
+		elif op < 0.6:
+			pairs = [(rnd.randrange(space), "%s/%d" % (val, i)) for i in range(rnd.randrange(1, 12))]
+			new = len({k for k, _ in pairs} - set(ref))
+			assert tree.insert_many(pairs)[0] == new
+			ref.update(pairs)
+		elif op < 0.68:
+			if not ref:
+				continue
+			key = rnd.choice(list(ref))
+			left, right = tree.split(tree.search(key)[0])
+			assert check_tree(left) == [k for k in sorted(ref) if k < key]
+			assert check_tree(right) == [k for k in sorted(ref) if k > key]
+			assert check_tree(tree) == []
+			tree = left.join(right, key, val) if rnd.random() < 0.5 else right.join(left, key, val)
+			ref[key] = val
+		elif op < 0.76:
+			lo = key
+			hi = lo + rnd.randrange(30)
+			removed = tree.delete_range(lo, hi, True)
+			gone = {k: v for k, v in ref.items() if lo <= k <= hi}
+			assert list(removed.items()) == items_of(gone)
+			check_tree(removed)
+			for k in gone:
+				del ref[k]
+			if rnd.random() < 0.5:  # put them back
+				tree = tree.union(removed, destroy=True)
+				stale = []
+				ref.update(gone)
+		elif op < 0.86:
+			other = {rnd.randrange(space): "o%d" % i for i in range(rnd.randrange(20))}
+			other_tree = AVLTree.from_unsorted(other.items())
+			destroy = rnd.random() < 0.5
+			kind = rnd.choice(["union", "intersection", "difference"])
+			before = items_of(ref)
+			result = getattr(tree, kind)(other_tree, destroy)
+			if kind == "union":
+				expected = dict(ref)
+				expected.update(other)
+			elif kind == "intersection":
+				expected = {k: v for k, v in ref.items() if k in other}
+			else:
+				expected = {k: v for k, v in ref.items() if k not in other}
+			assert check_tree(result) == sorted(expected)
+			assert list(result.items()) == items_of(expected)
+			if destroy:
+				assert check_tree(tree) == [] and check_tree(other_tree) == []
+			else:
+				assert list(tree.items()) == before and check_tree(tree) == sorted(ref)
+				assert list(other_tree.items()) == items_of(other)
+			tree = result
+			stale = []
+			if cache:
+				tree.enable_cache(8)
+			ref = expected
+		elif op < 0.94 and snap:
+			snapshots.append((tree.snapshot(), items_of(ref)))
+			stale.extend(node for node in tree.nodes() if rnd.random() < 0.1)
+		else:
+			node, _ = tree.search(key)
+			assert (node is not None) == (key in ref)
+			assert (tree.finger_search(key)[0] is not None) == (key in ref)
+			keys = [rnd.randrange(space) for _ in range(10)]
+			results, found = tree.search_many(keys)
+			assert found == [k in ref for k in keys]
+			assert results == [ref.get(k) for k in keys]
+			if augment is not None:
+				lo = rnd.choice([None, key])
+				hi = rnd.choice([None, key + rnd.randrange(50)])
+				inside = [(k, v) for k, v in items_of(ref) if (lo is None or k >= lo) and (hi is None or k <= hi)]
+				assert tree.aggregate(lo, hi) == expected_aggregate(augment, inside)
+				for snapshot, items in snapshots:
+					assert snapshot.aggregate() == expected_aggregate(augment, items)
+		keys = check_tree(tree)
+		assert keys == sorted(ref)
+		assert list(tree.items()) == items_of(ref)
+		for snapshot, items in snapshots:
+			check_snapshot(snapshot, items)
+	return tree, ref
+
+
+@pytest.mark.parametrize("seed", range(25))
+@pytest.mark.parametrize("snap", [False, True])
+@pytest.mark.parametrize("cache", [False, True])
+def test_updates_keep_invariants(seed, snap, cache):
+	run_updates(random.Random(seed), 250, snap, cache)
+
+
+@pytest.mark.parametrize("n", [0, 1, 2, 3, 7, 100, 1000])
+def test_bulk_builds_and_order_statistics(n):
+	rnd = random.Random(n)
+	items = [(key * 3, str(key)) for key in range(n)]
+	shuffled = items + [(key, "dup") for key, _ in items[:n // 4]]
+	rnd.shuffle(shuffled)
+	for tree in (AVLTree.from_sorted(items), AVLTree.from_unsorted(shuffled + items)):
+		assert check_tree(tree) == [key for key, _ in items]
+		assert list(tree.items()) == items
+		assert [node.key for node in tree.nodes(reverse=True)] == [key for key, _ in reversed(items)]
+		assert list(tree.keys(10, 50)) == [key for key, _ in items if 10 <= key <= 50]
+		for i, (key, _) in enumerate(items):
+			assert tree.rank(key) == i + 1 and tree.select(i + 1).key == key
+		assert tree.select(0) is None and tree.select(n + 1) is None
+	with pytest.raises(ValueError):
+		AVLTree.from_sorted([(2, None), (1, None)])
+
+
+def expected_aggregate(augment, items):
+	agg = augment.identity
+	for key, val in items:
+		agg = augment.combine(agg, augment.project(key, val))
+	return agg
+
+
+AUGMENTS = {
+	"sum": AVLAugmentation.sum(lambda key, val: key),
+	"max": AVLAugmentation.max(lambda key, val: -key),
+	# not commutative, so the order of combine matters
+	"concat": AVLAugmentation(lambda a, b: a + b, "", lambda key, val: "%d," % key),
+}
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("augment", sorted(AUGMENTS))
+def test_aggregates_follow_updates(seed, augment):
+	run_updates(random.Random(seed), 200, True, False, augment=AUGMENTS[augment])
+
+
+def test_set_augmentation_after_snapshot():
+	tree = AVLTree.from_sorted((key, key) for key in range(100))
+	snapshot = tree.snapshot()
+	tree.set_augmentation(AUGMENTS["sum"])
+	check_tree(tree)
+	assert tree.aggregate(10, 19) == sum(range(10, 20))
+	check_snapshot(snapshot, [(key, key) for key in range(100)])
+	with pytest.raises(ValueError):
+		AVLTree().aggregate()
+
+
+@pytest.mark.parametrize("augment", [None, "concat"])
+def test_insert_many_refreshes_each_path_once(monkeypatch, augment):
+	augment = AUGMENTS.get(augment)
+	items = [(key, str(key)) for key in range(0, 32768, 2)]
+	tree = AVLTree.from_sorted(items)
+	tree.set_augmentation(augment)
+	snapshot = tree.snapshot()
+	calls = [0]
+	set_size = AVLNode.set_size
+
+	def counting_set_size(node, size):
+		calls[0] += 1
+		set_size(node, size)
+
+	monkeypatch.setattr(AVLNode, "set_size", counting_set_size)
+	# 64 new keys next to each other, and 64 new values
+	pairs = [(key, "new") for key in range(1001, 1129, 2)] + [(key, "new") for key in range(20000, 20128, 2)]
+	assert tree.insert_many(pairs)[0] == 64
+	monkeypatch.undo()
+	# a refresh from every new key to the root would be 64 * 14 calls
+	assert calls[0] < 400
+	expected = sorted(dict(items + pairs).items())
+	assert check_tree(tree) == [key for key, _ in expected]
+	assert list(tree.items()) == expected
+	if augment is not None:
+		assert tree.aggregate(900, 20100) == expected_aggregate(augment, [item for item in expected if 900 <= item[0] <= 20100])
+	check_snapshot(snapshot, items)
+
+
+@pytest.mark.parametrize("kind", ["numpy", "fake"])
+def test_search_many_of_an_array(monkeypatch, kind):
+	tree = AVLTree.from_sorted((key, str(key)) for key in range(0, 100, 3))
+	keys = [42, 7, 42, 99, -1, 0, 7, 1000, 3]
+	array, flags = array_keys(kind, keys, monkeypatch)
+	results, found = tree.search_many(array)
+	assert flags(found) == [key % 3 == 0 and 0 <= key < 100 for key in keys]
+	assert results == [str(key) if key % 3 == 0 and 0 <= key < 100 else None for key in keys]
+	nodes, _ = tree.search_many(array, nodes=True)
+	assert [node and node.key for node in nodes] == [key if result else None for key, result in zip(keys, results)]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_finger_search_from_any_node(seed):
+	rnd = random.Random(seed)
+	keys = sorted(rnd.sample(range(2000), 300))
+	tree = make_tree(rnd.sample(keys, len(keys)))
+	nodes = list(tree.nodes())
+	for _ in range(300):
+		finger = rnd.choice(nodes)
+		key = rnd.randrange(-5, 2005)
+		node, e = tree.finger_search(key, finger)
+		assert (node is not None) == (key in keys) and e >= 0
+		if node is not None:
+			assert node.key == key
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_cursor_walks_and_seeks(seed):
+	rnd = random.Random(seed)
+	keys = sorted(rnd.sample(range(1000), 200))
+	tree = make_tree(keys)
+	cursor = tree.cursor()
+	walked = []
+	while cursor.node is not None:
+		walked.append(cursor.node.key)
+		cursor.next()
+	assert walked == keys
+	cursor = tree.cursor(keys[-1])
+	walked = []
+	while cursor.node is not None:
+		walked.append(cursor.node.key)
+		cursor.prev()
+	assert walked == keys[::-1]
+	cursor = tree.cursor(rnd.randrange(1000))
+	for _ in range(300):
+		key = rnd.randrange(-5, 1005)
+		at_least = [k for k in keys if k >= key]
+		node = cursor.seek(key)
+		assert (node.key if node is not None else None) == (at_least[0] if at_least else None)
+		assert cursor.node is node
+		if node is not None and rnd.random() < 0.3:
+			following = cursor.next()
+			assert (following.key if following is not None else None) == (at_least[1] if len(at_least) > 1 else None)
+	assert AVLTree().cursor(3).node is None
+
+
+def test_stats_count_rotations_promotions_and_paths():
+	tree = AVLTree()
+	stats = tree.enable_stats()
+	for key in (1, 2, 3):  # 3 unbalances 1: one single rotation
+		tree.insert(key, None)
+	assert stats.as_dict() == {
+		"single_rotations": 1,
+		"double_rotations": 0,
+		"promotions": 2,
+		"search_paths": {},
+		"insert_paths": {0: 1, 1: 1, 2: 1},
+		"join_height_diffs": {},
+		"calls": {"insert": 3},
+		"seconds": {},
+	}
+
+
+def test_stats_hook_and_timing():
+	calls = []
+	tree = AVLTree()
+	stats = tree.enable_stats(hook=lambda name, seconds, rotations: calls.append((name, seconds, rotations)))
+	for key in (3, 1, 4, 2):
+		tree.insert(key, None)
+	tree.delete(tree.search(4)[0])  # 3 is left with 1 and its right child 2: one double rotation
+	assert [(name, rotations) for name, _, rotations in calls] == [
+		("insert", 0), ("insert", 0), ("insert", 0), ("insert", 0), ("search", 0), ("delete", 1)]
+	assert all(seconds >= 0 for _, seconds, _ in calls)
+	assert (stats.single_rotations, stats.double_rotations, stats.promotions) == (0, 1, 3)
+	assert stats.search_paths == {2: 1}
+	assert stats.insert_paths == {0: 1, 1: 2, 2: 1}
+	assert dict(stats.calls) == {"insert": 4, "search": 1, "delete": 1}
+	assert set(stats.seconds) == {"insert", "search", "delete"}
+	timed = AVLTree().enable_stats(timing=True)
+	assert timed.timing and timed.hook is None
+
+
+def test_stats_join_heights_and_disable():
+	low = AVLTree.from_sorted((key, None) for key in range(15))  # height 3
+	high = AVLTree.from_sorted([(20, None)])  # height 0
+	stats = low.enable_stats()
+	low.join(high, 16, None)
+	assert stats.join_height_diffs == {3: 1}
+	assert dict(stats.calls) == {"join": 1}
+	left, right = low.split(low.search(2)[0])  # 2 is deep, the path above it is joined back
+	assert stats.calls["split"] == 1 and stats.calls["search"] == 1
+	assert sum(stats.join_height_diffs.values()) > 1  # the joins inside split are counted too
+	assert left.disable_stats() is None  # the parts of a split have no stats
+	before = stats.as_dict()
+	assert low.disable_stats() is stats
+	for name in stats.TRACKED:
+		assert name not in low.__dict__
+		assert getattr(low, name).__func__ is getattr(AVLTree, name)
+	low.insert(1, None)
+	low.search(1)
+	assert stats.as_dict() == before and low.stats is None
+
+
+def test_clock_cache_gives_referenced_keys_a_second_chance():
+	cache = AVLTreeCache(3, "clock")
+	for key in "abc":
+		cache.put(key, key.upper())
+	assert cache.get("a") == "A"  # sets the reference bit of a
+	cache.put("d", "D")  # the hand clears a and evicts b
+	assert sorted(cache.entries) == ["a", "c", "d"]
+	cache.put("e", "E")  # c was never referenced
+	assert sorted(cache.entries) == ["a", "d", "e"]
+	cache.put("f", "F")  # the bit of a was used up by the first pass
+	assert sorted(cache.entries) == ["d", "e", "f"]
+	cache.discard("e")
+	cache.put("g", "G")  # takes the freed slot, nothing is evicted
+	assert sorted(cache.entries) == ["d", "f", "g"]
+	assert cache.get("b") is None
+	assert cache.as_dict() == {"policy": "clock", "capacity": 3, "size": 3, "hits": 1, "misses": 1,
+		"evictions": 3, "hit_ratio": 0.5}
+
+
+def test_lru_cache_evicts_least_recently_used():
+	cache = AVLTreeCache(2)
+	assert cache.hit_ratio() == 0.0
+	cache.put(1, "one")
+	cache.put(2, "two")
+	cache.get(1)
+	cache.put(3, "three")
+	assert list(cache.entries) == [1, 3]
+	assert (cache.hits, cache.misses, cache.evictions) == (1, 0, 1)
+	with pytest.raises(ValueError):
+		AVLTreeCache(0)
+	with pytest.raises(ValueError):
+		AVLTreeCache(4, "fifo")
+
+
+@pytest.mark.parametrize("policy", AVLTreeCache.POLICIES)
+def test_cache_counts_only_the_lookups_of_the_user(policy):
+	tree = make_tree(range(100))
+	cache = tree.enable_cache(16, policy)
+	for key in (5, 5, 200, 7):
+		tree.search(key)
+	tree.finger_search(7)
+	assert (cache.hits, cache.misses) == (2, 3)
+	tree.snapshot()
+	tree.delete(tree.search(50)[0])  # with copy-on-write, delete looks the live node up again
+	tree.insert(5, "new")
+	tree.delete_range(10, 20)
+	assert (cache.hits, cache.misses) == (2, 4)
+	assert cache.hit_ratio() == 2 / 6
+	assert tree.search(5)[0].value == "new" and tree.search(15)[0] is None
+	check_tree(tree)
+	assert tree.disable_cache() is cache and tree.cache is None
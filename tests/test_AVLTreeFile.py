@@ -0,0 +1,61 @@
+import random
+
+import pytest
+
+from AVLArrayTree import AVLArrayTree
+from AVLTree import AVLTree
+import AVLTreeFile
+from treecheck import check_tree
+
+VALUES = [None, "", b"", "a", b"\x00", "é\U0001f600", (1, "two"), [], 0, 3.5, {"k": None}]
+MODES = [("node", False), ("array", False), ("node", True), ("array", True)]
+
+
+@pytest.mark.parametrize("val", VALUES, ids=repr)
+def test_encode_value_round_trip(val):
+	assert AVLTreeFile.decode_value(AVLTreeFile.encode_value(val)) == val
+	assert AVLTreeFile.decode_value(memoryview(AVLTreeFile.encode_value(val))) == val
+
+
+@pytest.mark.parametrize("engine, use_mmap", MODES)
+@pytest.mark.parametrize("source", [AVLTree, AVLArrayTree])
+def test_dump_load_round_trip(tmp_path, source, engine, use_mmap):
+	rnd = random.Random(7)
+	tree = source()
+	items = {}
+	for key in rnd.sample(range(-10 ** 12, 10 ** 12), 500):
+		val = VALUES[key % len(VALUES)]
+		tree.insert(key, val)
+		items[key] = val
+	path = str(tmp_path / "tree.avl")
+	tree.dump(path)
+	loaded = AVLTreeFile.load(path, engine, use_mmap)
+	expected = sorted(items.items())
+	assert list(loaded.items()) == expected
+	assert loaded.size() == len(items)
+	for key, val in expected[::7]:
+		node = loaded.search(key)[0]
+		assert node is not None
+		assert (loaded.get_value(node) if isinstance(loaded, AVLArrayTree) else node.value) == val
+	assert loaded.search(10 ** 13)[0] is None
+	if engine == "node" and not use_mmap:
+		assert check_tree(loaded) == [key for key, _ in expected]
+		loaded.insert(10 ** 13, "")  # a loaded tree is a live tree
+		assert check_tree(loaded)[-1] == 10 ** 13
+
+
+@pytest.mark.parametrize("engine, use_mmap", MODES)
+def test_dump_load_small(tmp_path, engine, use_mmap):
+	path = str(tmp_path / "tree.avl")
+	for items in ([], [(5, "")], [(1, b""), (2, None)]):
+		tree = AVLTree.from_sorted(items)
+		tree.dump(path)
+		loaded = AVLTreeFile.load(path, engine, use_mmap)
+		assert list(loaded.items()) == items
+
+
+def test_load_rejects_other_files(tmp_path):
+	path = tmp_path / "tree.avl"
+	path.write_bytes(b"not a tree")
+	with pytest.raises(ValueError):
+		AVLTreeFile.load(str(path))
@@ -0,0 +1,49 @@
+import random
+
+import pytest
+
+from AVLArrayTree import AVLArrayTree
+import AVLTreeParallel
+from treecheck import check_array_tree, check_tree
+
+
+@pytest.fixture
+def small_ranges(monkeypatch):
+	monkeypatch.setattr(AVLTreeParallel, "MIN_RANGE", 10)  # several ranges on small inputs
+
+
+@pytest.mark.parametrize("n", [0, 1, 2, 31, 100, 1001])
+@pytest.mark.parametrize("workers", [1, 3])
+def test_build_matches_from_sorted(small_ranges, n, workers):
+	items = [(key * 2, str(key)) for key in range(n)]
+	tree = AVLTreeParallel.build(items, "node", workers)
+	assert check_tree(tree) == [key for key, _ in items]
+	assert list(tree.items()) == items
+	tree.insert(-1, "")  # a live tree
+	check_tree(tree)
+	array_tree = AVLTreeParallel.build(items, "array", workers)
+	assert check_array_tree(array_tree) == [key for key, _ in items]
+	assert list(array_tree.items()) == items
+
+
+def test_build_keeps_the_last_of_equal_keys(small_ranges):
+	items = [(0, "a"), (1, "b"), (1, "c"), (2, "d")]
+	assert list(AVLTreeParallel.build(items, "node", 2).items()) == [(0, "a"), (1, "c"), (2, "d")]
+	with pytest.raises(ValueError):
+		AVLTreeParallel.build([(2, None), (1, None)])
+
+
+@pytest.mark.parametrize("engine", ["node", "array"])
+def test_search_pool(engine):
+	rnd = random.Random(1)
+	items = [(key, key * 10) for key in range(0, 600, 3)]
+	tree = AVLTreeParallel.build(items, engine, 1)
+	keys = [rnd.randrange(-10, 610) for _ in range(500)]
+	with AVLTreeParallel.AVLTreeSearchPool(tree, 2) as pool:
+		for _ in range(2):  # a pool answers any number of batches
+			results, found = pool.search_many(keys)
+			assert found == [key % 3 == 0 and 0 <= key < 600 for key in keys]
+			assert results == [key * 10 if hit else None for key, hit in zip(keys, found)]
+		assert pool.search_many([]) == ([], [])
+	assert AVLTreeParallel.search_many(tree, [3, 4], 2) == ([30, None], [True, False])
+	assert isinstance(tree, AVLArrayTree) == (engine == "array")
@@ -0,0 +1,82 @@
+import random
+import threading
+
+from ConcurrentAVLTree import ConcurrentAVLTree
+from treecheck import check_nodes, check_tree
+
+
+def test_readers_see_whole_versions_while_writers_run():
+	tree = ConcurrentAVLTree()
+	tree.insert_many((key, key) for key in range(0, 2000, 2))
+	errors = []
+	done = threading.Event()
+
+	def write(t):
+		rnd = random.Random(t)
+		try:
+			for i in range(300):
+				key = 2000 + 4 * i + t
+				tree.insert(key, key)
+				if rnd.random() < 0.3:
+					tree.delete_many([rnd.randrange(0, 2000, 2)])
+		except Exception as e:
+			errors.append(e)
+
+	def read():
+		try:
+			while not done.is_set():
+				view = tree.snapshot()
+				keys = [node.key for node in check_nodes(view.root)]
+				assert keys == [key for key, _ in view.items()]
+				assert view.size() == len(keys)
+				for key in keys[::97]:
+					assert view.search(key)[0].value == key
+		except Exception as e:
+			errors.append(e)
+
+	writers = [threading.Thread(target=write, args=(t,)) for t in range(4)]
+	readers = [threading.Thread(target=read) for _ in range(2)]
+	for thread in writers + readers:
+		thread.start()
+	for thread in writers:
+		thread.join()
+	done.set()
+	for thread in readers:
+		thread.join()
+	assert not errors
+	keys = check_tree(tree.tree)
+	assert keys == [key for key, _ in tree.items()]
+	assert set(range(2000, 2000 + 4 * 300)) <= set(keys)
+
+
+def test_delete_takes_nodes_of_old_versions():
+	tree = ConcurrentAVLTree()
+	for key in range(50):
+		tree.insert(key, str(key))
+	old = tree.search(10)[0]
+	tree.insert(10, "new")
+	tree.delete(old)
+	assert 10 not in tree and tree.get(11) == "11"
+	assert check_tree(tree.tree) == [key for key in range(50) if key != 10]
+
+
+def test_writes_are_published_on_the_next_read():
+	tree = ConcurrentAVLTree()
+	tree.insert(1, "a")
+	epoch = tree.tree.epoch
+	for key in range(2, 50):  # no read in between: nothing is published, no path is copied
+		tree.insert(key, None)
+	tree.delete_many([3, 4, 1000])
+	assert tree.tree.epoch == epoch and tree.stale
+	view = tree.snapshot()
+	assert not tree.stale and tree.tree.epoch != epoch
+	assert [key for key, _ in view.items()] == [1, 2] + list(range(5, 50))
+	assert tree.snapshot() is view  # no write since, the same version
+	tree.delete_many([1000])  # deletes nothing, the view stays current
+	assert not tree.stale
+	tree.insert(99, None)
+	with tree.batch() as live:  # reads inside a batch see the writes before it, and not its own
+		live.insert(100, None)
+		assert 99 in tree and 100 not in tree
+	assert 100 in tree and tree.get(1) == "a"
+	assert view.search(100)[0] is None  # an older version never changes
@@ -0,0 +1,99 @@
+import os
+import random
+
+import pytest
+
+from DurableAVLTree import LOG, DurableAVLTree, decode_records, encode_record, OP_DELETE, OP_INSERT
+from treecheck import check_tree
+
+VALUES = [None, "", b"", "value", b"\xff", (1, 2), 0]
+
+
+def test_records_round_trip():
+	records = [(OP_INSERT, key, val) for key, val in enumerate(VALUES)] + [(OP_DELETE, 3, None)]
+	data = b"".join(encode_record(op, key, val) for op, key, val in records)
+	assert decode_records(data) == (records, len(data))
+
+
+def test_replay_keeps_empty_values(tmp_path):
+	directory = str(tmp_path / "db")
+	with DurableAVLTree(directory) as tree:
+		for key, val in enumerate(VALUES):
+			tree.insert(key, val)
+	with DurableAVLTree(directory) as tree:
+		assert tree.replayed == len(VALUES)
+		assert list(tree.items()) == list(enumerate(VALUES))
+		assert tree.get(1, "missing") == "" and tree.get(2, "missing") == b""
+
+
+@pytest.mark.parametrize("cut", [1, 5, 12])
+def test_replay_drops_torn_tail(tmp_path, cut):
+	directory = str(tmp_path / "db")
+	with DurableAVLTree(directory) as tree:
+		tree.insert(1, "")
+		tree.insert(2, b"")
+		tree.insert(3, "torn")
+	path = os.path.join(directory, LOG)
+	size = os.path.getsize(path)
+	with open(path, "r+b") as f:
+		f.truncate(size - cut)  # a crash in the middle of the last record
+	with DurableAVLTree(directory) as tree:
+		assert tree.replayed == 2
+		assert list(tree.items()) == [(1, ""), (2, b"")]
+		tree.insert(4, "after")  # appended after the valid records, not after the torn one
+	with DurableAVLTree(directory) as tree:
+		assert list(tree.items()) == [(1, ""), (2, b""), (4, "after")]
+
+
+def test_replay_stops_at_corrupt_record(tmp_path):
+	directory = str(tmp_path / "db")
+	with DurableAVLTree(directory) as tree:
+		tree.insert(1, "a")
+		tree.insert(2, "b")
+	path = os.path.join(directory, LOG)
+	with open(path, "r+b") as f:
+		data = bytearray(f.read())
+		data[-1] ^= 0xFF
+		f.seek(0)
+		f.write(data)
+	with DurableAVLTree(directory) as tree:
+		assert list(tree.items()) == [(1, "a")]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_recovery_matches_dict(tmp_path, seed):
+	rnd = random.Random(seed)
+	directory = str(tmp_path / "db")
+	expected = {}
+	tree = DurableAVLTree(directory, sync_every=rnd.choice([1, 7, 100]), checkpoint_every=rnd.choice([None, 150]))
+	for step in range(600):
+		r = rnd.random()
+		if r < 0.3:  # appends, replayed as joined runs
+			key = max(expected, default=0) + rnd.randrange(1, 4)
+			val = rnd.choice(VALUES)
+			tree.insert(key, val)
+			expected[key] = val
+		elif r < 0.6:
+			key = rnd.randrange(1000)
+			val = rnd.choice(VALUES)
+			tree.insert(key, val)
+			expected[key] = val
+		elif r < 0.7:
+			pairs = sorted({rnd.randrange(1000): rnd.choice(VALUES) for _ in range(10)}.items())
+			tree.insert_many(pairs)
+			expected.update(pairs)
+		elif r < 0.95:
+			node = tree.search(rnd.randrange(1000))[0]
+			if node is not None:
+				del expected[node.key]
+			tree.delete(node)
+		else:
+			tree.checkpoint()
+		if step % 150 == 0:  # reopen, replaying what was logged since the last checkpoint
+			tree.close()
+			tree = DurableAVLTree(directory)
+			assert list(tree.items()) == sorted(expected.items())
+	tree.close()
+	with DurableAVLTree(directory) as tree:
+		assert check_tree(tree.tree) == sorted(expected)
+		assert list(tree.items()) == sorted(expected.items())
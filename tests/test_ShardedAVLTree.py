@@ -0,0 +1,146 @@
+import random
+import threading
+
+import pytest
+
+from ShardedAVLTree import ShardedAVLTree
+
+
+@pytest.fixture
+def sharded():
+	trees = []
+
+	def make(*args, **kwargs):
+		tree = ShardedAVLTree(*args, **kwargs)
+		trees.append(tree)
+		return tree
+
+	yield make
+	for tree in trees:
+		tree.close()
+
+
+def test_bounds_must_increase():
+	with pytest.raises(ValueError):
+		ShardedAVLTree([5, 5])
+
+
+def test_from_sorted(sharded):
+	items = [(key, str(key)) for key in range(0, 300, 3)]
+	tree = ShardedAVLTree.from_sorted(items, shards=4)
+	try:
+		assert len(tree.shards) == 4
+		assert tree.items() == items
+		assert tree.items(10, 40) == [(key, val) for key, val in items if 10 <= key <= 40]
+	finally:
+		tree.close()
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_matches_dict_through_splits_and_merges(sharded, seed):
+	rnd = random.Random(seed)
+	expected = {key: key * 2 for key in rnd.sample(range(1000), 200)}
+	tree = sharded([250, 500, 750], sorted(expected.items()))
+	for step in range(300):
+		r = rnd.random()
+		key = rnd.randrange(1000)
+		if r < 0.3:
+			assert tree.insert(key, step) == (key not in expected)
+			expected[key] = step
+		elif r < 0.4:
+			pairs = [(rnd.randrange(1000), step) for _ in range(20)]
+			new = len({key for key, _ in pairs} - set(expected))
+			assert tree.insert_many(pairs) == new
+			expected.update(pairs)
+		elif r < 0.55:
+			assert tree.delete(key) == (key in expected)
+			expected.pop(key, None)
+		elif r < 0.6:
+			keys = [rnd.randrange(1000) for _ in range(20)]
+			gone = {key for key in keys if key in expected}
+			assert tree.delete_many(keys) == len(gone)
+			for key in gone:
+				del expected[key]
+		elif r < 0.75:
+			assert tree.get(key, "missing") == expected.get(key, "missing")
+			assert (key in tree) == (key in expected)
+		elif r < 0.85:
+			keys = [rnd.randrange(1000) for _ in range(30)]
+			results, found = tree.search_many(keys)
+			assert found == [key in expected for key in keys]
+			assert results == [expected.get(key) for key in keys]
+		elif r < 0.93:
+			i = rnd.randrange(len(tree.shards))
+			shard = tree.shards[i]
+			inside = [k for k in expected if (shard.lo is None or k >= shard.lo) and (shard.hi is None or k < shard.hi)]
+			split_key = rnd.choice(sorted(inside)[1:]) if len(inside) > 1 and rnd.random() < 0.5 else None
+			tree.split_shard(i, split_key)
+		elif len(tree.shards) > 1:
+			tree.merge_shards(rnd.randrange(len(tree.shards) - 1))
+		assert tree.bounds == [shard.lo for shard in tree.shards[1:]]
+		assert [shard.hi for shard in tree.shards[:-1]] == tree.bounds
+	assert tree.items() == sorted(expected.items())
+	assert tree.keys(300, 600) == sorted(key for key in expected if 300 <= key <= 600)
+	assert len(tree) == len(expected)
+	assert sum(record["keys"] for record in tree.shard_stats()) == len(expected)
+
+
+def test_rebalance_splits_hot_and_merges_cold(sharded):
+	tree = sharded([100, 200, 300], [(key, None) for key in range(400)])
+	for key in range(100):
+		tree.get(key)
+	splits, merges = tree.rebalance(hot=2.0, cold=0.5)
+	assert (splits, merges) == (1, 2)  # shard 0 is split, the three idle ones become one
+	assert [shard.lo for shard in tree.shards] == [None, 50, 100]
+	assert tree.keys() == list(range(400))
+
+
+def test_split_shard_rejects_key_outside(sharded):
+	tree = sharded([100], [(key, None) for key in range(200)])
+	with pytest.raises(ValueError):
+		tree.split_shard(0, 150)
+
+
+def test_busy_shard_does_not_hold_up_others(sharded):
+	tree = sharded([100], [(key, key) for key in range(200)])
+	busy = tree.shards[0]
+	busy.lock.acquire()  # as if shard 0 were serving a long request
+	try:
+		waiting = threading.Thread(target=tree.get, args=(5,), daemon=True)
+		waiting.start()
+		waiting.join(0.2)
+		answer = []
+		other = threading.Thread(target=lambda: answer.append(tree.get(150)), daemon=True)
+		other.start()
+		other.join(10)
+		assert answer == [150]
+	finally:
+		busy.lock.release()
+	waiting.join(10)
+	assert not waiting.is_alive()
+
+
+def test_requests_during_rebalance(sharded):
+	tree = sharded([500], [])
+	errors = []
+
+	def insert(first):
+		try:
+			for key in range(first, 1000, 4):
+				tree.insert(key, -key)
+				assert tree.get(key) == -key
+		except Exception as e:
+			errors.append(e)
+
+	threads = [threading.Thread(target=insert, args=(first,)) for first in range(4)]
+	for thread in threads:
+		thread.start()
+	while any(thread.is_alive() for thread in threads):
+		tree.split_shard(len(tree.shards) - 1)  # moves the range the inserts go to
+		if len(tree.shards) > 3:
+			tree.merge_shards(0)
+	for thread in threads:
+		thread.join()
+	assert not errors
+	assert tree.items() == [(key, -key) for key in range(1000)]
+	assert tree.size() == 1000
@@ -0,0 +1,157 @@
+"""Invariant checks and helpers shared by the tests."""
+import sys
+import types
+
+import pytest
+
+
+"""checks the structure of a subtree by its child links only, as a snapshot sees it
+@rtype: list
+@returns: the nodes in key order
+"""
+def check_nodes(root, augment=None):
+	nodes = []
+	if root is None or not root.is_real_node():
+		return nodes
+	# (node, lower bound, upper bound, children done)
+	stack = [(root, None, None, False)]
+	while stack:
+		node, lo, hi, done = stack.pop()
+		if not done:
+			assert lo is None or node.key > lo, ("order", node.key, lo)
+			assert hi is None or node.key < hi, ("order", node.key, hi)
+			stack.append((node, lo, hi, True))
+			if node.right.is_real_node():
+				stack.append((node.right, node.key, hi, False))
+			if node.left.is_real_node():
+				stack.append((node.left, lo, node.key, False))
+			continue
+		left, right = node.left, node.right
+		assert abs(left.height - right.height) <= 1, ("balance", node.key, left.height, right.height)
+		assert node.height == max(left.height, right.height) + 1, ("height", node.key)
+		assert node.size == left.size + right.size + 1, ("size", node.key)
+		if augment is not None:
+			agg = augment.project(node.key, node.value)
+			if left.is_real_node():
+				agg = augment.combine(left.agg, agg)
+			if right.is_real_node():
+				agg = augment.combine(agg, right.agg)
+			assert node.agg == agg, ("aggregate", node.key)
+	nodes = []
+	stack = []
+	curr = root
+	while stack or curr.is_real_node():
+		while curr.is_real_node():
+			stack.append(curr)
+			curr = curr.left
+		curr = stack.pop()
+		nodes.append(curr)
+		curr = curr.right
+	return nodes
+
+
+"""checks every invariant of a live AVLTree: order, balance, heights, sizes, aggregates,
+parent pointers, in-order links and min / max
+@rtype: list
+@returns: the keys in order
+"""
+def check_tree(tree):
+	root = tree.root
+	nodes = check_nodes(root, tree.augment)
+	if not nodes:
+		assert root is None or not root.is_real_node()
+		assert tree.min is None and tree.max is None
+		assert tree.size() == 0
+		return []
+	assert root.parent is None, "the root has a parent"
+	for node in nodes:
+		for child in (node.left, node.right):
+			if child.is_real_node():
+				assert child.parent is node, ("parent", child.key, node.key)
+	for a, b in zip(nodes, nodes[1:]):
+		assert a.next is b and b.prev is a, ("links", a.key, b.key)
+	assert nodes[0].prev is None and nodes[-1].next is None, "the links go past the ends"
+	assert tree.min is nodes[0] and tree.max is nodes[-1], "min / max"
+	assert tree.size() == len(nodes)
+	return [node.key for node in nodes]
+
+
+"""checks a snapshot against the items it was taken with"""
+def check_snapshot(snapshot, items):
+	nodes = check_nodes(snapshot.root, snapshot.augment)
+	assert [(node.key, node.value) for node in nodes] == items
+	assert list(snapshot.items()) == items
+
+
+"""checks every invariant of an AVLArrayTree in its buffers: order, balance, heights, sizes,
+parent links and min / max
+@rtype: list
+@returns: the keys in order
+"""
+def check_array_tree(tree):
+	s = tree.store
+	K, H, S, L, R, P = s.keys, s.heights, s.sizes, s.lefts, s.rights, s.parents
+	if not tree.root:
+		assert tree.min == 0 and tree.max == 0 and tree.size() == 0
+		return []
+	assert P[tree.root] == 0, "the root has a parent"
+	order = []
+	stack = []
+	curr = tree.root
+	while stack or curr:
+		while curr:
+			stack.append(curr)
+			curr = L[curr]
+		curr = stack.pop()
+		order.append(curr)
+		curr = R[curr]
+	for node in order:
+		left, right = L[node], R[node]
+		assert abs(H[left] - H[right]) <= 1, ("balance", K[node])
+		assert H[node] == max(H[left], H[right]) + 1, ("height", K[node])
+		assert S[node] == S[left] + S[right] + 1, ("size", K[node])
+		for child in (left, right):
+			if child:
+				assert P[child] == node, ("parent", K[child], K[node])
+	keys = [K[node] for node in order]
+	assert keys == sorted(set(keys)), "order"
+	assert tree.min == order[0] and tree.max == order[-1], "min / max"
+	assert tree.size() == len(order)
+	return keys
+
+
+"""the part of the numpy.ndarray interface that search_many uses, for running its array path
+without NumPy"""
+
+class FakeArray(object):
+
+	def __init__(self, values):
+		self.values = list(values)
+
+	def argsort(self, kind="quicksort"):
+		assert kind == "stable", "equal keys must keep their order"
+		return FakeArray(sorted(range(len(self.values)), key=self.values.__getitem__))
+
+	def tolist(self):
+		return list(self.values)
+
+
+"""returns keys as an array for search_many: a NumPy array, skipping the test without NumPy,
+or a FakeArray with a stand-in numpy module for the conversion of the found flags
+@type kind: str
+@param kind: "numpy" or "fake"
+@rtype: (array, function)
+@returns: the array and a function turning the found flags returned by search_many into a list
+"""
+def array_keys(kind, keys, monkeypatch):
+	if kind == "numpy":
+		numpy = pytest.importorskip("numpy")
+		return numpy.array(keys, dtype=numpy.int64), lambda found: found.tolist()
+	fake = types.ModuleType("numpy")
+	fake.array = lambda values, dtype=None: ("array", [dtype(value) for value in values])
+	monkeypatch.setitem(sys.modules, "numpy", fake)
+
+	def flags(found):
+		assert found[0] == "array", "found was not converted to an array"
+		return found[1]
+	return FakeArray(keys), flags